@@ -0,0 +1,280 @@
+## @package BatchRunner
+# Contains the batch runner used to run many independent simulation episodes
+# (one pod in one world) in parallel on a pool of worker processes.
+#
+# Each worker loads a world file once and reuses it for every episode it runs
+# in that world. Results are streamed back to the caller as soon as each
+# chunk of episodes finishes.
+#
+# Example:
+#
+# episodes = [Episode('world.txt', params={'angle_prop_gain': g}) for g in gains]
+# for result in run_episodes(episodes):
+#     print result.index, result.min_distance
+import importlib
+import math
+import multiprocessing
+import time
+
+from Controllers import PDController
+from simulation import GravityPod
+from simulation import HeadlessSimulation
+from WorldCache import load_world
+
+try:
+    ## The types a dotted class name may have (str or unicode, for names read
+    # back from JSON)
+    string_types = basestring
+except NameError:
+    ## The types a dotted class name may have
+    string_types = str
+
+## Episode Specification
+#
+# Describes one episode. Classes may be given directly or as dotted names
+# (e.g. 'Controllers.RuleController'); either way they must be importable by
+# the worker processes.
+class Episode:
+    ## The Episode constructor
+    #
+    # @param self The object pointer
+    # @param world_file The world file to run in
+    # @param pod_class The pod class (e.g. simulation.GravityPod)
+    # @param controller_class The controller class (any class in Controllers)
+    # @param params A dictionary of controller attributes to set before the
+    # episode starts (e.g. gains or rule thresholds)
+    # @param start A dictionary of pod attributes (x, y, dxdt, dydt, ang,
+    # dangdt) to set after the pod is placed at the world's start position
+    # @param ticks The maximum number of ticks to run
+    # @param target The (x, y) target coordinates given to the controller. If
+    # None, the centre of the world's end wall is used.
+    # @param stop_radius If set, the episode stops once the pod is within this
+    # distance of the target
+    # @param dt The simulation timestep
+    # @param n_sensors The number of sensors on the pod
+    # @param sensor_range The range of the sensors
+    # @param tag Any picklable value, returned unchanged in the result
+    def __init__(self, world_file, pod_class=GravityPod, controller_class=PDController,
+                 params=None, start=None, ticks=1000, target=None, stop_radius=None,
+                 dt=0.1, n_sensors=40, sensor_range=1000, tag=None):
+        self.world_file = world_file
+        self.pod_class = pod_class
+        self.controller_class = controller_class
+        self.params = params or {}
+        self.start = start or {}
+        self.ticks = ticks
+        self.target = target
+        self.stop_radius = stop_radius
+        self.dt = dt
+        self.n_sensors = n_sensors
+        self.sensor_range = sensor_range
+        self.tag = tag
+
+## Episode Result
+#
+# The outcome of one episode, as returned by the workers.
+class EpisodeResult:
+    ## The EpisodeResult constructor
+    #
+    # @param self The object pointer
+    # @param index The position of the episode in the list passed to
+    # run_episodes()
+    # @param episode The Episode that was run
+    # @param pod The pod at the end of the episode
+    # @param stats The simulation.RunStats of the run
+    # @param tracker The TargetTracker used during the run
+    def __init__(self, index, episode, pod, stats, tracker):
+        self.index = index
+        self.tag = episode.tag
+        self.x = pod.x
+        self.y = pod.y
+        self.dxdt = pod.dxdt
+        self.dydt = pod.dydt
+        self.ang = pod.ang
+        self.ticks = stats.ticks
+        self.collisions = stats.collisions
+        self.wall_time = stats.wall_time
+        self.target = tracker.target
+        self.final_distance = tracker.distance
+        self.min_distance = tracker.min_distance
+        self.mean_distance = tracker.total_distance / max(tracker.samples, 1)
+        ## True if the pod came within the episode's stop radius
+        self.reached = stats.stopped
+
+## Episode Brain
+#
+# The brain given to the pod in an episode. It sets a fixed target on the state
+# and passes it to the controller, like MainController does without the
+# navigator and the keyboard.
+class EpisodeBrain:
+    ## The EpisodeBrain constructor
+    #
+    # @param self The object pointer
+    # @param controller The controller to run
+    # @param target The (x, y) target coordinates
+    def __init__(self, controller, target):
+        self.controller = controller
+        self.target = target
+
+    ## The process function for the EpisodeBrain
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects.
+    # @param state The current state of the pod.
+    # @param dt The timestep used by the simulator.
+    # @return A Control object from the controller
+    def process(self, sensor, state, dt):
+        (state.target_x, state.target_y) = self.target
+        return self.controller.process(sensor, state, dt)
+
+## Target Tracker
+#
+# Used as the until predicate of the headless run. It records how close the
+# first pod gets to the target, and stops the run inside the stop radius.
+class TargetTracker:
+    ## The TargetTracker constructor
+    #
+    # @param self The object pointer
+    # @param target The (x, y) target coordinates
+    # @param stop_radius The stop radius, or None to never stop
+    def __init__(self, target, stop_radius):
+        self.target = target
+        self.stop_radius = stop_radius
+        self.distance = None
+        self.min_distance = None
+        self.total_distance = 0.0
+        self.samples = 0
+
+    ## Updates the distances
+    #
+    # @param self The object pointer
+    # @param world The world being run
+    # @return True if the run should stop
+    def __call__(self, world):
+        pod = world.pods[0]
+        self.distance = math.hypot(pod.x - self.target[0], pod.y - self.target[1])
+        if self.min_distance == None or self.distance < self.min_distance:
+            self.min_distance = self.distance
+        self.total_distance += self.distance
+        self.samples += 1
+        return self.stop_radius != None and self.distance <= self.stop_radius
+
+## Resolves a class given as a class or as a dotted name
+#
+# @param cls A class, or a string such as 'Controllers.PDController'
+# @return The class
+def resolve(cls):
+    if not isinstance(cls, string_types):
+        return cls
+    (module, name) = str(cls).rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+## Finds the default target of a world
+#
+# @param world A World
+# @return The centre of the first wall with "end" in its name, or the pod
+# start position if there is none
+def end_target(world):
+    for wall in world.walls:
+        if "end" in wall.name:
+            return ((wall.minX + wall.maxX) / 2.0, (wall.minY + wall.maxY) / 2.0)
+    return world.pod_start
+
+## The worlds loaded by this process, keyed by file name
+world_cache = {}
+
+## Loads a world, reusing the copy already loaded by this process
+#
+# @param world_file The world file to load
+# @return A World with no pods
+#
+# The world is loaded through WorldCache, so only the first process to load
+# a world file parses it.
+def cached_world(world_file):
+    if world_file not in world_cache:
+        world_cache[world_file] = load_world(world_file, [])
+    return world_cache[world_file]
+
+## Runs one episode in the current process
+#
+# @param episode The Episode to run
+# @param index The position of the episode in its batch
+# @return An EpisodeResult
+def run_episode(episode, index=0):
+    world = cached_world(episode.world_file)
+    target = episode.target
+    if target == None:
+        target = end_target(world)
+
+    controller = resolve(episode.controller_class)()
+    for (name, value) in episode.params.items():
+        setattr(controller, name, value)
+
+    pod_class = resolve(episode.pod_class)
+    pod = pod_class(episode.n_sensors, episode.sensor_range, EpisodeBrain(controller, target), (255, 0, 0))
+    pod.place(*world.pod_start)
+    for (name, value) in episode.start.items():
+        setattr(pod, name, value)
+
+    world.pods = [pod]
+    world.ticks = 0
+    tracker = TargetTracker(target, episode.stop_radius)
+    tracker(world)
+    stats = HeadlessSimulation(world, episode.dt).run(ticks=episode.ticks, until=tracker)
+    return EpisodeResult(index, episode, pod, stats, tracker)
+
+## Pool task wrapper for run_episode()
+#
+# @param task A tuple (index, episode)
+# @return An EpisodeResult
+def run_task(task):
+    return run_episode(task[1], task[0])
+
+## Runs a list of episodes on a process pool
+#
+# @param episodes A list of Episode objects
+# @param processes The number of worker processes (default: one per core).
+# If 1, the episodes are run in the calling process.
+# @param chunksize The number of episodes sent to a worker at a time. The
+# default gives each worker about four chunks.
+# @param pool A multiprocessing.Pool to run the episodes on, or None to
+# create one for this batch. A pool passed in is left running, so its
+# workers keep the worlds they have loaded for the next batch.
+# @return A generator yielding an EpisodeResult for each episode, in the
+# order they finish. Use EpisodeResult.index to match them to the episodes.
+def run_episodes(episodes, processes=None, chunksize=None, pool=None):
+    tasks = list(enumerate(episodes))
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    if chunksize == None:
+        chunksize = max(1, len(tasks) // (processes * 4))
+
+    if pool != None:
+        for result in pool.imap_unordered(run_task, tasks, chunksize):
+            yield result
+        return
+
+    if processes == 1:
+        for task in tasks:
+            yield run_task(task)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(run_task, tasks, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+## Runs a list of episodes on a process pool and waits for them all
+#
+# @param episodes A list of Episode objects
+# @param processes The number of worker processes
+# @param chunksize The number of episodes sent to a worker at a time
+# @return A tuple (results, wall_time) where results is a list of
+# EpisodeResult objects in the same order as episodes
+def run_batch(episodes, processes=None, chunksize=None):
+    start = time.time()
+    results = sorted(run_episodes(episodes, processes, chunksize), key=lambda result: result.index)
+    return (results, time.time() - start)
@@ -0,0 +1,315 @@
+## @package Benchmarks
+# Contains the benchmark suite for the simulation's hot paths.
+#
+# Each world is run through three repeatable, headless scenarios:
+#
+# - ticks - a simulation.GravityPod flies towards the world's end wall for a
+#   fixed number of ticks, reading every sensor each tick through a
+#   WallDodgers.WallDodger. The ray casts and collision checks made are
+#   counted as it runs.
+# - rays - a fixed, seeded set of sensor rays is cast from random points in
+#   the world.
+# - collisions - a fixed, seeded set of short moves is checked against the
+#   walls.
+#
+# and the peak memory used to load the world and run it is measured. Rates
+# are the best of several repeats, to reduce the noise from other processes.
+#
+# The worlds are the bundled world files and stress worlds made by
+# WorldGenerators with a range of kinds and segment counts. Results can be
+# saved as a baseline JSON file, and later runs compared to it: any rate that
+# falls (or memory use that rises) by more than the tolerance is reported as a
+# regression.
+#
+# Example:
+#
+# python Benchmarks.py --save-baseline bench_baseline.json
+# python Benchmarks.py --baseline bench_baseline.json
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from BatchRunner import end_target
+from Controllers import PDController
+from WallDodgers import WallDodger
+from WorldCache import load_world
+from WorldGenerators import world_file
+from simulation import GravityPod
+from simulation import HeadlessSimulation
+
+## The bundled world files
+BUNDLED_WORLDS = ['world.txt', 'rect_world.txt', 'small_rect_world.txt', 'freefall_world.txt', 'huge_world.txt']
+
+## The (kind, segment count) of each default stress world (see
+# @ref WorldGenerators)
+STRESS_WORLDS = [('obstacles', 1000), ('obstacles', 10000), ('obstacles', 100000),
+                 ('maze', 10000), ('caves', 10000), ('corridors', 10000)]
+
+## The metrics where a higher value is better
+RATE_METRICS = ['ticks_per_sec', 'rays_per_sec', 'collision_checks_per_sec', 'tick_rays_per_sec',
+                'tick_collision_checks_per_sec']
+
+## The metrics where a lower value is better
+COST_METRICS = ['peak_memory_kb']
+
+## Scenario Brain
+#
+# Reads every sensor through a WallDodger and then flies to the target with a
+# PDController.
+class ScenarioBrain:
+    ## The ScenarioBrain constructor
+    #
+    # @param self The object pointer
+    # @param target The (x, y) target coordinates
+    def __init__(self, target):
+        self.target = target
+        self.dodger = WallDodger(20)
+        self.controller = PDController()
+
+    ## The process function for the ScenarioBrain
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects.
+    # @param state The current state of the pod.
+    # @param dt The timestep used by the simulator.
+    # @return A Control object from the controller
+    def process(self, sensor, state, dt):
+        (state.target_x, state.target_y) = self.target
+        state = self.dodger.process(sensor, state, dt)
+        return self.controller.process(sensor, state, dt)
+
+## Call Counter
+#
+# Counts the ray casts and collision checks made through a world, by
+# replacing the world's query functions with counting versions.
+class CallCounter:
+    ## The CallCounter constructor
+    #
+    # @param self The object pointer
+    # @param world The World to count the queries of
+    def __init__(self, world):
+        ## The number of rays cast
+        self.rays = 0
+        ## The number of moves checked for collisions
+        self.checks = 0
+        cast_rays = world.cast_rays
+        find_closest_intersects = world.find_closest_intersects
+        check_collisions = world.check_collisions
+        check_collide_with_wall = world.check_collide_with_wall
+
+        def count_cast_rays(p0_x, p0_y, p1_x, p1_y, last=None):
+            self.rays += np.size(p1_x)
+            return cast_rays(p0_x, p0_y, p1_x, p1_y, last)
+
+        def count_find_closest_intersects(p0_x, p0_y, p1_xs, p1_ys):
+            self.rays += len(p1_xs)
+            return find_closest_intersects(p0_x, p0_y, p1_xs, p1_ys)
+
+        def count_check_collisions(p0_x, p0_y, p1_x, p1_y):
+            self.checks += np.size(p1_x)
+            return check_collisions(p0_x, p0_y, p1_x, p1_y)
+
+        def count_check_collide_with_wall(p0_x, p0_y, p1_x, p1_y):
+            self.checks += 1
+            return check_collide_with_wall(p0_x, p0_y, p1_x, p1_y)
+
+        world.cast_rays = count_cast_rays
+        world.find_closest_intersects = count_find_closest_intersects
+        world.check_collisions = count_check_collisions
+        world.check_collide_with_wall = count_check_collide_with_wall
+
+## Runs the ticks scenario
+#
+# @param world_file The world file
+# @param ticks The number of ticks
+# @return A dictionary of metrics
+def bench_ticks(world_file, ticks):
+    world = load_world(world_file, [])
+    counter = CallCounter(world)
+    pod = GravityPod(40, 1000, ScenarioBrain(end_target(world)), (255, 0, 0))
+    pod.place(*world.pod_start)
+    world.pods = [pod]
+    stats = HeadlessSimulation(world, 0.1).run(ticks=ticks)
+    wall_time = max(stats.wall_time, 1e-9)
+    return {'ticks_per_sec': stats.ticks / wall_time, 'tick_rays_per_sec': counter.rays / wall_time,
+            'tick_collision_checks_per_sec': counter.checks / wall_time,
+            'rays_per_tick': float(counter.rays) / stats.ticks, 'collisions': stats.collisions}
+
+## Finds a seeded set of random points in a world
+#
+# @param world The World
+# @param n The number of points
+# @param seed The random seed
+# @return A tuple (xs, ys) of arrays
+def random_points(world, n, seed):
+    rng = np.random.RandomState(seed)
+    rect = world.rect
+    return (rng.uniform(rect.left, rect.right, n), rng.uniform(rect.top, rect.bottom, n))
+
+## Runs the rays scenario
+#
+# @param world_file The world file
+# @param n The number of rays
+# @param seed The random seed
+# @return A dictionary of metrics
+#
+# The rays are cast 40 at a time from each point, as a pod casts them.
+def bench_rays(world_file, n, seed=1):
+    world = load_world(world_file, [])
+    (xs, ys) = random_points(world, n // 40, seed)
+    ang = np.arange(40) * 2 * math.pi / 40
+    start = time.time()
+    for (x, y) in zip(xs.tolist(), ys.tolist()):
+        world.cast_rays(x, y, x + 1000 * np.sin(ang), y + 1000 * np.cos(ang))
+    return {'rays_per_sec': 40 * len(xs) / max(time.time() - start, 1e-9)}
+
+## Runs the collisions scenario
+#
+# @param world_file The world file
+# @param n The number of moves
+# @param seed The random seed
+# @return A dictionary of metrics
+#
+# The moves are up to 10 px long (about one tick of a fast pod) and checked
+# one at a time, as simulation.GravityPod checks them.
+def bench_collisions(world_file, n, seed=2):
+    world = load_world(world_file, [])
+    (xs, ys) = random_points(world, n, seed)
+    rng = np.random.RandomState(seed + 1)
+    (dxs, dys) = (rng.uniform(-10, 10, n), rng.uniform(-10, 10, n))
+    start = time.time()
+    for (x, y, dx, dy) in zip(xs.tolist(), ys.tolist(), dxs.tolist(), dys.tolist()):
+        world.check_collide_with_wall(x, y, x + dx, y + dy)
+    return {'collision_checks_per_sec': n / max(time.time() - start, 1e-9)}
+
+## Measures the peak memory used to load and run a world
+#
+# @param world_file The world file
+# @param ticks The number of ticks to run
+# @return A dictionary of metrics. The peak is measured with tracemalloc
+# where it is available, and is otherwise the process's peak resident size
+# (which never falls, so only the largest world is measured accurately).
+def bench_memory(world_file, ticks):
+    if tracemalloc == None:
+        import resource
+        bench_ticks(world_file, ticks)
+        return {'peak_memory_kb': float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)}
+
+    tracemalloc.start()
+    try:
+        bench_ticks(world_file, ticks)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'peak_memory_kb': peak / 1024.0}
+
+## Runs every scenario on one world
+#
+# @param world_file The world file
+# @param ticks The number of ticks in the ticks scenario
+# @param rays The number of rays in the rays scenario
+# @param moves The number of moves in the collisions scenario
+# @param repeats The number of times each scenario is run
+# @return A dictionary of metrics, taking the best rate of the repeats
+def bench_world(world_file, ticks=500, rays=20000, moves=5000, repeats=3):
+    load_world(world_file, [])     # Compile the world before timing it.
+    result = {}
+    for i in range(repeats):
+        for metrics in (bench_ticks(world_file, ticks), bench_rays(world_file, rays),
+                        bench_collisions(world_file, moves)):
+            for (name, value) in metrics.items():
+                if name in RATE_METRICS:
+                    value = max(value, result.get(name, value))
+                result[name] = value
+    result.update(bench_memory(world_file, min(ticks, 100)))
+    return result
+
+## Compares results to a baseline
+#
+# @param results A dictionary of metric dictionaries, by world name
+# @param baseline A dictionary in the same form
+# @param tolerance The fractional change allowed before a metric counts as
+# a regression
+# @return A list of strings describing each regression
+def compare(results, baseline, tolerance=0.1):
+    regressions = []
+    for (world, metrics) in sorted(results.items()):
+        base = baseline.get(world)
+        if base == None:
+            continue
+        for name in RATE_METRICS + COST_METRICS:
+            if name not in metrics or name not in base or base[name] <= 0:
+                continue
+            change = metrics[name] / base[name] - 1
+            if (name in RATE_METRICS and change < -tolerance) or (name in COST_METRICS and change > tolerance):
+                regressions.append("%s %s: %.4g -> %.4g (%+.1f%%)" % (world, name, base[name], metrics[name], 100 * change))
+    return regressions
+
+## Formats results as a table
+#
+# @param results A dictionary of metric dictionaries, by world name
+# @return A string with one line per world
+def report(results):
+    lines = ["%-28s %10s %12s %12s %12s %10s" % ('world', 'ticks/s', 'rays/s', 'checks/s', 'rays/tick', 'peak KB')]
+    for (world, metrics) in sorted(results.items()):
+        lines.append("%-28s %10.0f %12.0f %12.0f %12.1f %10.0f" %
+                     (world, metrics['ticks_per_sec'], metrics['rays_per_sec'], metrics['collision_checks_per_sec'],
+                      metrics['rays_per_tick'], metrics['peak_memory_kb']))
+    return "\n".join(lines)
+
+## Runs the benchmark suite
+#
+# @param worlds A list of world files
+# @param stress A list of (kind, segment count) of the stress worlds
+# @param ticks The number of ticks in the ticks scenario
+# @param repeats The number of times each scenario is run
+# @return A dictionary of metric dictionaries, by world name
+def run_benchmarks(worlds=BUNDLED_WORLDS, stress=STRESS_WORLDS, ticks=500, repeats=3):
+    files = [(os.path.basename(world), world) for world in worlds]
+    files += [('%s-%d' % (kind, n), world_file(kind, n)) for (kind, n) in stress]
+    results = {}
+    for (name, filename) in files:
+        results[name] = bench_world(filename, ticks, repeats=repeats)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the simulation on the bundled and stress worlds.')
+    parser.add_argument('worlds', nargs='*', default=BUNDLED_WORLDS, help='the world files to run')
+    parser.add_argument('--stress', default=','.join('%s:%d' % world for world in STRESS_WORLDS),
+                        help='comma-separated KIND:SEGMENTS of the stress worlds (empty for none)')
+    parser.add_argument('--ticks', type=int, default=500, help='the length of the ticks scenario')
+    parser.add_argument('--repeats', type=int, default=3, help='the number of runs of each scenario')
+    parser.add_argument('--baseline', help='a baseline file to compare the results to')
+    parser.add_argument('--save-baseline', help='save the results as a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the fractional slow down allowed before a regression is reported')
+    args = parser.parse_args()
+
+    stress = [(spec.split(':')[0].strip(), int(spec.split(':')[1])) for spec in args.stress.split(',') if spec.strip() != '']
+    results = run_benchmarks(args.worlds, stress, args.ticks, args.repeats)
+    print(report(results))
+
+    if args.save_baseline:
+        out = open(args.save_baseline, 'w')
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'results': results},
+                  out, indent=4, sort_keys=True)
+        out.close()
+
+    if args.baseline:
+        regressions = compare(results, json.load(open(args.baseline, 'r'))['results'], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions against " + args.baseline)
@@ -8,10 +8,54 @@
 #
 # This function returns a Control object that instructs the pod how to fire its
 # thrusters.
+#
+# A controller may also implement the batched equivalent used by the pod batches
+# in PodBatches:
+#
+# process_batch(self, sensor, state, dt)
+#
+# where state is a PodBatches.BatchState with target_x and target_y arrays
+# added. This function returns a PodBatches.BatchControl holding the same
+# instructions process() would give for each pod. Any of the controller's
+# constants may be replaced with an array holding one value per pod (for
+# example to sweep a gain across a batch), but process() then no longer works.
+# The rule controllers compile their rules for process_batch() once, and again
+# whenever one of their attributes is set.
+# Running this module checks that process_batch() gives exactly the
+# instructions of process() for each controller (see check_process_batch()).
 
 import math
+import sys
+
+import numpy as np
 
+from PodBatches import BatchControl
+from PodBatches import BatchState
+from PodBatches import GravityPodBatch
+from PodBatches import PodRow
 from simulation import Control
+from simulation import State
+
+## Compiles the rules of RuleController for a batch of pods
+#
+# @param rules The RuleController or TestRuleController holding the constants
+# @param error_limit If not None, the position errors are limited to this
+# size before the rules are applied
+# @return A function taking the arrays (target_x, target_y, x, y, ang, dxdt,
+# dydt, dangdt) and returning a tuple (up, left, right) of the unlimited
+# thruster instructions
+#
+# The rules are compiled from the controller's current constants by
+# RuleTables, which writes each if/elif chain of the process() functions as
+# a nested np.where(), evaluated in the same order, so every pod gets exactly
+# the result of process().
+def compile_batch_rules(rules, error_limit=None):
+    # RuleTables imports this module, so it can only be imported once this
+    # module has loaded
+    from RuleTables import compile_rule_table
+    from RuleTables import rule_table
+
+    return compile_rule_table(rule_table(rules, error_limit))[1]
 
 ## Rule-Based Controller
 #
@@ -65,6 +109,36 @@ class TestRuleController:
         ## The angle the controller aims for to move the pod sidewise
         self.propel_angle = 0.1
 
+        ## The Angle Control Equation's proportional gain
+        self.angle_prop_gain = 22.0974
+        ## The Angle Control Equation's differential gain
+        self.angle_diff_gain = 43.3479
+
+        ## The rules compiled for process_batch() from the constants above, or
+        # None until it is next called. Setting any attribute clears them, so an
+        # array changed in place must be set again.
+        self.batch_rules = None
+
+    ## Sets an attribute, clearing the compiled batch rules
+    #
+    # @param self The object pointer
+    # @param name The name of the attribute
+    # @param value The new value
+    # @return None
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        if name != 'batch_rules':
+            self.__dict__['batch_rules'] = None
+
+    ## Gets the controller's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the compiled batch rules
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['batch_rules'] = None
+        return state
+
     ## The process function for the RuleController
     #
     # @param self The object pointer
@@ -91,7 +165,7 @@ class TestRuleController:
     # @note
     #       - Angle control is by a standard PD controller, using the following equation:
     #         @f[
-    #            6 \times \mbox{angle\_error} + 5 \times \mbox{state.dangdt}
+    #            \mbox{angle\_prop\_gain} \times \mbox{angle\_error} + \mbox{angle\_diff\_gain} \times \mbox{state.dangdt}
     #         @f]
     #         The controller constants were determined by trial and error to be acceptable
     #       - The returned control values are not limited to 1
@@ -102,8 +176,6 @@ class TestRuleController:
         y_error = state.target_y - state.y
         x_error = state.target_x - state.x
 
-        print y_error
-
         if y_error > 20:
             y_error = 20
         if y_error < -20:
@@ -113,8 +185,6 @@ class TestRuleController:
         if x_error < -20:
             x_error = -20
 
-        print y_error
-
         norm_ang = (2 * math.pi) - ( (state.ang + math.pi) % (2 * math.pi))
         if norm_ang > math.pi:
             norm_ang -= 2* math.pi
@@ -153,7 +223,7 @@ class TestRuleController:
 
         ang_error = target_ang - norm_ang
 
-        side_force = (ang_error * 22.0974 + state.dangdt * 43.3479)
+        side_force = (ang_error * self.angle_prop_gain + state.dangdt * self.angle_diff_gain)
 
         if side_force > 0:
             control.right = side_force
@@ -164,6 +234,21 @@ class TestRuleController:
 
         return control
 
+    ## The batched process function for the TestRuleController
+    #
+    # @param self The object pointer
+    # @param sensor The pod batch.  Unused.
+    # @param state A PodBatches.BatchState with target_x and target_y arrays
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A BatchControl holding the instructions process() gives each pod
+    def process_batch(self, sensor, state, dt):
+        if self.batch_rules == None:
+            self.batch_rules = compile_batch_rules(self, 20)
+        control = BatchControl(len(state.x))
+        (control.up, control.left, control.right) = self.batch_rules(
+            state.target_x, state.target_y, state.x, state.y, state.ang, state.dxdt, state.dydt, state.dangdt)
+        return control
+
 ## Rule-Based Controller
 #
 # This controller controls the pod's thrusters based on a set of discrete rules
@@ -216,6 +301,36 @@ class RuleController:
         ## The angle the controller aims for to move the pod sidewise
         self.propel_angle = 0.1
 
+        ## The Angle Control Equation's proportional gain
+        self.angle_prop_gain = 6
+        ## The Angle Control Equation's differential gain
+        self.angle_diff_gain = 5
+
+        ## The rules compiled for process_batch() from the constants above, or
+        # None until it is next called. Setting any attribute clears them, so an
+        # array changed in place must be set again.
+        self.batch_rules = None
+
+    ## Sets an attribute, clearing the compiled batch rules
+    #
+    # @param self The object pointer
+    # @param name The name of the attribute
+    # @param value The new value
+    # @return None
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        if name != 'batch_rules':
+            self.__dict__['batch_rules'] = None
+
+    ## Gets the controller's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the compiled batch rules
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['batch_rules'] = None
+        return state
+
     ## The process function for the RuleController
     #
     # @param self The object pointer
@@ -242,7 +357,7 @@ class RuleController:
     # @note
     #       - Angle control is by a standard PD controller, using the following equation:
     #         @f[
-    #            6 \times \mbox{angle\_error} + 5 \times \mbox{state.dangdt}
+    #            \mbox{angle\_prop\_gain} \times \mbox{angle\_error} + \mbox{angle\_diff\_gain} \times \mbox{state.dangdt}
     #         @f]
     #         The controller constants were determined by trial and error to be acceptable
     #       - The returned control values are not limited to 1
@@ -290,7 +405,7 @@ class RuleController:
 
         ang_error = target_ang - norm_ang
 
-        side_force = (ang_error * 6 + state.dangdt * 5)
+        side_force = (ang_error * self.angle_prop_gain + state.dangdt * self.angle_diff_gain)
 
         if side_force > 0:
             control.right = side_force
@@ -301,6 +416,21 @@ class RuleController:
 
         return control
 
+    ## The batched process function for the RuleController
+    #
+    # @param self The object pointer
+    # @param sensor The pod batch.  Unused.
+    # @param state A PodBatches.BatchState with target_x and target_y arrays
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A BatchControl holding the instructions process() gives each pod
+    def process_batch(self, sensor, state, dt):
+        if self.batch_rules == None:
+            self.batch_rules = compile_batch_rules(self)
+        control = BatchControl(len(state.x))
+        (control.up, control.left, control.right) = self.batch_rules(
+            state.target_x, state.target_y, state.x, state.y, state.ang, state.dxdt, state.dydt, state.dangdt)
+        return control
+
 ## Proportional+Differential Controller
 #
 # This controller controls the pod's thrusters based on a set of equations derived
@@ -328,6 +458,8 @@ class PDController:
         self.horizontal_force_feedback_scale = 20
         ## The thrust commands produced by the system
         self.control = Control()
+        ## The thrust commands produced for each pod by process_batch()
+        self.batch_control = None
 
     ## The process function for the PDController
     #
@@ -399,4 +531,98 @@ class PDController:
 
         self.control.limit()
 
-        return self.control
\ No newline at end of file
+        return self.control
+
+    ## The batched process function for the PDController
+    #
+    # @param self The object pointer
+    # @param sensor The pod batch.  Unused.
+    # @param state A PodBatches.BatchState with target_x and target_y arrays
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A BatchControl holding the instructions process() gives each pod
+    #
+    # Each pod's last instructions are kept in @ref batch_control, in the same
+    # way process() keeps them in @ref control. They are reset when the
+    # number of pods changes.
+    def process_batch(self, sensor, state, dt):
+        n = len(state.x)
+        if self.batch_control == None or len(self.batch_control.up) != n:
+            self.batch_control = BatchControl(n)
+        control = self.batch_control
+
+        # Vertical first:
+        control.up = (control.up - (self.vertical_prop_gain * \
+            (state.target_y - state.y) + self.vertical_diff_gain * state.dydt))
+
+        # Horizontal next, limited so that arcsin never fails:
+        horiz_feedback = np.clip(((state.target_x - state.x) * self.horizontal_prop_gain \
+                                  + (self.horizontal_diff_gain * state.dxdt)) \
+                                 / self.horizontal_force_feedback_scale, -1, 1)
+
+        angle_change = math.pi - (self.angle_gain * np.arcsin(horiz_feedback)) \
+            - state.ang
+
+        horiz_force = (control.left - control.right) + \
+            (angle_change * self.angle_prop_gain + \
+                (self.angle_diff_gain * state.dangdt))
+
+        control.left = np.where(horiz_force > 0, horiz_force, 0.0)
+        control.right = np.where(horiz_force > 0, 0.0, np.abs(horiz_force))
+
+        control.limit()
+
+        return control
+
+## Checks that a controller's process_batch() matches its process()
+#
+# @param controller_class The controller class
+# @param n The number of pods
+# @param ticks The number of ticks, each with new random states
+# @param seed The random seed
+# @return The number of thruster instructions that differ
+#
+# One controller runs process_batch() for the batch while n others run
+# process() for one pod each, so controllers that keep state between ticks
+# are checked too. Some pods are placed on their targets, or given no speed,
+# to test the edges of the rules. After the first tick one of the numeric
+# constants is changed before each tick, to check that the batch follows it.
+def check_process_batch(controller_class, n=1000, ticks=5, seed=0):
+    rng = np.random.RandomState(seed)
+    pods = GravityPodBatch(n, 0, 1, None, (255, 0, 0))
+    batch = controller_class()
+    controllers = [controller_class() for i in range(n)]
+    constants = sorted(name for (name, value) in batch.__dict__.items()
+                       if isinstance(value, (int, float)) and not isinstance(value, bool))
+    mismatches = 0
+    for tick in range(ticks):
+        if tick > 0 and len(constants) > 0:
+            name = constants[(tick - 1) * 7 % len(constants)]
+            for controller in [batch] + controllers:
+                setattr(controller, name, getattr(controller, name) * 1.1)
+        for (name, size) in (('x', 300), ('y', 300), ('dxdt', 80), ('dydt', 80), ('ang', 7), ('dangdt', 2)):
+            setattr(pods, name, rng.uniform(-size, size, n))
+        target_x = rng.uniform(-300, 300, n)
+        target_y = rng.uniform(-300, 300, n)
+        target_x[:n // 20] = pods.x[:n // 20]
+        target_y[:n // 20] = pods.y[:n // 20]
+        pods.dxdt[n // 20:n // 10] = 0
+
+        state = BatchState(pods)
+        (state.target_x, state.target_y) = (target_x, target_y)
+        control = batch.process_batch(pods, state, 0.1)
+        for (i, controller) in enumerate(controllers):
+            state = State(PodRow(pods, i))
+            (state.target_x, state.target_y) = (float(target_x[i]), float(target_y[i]))
+            expected = controller.process([], state, 0.1)
+            for name in ('up', 'down', 'left', 'right'):
+                if float(getattr(expected, name)) != float(np.broadcast_to(getattr(control, name), (n,))[i]):
+                    mismatches += 1
+    return mismatches
+
+if __name__ == '__main__':
+    failed = False
+    for controller_class in (PDController, RuleController, TestRuleController):
+        mismatches = check_process_batch(controller_class)
+        print("%s: %d mismatched instructions" % (controller_class.__name__, mismatches))
+        failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,215 @@
+## @package DistanceFields
+# Contains the signed distance field used by WallDodgers.FieldWallDodger to
+# find how far the pod is from the nearest wall, and in which direction the
+# walls are furthest away, without casting any rays.
+#
+# The field is sampled on a grid of nodes covering the world. Each node holds
+# its distance from the nearest wall segment (up to a maximum distance), which
+# is positive in the space the pod can reach from its start position and
+# negative elsewhere (inside solid areas and outside the boundary), and the
+# gradient of that distance. Values between the nodes are found by bilinear
+# interpolation.
+#
+# Fields are saved in the world's WorldCache entry, so each world is only
+# processed once for each setting.
+#
+# Example:
+#
+# field = distance_field(world)
+# (distance, grad_x, grad_y) = field.lookup(pod.x, pod.y)
+import collections
+
+import numpy as np
+
+from PathPlanning import point_segment_distances
+from SpatialIndex import expand_ranges
+from WorldCache import cached_array
+
+## The number of segments processed in one NumPy operation
+BUILD_BLOCK = 1 << 10
+
+## Distance Field
+#
+# A signed distance field and its gradient, sampled on a grid of nodes.
+class DistanceField:
+    ## The DistanceField constructor
+    #
+    # @param self The object pointer
+    # @param world The World to build the field for
+    # @param resolution The distance between grid nodes
+    # @param max_distance The largest distance stored. Nodes further than this
+    # from every wall hold max_distance (or -max_distance).
+    # @param values A (3, ny, nx) array of distance, x gradient and y gradient
+    # saved from a field built with the same world and settings. If None,
+    # the field is built.
+    def __init__(self, world, resolution=5.0, max_distance=100.0, values=None):
+        self.resolution = float(resolution)
+        self.max_distance = float(max_distance)
+        border = 2 * self.resolution
+        ## The x coordinate of the first node
+        self.x0 = world.rect.left - border
+        ## The y coordinate of the first node
+        self.y0 = world.rect.top - border
+        ## The number of nodes in the x direction
+        self.nx = int((world.rect.width + 2 * border) / self.resolution) + 2
+        ## The number of nodes in the y direction
+        self.ny = int((world.rect.height + 2 * border) / self.resolution) + 2
+
+        if values is None:
+            distance = self.signed(world, self.distances(world.segs))
+            (grad_y, grad_x) = np.gradient(distance, self.resolution)
+            values = np.stack([distance, grad_x, grad_y])
+        ## The signed distance at each node
+        self.distance = values[0]
+        ## The x component of the gradient at each node
+        self.grad_x = values[1]
+        ## The y component of the gradient at each node
+        self.grad_y = values[2]
+        ## The three fields as flat arrays, for single lookups
+        self.flat = [np.asarray(field).ravel() for field in values]
+
+    ## Finds the unsigned distance of every node from the nearest segment
+    #
+    # @param self The object pointer
+    # @param segs An (n, 4) array of segments
+    # @return An (ny, nx) array of distances, limited to max_distance
+    #
+    # Each segment only updates the nodes within max_distance of its bounding
+    # box.
+    def distances(self, segs):
+        distance = np.full(self.ny * self.nx, self.max_distance)
+        res = self.resolution
+        reach = self.max_distance
+        for first in range(0, len(segs), BUILD_BLOCK):
+            block = segs[first:first + BUILD_BLOCK]
+            nx_lo = np.clip(np.ceil((np.minimum(block[:, 0], block[:, 2]) - reach - self.x0) / res).astype(np.intp), 0, self.nx - 1)
+            nx_hi = np.clip(np.floor((np.maximum(block[:, 0], block[:, 2]) + reach - self.x0) / res).astype(np.intp), 0, self.nx - 1)
+            ny_lo = np.clip(np.ceil((np.minimum(block[:, 1], block[:, 3]) - reach - self.y0) / res).astype(np.intp), 0, self.ny - 1)
+            ny_hi = np.clip(np.floor((np.maximum(block[:, 1], block[:, 3]) + reach - self.y0) / res).astype(np.intp), 0, self.ny - 1)
+
+            span_x = nx_hi - nx_lo + 1
+            (seg, offset) = expand_ranges(np.zeros(len(block), dtype=np.intp), span_x * (ny_hi - ny_lo + 1))
+            node_x = nx_lo[seg] + offset % span_x[seg]
+            node_y = ny_lo[seg] + offset // span_x[seg]
+            d = point_segment_distances(self.x0 + node_x * res, self.y0 + node_y * res, block[seg])
+            np.minimum.at(distance, node_y * self.nx + node_x, d)
+        return distance.reshape(self.ny, self.nx)
+
+    ## Gives the distances their sign
+    #
+    # @param self The object pointer
+    # @param world The World
+    # @param distance An (ny, nx) array of unsigned distances
+    # @return An (ny, nx) array of signed distances
+    #
+    # The nodes reachable from the world's pod start position without passing
+    # within half a node spacing of a wall are inside; all others are outside.
+    # A wall can not pass between two neighbouring nodes that are both
+    # further than this from it, so the fill never leaks through a wall.
+    def signed(self, world, distance):
+        nx = self.nx
+        barrier = (distance <= self.resolution / 2).ravel()
+        inside = np.zeros(self.ny * nx, dtype=bool)
+
+        start = self.node(world.pod_start[0], world.pod_start[1])
+        free = np.flatnonzero(~barrier)
+        if len(free) > 0 and barrier[start]:
+            (free_y, free_x) = np.divmod(free, nx)
+            d2 = (self.x0 + free_x * self.resolution - world.pod_start[0]) ** 2 + \
+                 (self.y0 + free_y * self.resolution - world.pod_start[1]) ** 2
+            start = int(free[np.argmin(d2)])
+
+        if not barrier[start]:
+            blocked = barrier.tolist()
+            reached = [False] * len(blocked)
+            reached[start] = True
+            queue = collections.deque([start])
+            while len(queue) > 0:
+                node = queue.popleft()
+                (node_y, node_x) = divmod(node, nx)
+                for (next_node, ok) in ((node - 1, node_x > 0), (node + 1, node_x < nx - 1),
+                                        (node - nx, node_y > 0), (node + nx, node_y < self.ny - 1)):
+                    if ok and not reached[next_node] and not blocked[next_node]:
+                        reached[next_node] = True
+                        queue.append(next_node)
+            inside = np.array(reached, dtype=bool)
+
+        # Nodes on the wall next to the reachable space are also inside.
+        inside = inside.reshape(self.ny, nx)
+        touching = inside.copy()
+        touching[1:, :] |= inside[:-1, :]
+        touching[:-1, :] |= inside[1:, :]
+        touching[:, 1:] |= inside[:, :-1]
+        touching[:, :-1] |= inside[:, 1:]
+        inside |= touching & barrier.reshape(self.ny, nx)
+        return np.where(inside, distance, -distance)
+
+    ## Finds the node nearest a position
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return The flat index of the node, clamped to the grid
+    def node(self, x, y):
+        node_x = min(max(int(round((x - self.x0) / self.resolution)), 0), self.nx - 1)
+        node_y = min(max(int(round((y - self.y0) / self.resolution)), 0), self.ny - 1)
+        return node_y * self.nx + node_x
+
+    ## Looks up the field at one position
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return A tuple (distance, grad_x, grad_y), bilinearly interpolated
+    # between the surrounding nodes (and clamped to the edge of the grid)
+    def lookup(self, x, y):
+        f_x = min(max((x - self.x0) / self.resolution, 0.0), self.nx - 1.0)
+        f_y = min(max((y - self.y0) / self.resolution, 0.0), self.ny - 1.0)
+        i_x = min(int(f_x), self.nx - 2)
+        i_y = min(int(f_y), self.ny - 2)
+        (u, v) = (f_x - i_x, f_y - i_y)
+        i = i_y * self.nx + i_x
+        j = i + self.nx
+        result = []
+        for field in self.flat:
+            (a, b, c, d) = (field.item(i), field.item(i + 1), field.item(j), field.item(j + 1))
+            top = a + u * (b - a)
+            bottom = c + u * (d - c)
+            result.append(top + v * (bottom - top))
+        return tuple(result)
+
+    ## Looks up the field at many positions
+    #
+    # @param self The object pointer
+    # @param xs An array of x coordinates
+    # @param ys An array of y coordinates
+    # @return A tuple (distances, grad_xs, grad_ys) of arrays
+    def lookup_many(self, xs, ys):
+        f_x = np.clip((np.asarray(xs, dtype=float) - self.x0) / self.resolution, 0.0, self.nx - 1.0)
+        f_y = np.clip((np.asarray(ys, dtype=float) - self.y0) / self.resolution, 0.0, self.ny - 1.0)
+        i_x = np.minimum(f_x.astype(np.intp), self.nx - 2)
+        i_y = np.minimum(f_y.astype(np.intp), self.ny - 2)
+        (u, v) = (f_x - i_x, f_y - i_y)
+        result = []
+        for field in (self.distance, self.grad_x, self.grad_y):
+            top = field[i_y, i_x] + u * (field[i_y, i_x + 1] - field[i_y, i_x])
+            bottom = field[i_y + 1, i_x] + u * (field[i_y + 1, i_x + 1] - field[i_y + 1, i_x])
+            result.append(top + v * (bottom - top))
+        return tuple(result)
+
+## Loads the distance field of a world
+#
+# @param world The World
+# @param resolution The distance between grid nodes
+# @param max_distance The largest distance stored
+# @return A DistanceField, taken from the world's cache entry when the world
+# was loaded from a file
+def distance_field(world, resolution=5.0, max_distance=100.0):
+    if world.file_name == None:
+        return DistanceField(world, resolution, max_distance)
+
+    def build():
+        field = DistanceField(world, resolution, max_distance)
+        return np.stack([field.distance, field.grad_x, field.grad_y])
+    name = 'distance-%r-%r' % (float(resolution), float(max_distance))
+    return DistanceField(world, resolution, max_distance, cached_array(world.file_name, name, build))
@@ -8,10 +8,15 @@ from Controllers import RuleController
 from Controllers import TestRuleController
 
 from Navigators import KeyboardCoordinateNavigator
+from Navigators import PlanningNavigator
 from Navigators import RouteNavigator
 from Painters import TargetCoordinatePainter
+from Profiling import Profiler
+from Recorders import BinaryRecorder
+from Recorders import CompactRouteRecorder
 from Recorders import RouteRecorder
 from Recorders import SensorRecorder
+from WallDodgers import FieldWallDodger
 from WallDodgers import WallDodger
 
 from simulation import Control
@@ -39,6 +44,11 @@ class MainController:
         self.recorder = None
         ## The current wall dodger in use
         self.wall_dodger = WallDodger(10)
+        ## The world the pod is in (needed by @ref Navigators.PlanningNavigator
+        # and @ref WallDodgers.FieldWallDodger)
+        self.world = None
+        ## The @ref Profiling.Profiler timing the modules, or None
+        self.profiler = None
 
     ## The process function for the MainController
     #
@@ -57,16 +67,20 @@ class MainController:
     #    - e - None
     #    - r - @ref Recorders.RouteRecorder
     #    - t - @ref Recorders.SensorRecorder
+    #    - y - @ref Recorders.BinaryRecorder (saving to trajectory.npz)
+    #    - u - @ref Recorders.CompactRouteRecorder (saving to routeCompact.csv)
     # - Controllers
     #    - o - @ref Controllers.PDController
     #    - p - @ref Controllers.RuleController
     # - Navigators
     #    - a - @ref Navigators.RouteNavigator (using routeNew.csv as an input file)
     #    - s - @ref Navigators.KeyboardCoordinateNavigator
+    #    - d - @ref Navigators.PlanningNavigator (planning from the pod's position)
     # - Wall Dodgers
     #    - j - None
     #    - k - @ref WallDodgers.WallDodger (safe distance = 10)
     #    - l - @ref WallDodgers.WallDodger (safe distance = 20)
+    #    - h - @ref WallDodgers.FieldWallDodger (safe distance = 20)
     #
     # The modules are called in the following order:
     # -# Navigator
@@ -75,6 +89,8 @@ class MainController:
     # -# Controller
     #
     # The painter module is called by the simulation, not by MainController.
+    # While a @ref Profiling.Profiler is attached, the time spent in each
+    # module is recorded.
     def process(self, sensor, state, dt):
         # Initialise modules.
         if self.navigator == None:
@@ -87,11 +103,15 @@ class MainController:
         # Manage modules.
         # Recorders
         if keyinput[pg.K_e]:
-            self.recorder = None
+            self.set_recorder(None)
         if keyinput[pg.K_r]:
-            self.recorder = RouteRecorder('routeData.csv')
+            self.set_recorder(RouteRecorder('routeData.csv'))
         if keyinput[pg.K_t]:
-            self.recorder = SensorRecorder('sensorData.csv')
+            self.set_recorder(SensorRecorder('sensorData.csv'))
+        if keyinput[pg.K_y]:
+            self.set_recorder(BinaryRecorder('trajectory.npz'))
+        if keyinput[pg.K_u]:
+            self.set_recorder(CompactRouteRecorder('routeCompact.csv'))
 
         # Controllers
         if keyinput[pg.K_o]:
@@ -104,6 +124,8 @@ class MainController:
             self.navigator = RouteNavigator(state, 'routeNew.csv')
         if keyinput[pg.K_s]:
             self.navigator = KeyboardCoordinateNavigator(state)
+        if keyinput[pg.K_d] and self.world != None:
+            self.navigator = PlanningNavigator(state, self.world)
 
         # Wall Dodgers
         if keyinput[pg.K_j]:
@@ -112,10 +134,18 @@ class MainController:
             self.wall_dodger = WallDodger(10)
         if keyinput[pg.K_l]:
             self.wall_dodger = WallDodger(20)
+        if keyinput[pg.K_h] and self.world != None:
+            self.wall_dodger = FieldWallDodger(20, self.world)
+
+        profiler = self.profiler
 
         # Run the navigator
         if self.navigator != None:
+            if profiler != None:
+                profiler.push('navigator')
             (state.target_x, state.target_y) = self.navigator.process(sensor, state, dt)
+            if profiler != None:
+                profiler.pop()
 
         # Set up variables
         control = Control()
@@ -126,18 +156,56 @@ class MainController:
 
         # Dodge walls
         if self.wall_dodger != None:
+            if profiler != None:
+                profiler.push('dodger')
             state = self.wall_dodger.process(sensor, state, dt)
+            if profiler != None:
+                profiler.pop()
 
         # Run the recorder
         if self.recorder != None:
+            if profiler != None:
+                profiler.push('recorder')
             self.recorder.process(sensor, state)
+            if profiler != None:
+                profiler.pop()
 
         # Run the controller.
         if self.controller != None:
+            if profiler != None:
+                profiler.push('controller')
             control = self.controller.process(sensor, state, dt)
+            if profiler != None:
+                profiler.pop()
 
         return control
 
+    ## Gets the controller's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the recorder or profiler
+    #
+    # A recorder holds an open file, so a copy of the controller (such as one
+    # restored from a @ref WorldStates snapshot) starts without one.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['recorder'] = None
+        state['profiler'] = None
+        return state
+
+    ## Changes the recorder, closing the old one
+    #
+    # @param self The object pointer
+    # @param recorder The new recorder, or None
+    # @return None
+    def set_recorder(self, recorder):
+        if self.recorder != None:
+            self.recorder.close()
+        self.recorder = recorder
+
+## Set to True to print the time spent in each stage of a tick when the
+# simulation ends (see @ref Profiling)
+PROFILE = False
 ## The simulation timestep
 timestep = .1
 ## The colour red (used as the colour of the pod)
@@ -156,9 +224,20 @@ POD = GravityPod(N_SENSORS, SENSOR_RANGE, BRAIN, RED)
 PODS = [POD]
 ## The world the pods exist in
 WORLD = World("world.txt", PODS)
+BRAIN.world = WORLD
 ## The simulation that runs the world
 SIM = Simulation(WORLD, timestep)
 
 SIM.painter = BRAIN.painter
 
-SIM.run()
\ No newline at end of file
+## The profiler timing the simulation, if PROFILE is set
+PROFILER = None
+if PROFILE:
+    PROFILER = Profiler()
+    PROFILER.attach(WORLD)
+
+SIM.run()
+
+BRAIN.set_recorder(None)
+if PROFILER != None:
+    print(PROFILER.report())
@@ -11,11 +11,15 @@
 #
 # The navigator must also have an attribute named end which flags if it has
 # reached the end of the route.
-import csv
-import math
-
+import numpy as np
 import pygame as pg
 
+from PathPlanning import plan_route
+from Routes import RouteIndex
+from Routes import RouteProgress
+from Routes import load_route_index
+from WorldCache import load_world
+
 ## Keyboard-set Coordinate Navigator
 #
 # This navigator controls the pod's target coordinates based on input from the
@@ -75,6 +79,10 @@ class KeyboardCoordinateNavigator:
 # ...\n
 # target_x_n, target_y_n\n
 #
+# The pod's progress along the route is tracked by a @ref Routes.RouteProgress,
+# so a pod that overshoots a waypoint or is pushed along the route by the wall
+# dodger catches up rather than turning back.
+#
 # @note This navigator makes no attempt to avoid walls.
 class RouteNavigator:
     ## The RouteNavigator constructor
@@ -82,25 +90,85 @@ class RouteNavigator:
     # @param self The object pointer
     # @param state The current state of the pod. Unused.
     # @param filename The name of the file to load the route from.
+    # @param window The number of waypoints ahead of the current one that the
+    # pod may catch up to (0 to disable catching up)
+    # @param lookahead If above 0, the target is this many pixels along the
+    # route ahead of the current waypoint
     #
     # Initialises the navigator and loads the route in to the @ref coordinates
-    # attribute.
-    def __init__(self, state, filename):
+    # attribute, using @ref Routes.load_route so that navigators following the
+    # same file share one copy of the route.
+    def __init__(self, state, filename, window=50, lookahead=0):
+        ## The name of the route file
+        self.filename = filename
         ## The index of the current coordinate in the route
         self.current_coordinate = 0
-        ## The list of coordinates that make up the route
-        self.coordinates = []
         ## Flag showing if the pod has reached the end
         #
         # Set to true when the pod is within 20 pixels of the final target
         # coordinate.
         self.end = False
+        ## The (n, 2) read only array of coordinates that make up the route
+        self.coordinates = None
+        ## The @ref Routes.RouteProgress tracking the pod along the route
+        self.progress = None
+        self.load(window, lookahead)
+
+    ## Loads the route and sets up the progress tracker
+    #
+    # @param self The object pointer
+    # @param window The catch up window
+    # @param lookahead The lookahead distance
+    # @return None
+    def load(self, window, lookahead):
+        self.follow(load_route_index(self.filename), window, lookahead)
+
+    ## Sets up the progress tracker for a route
+    #
+    # @param self The object pointer
+    # @param index The @ref Routes.RouteIndex of the route
+    # @param window The catch up window
+    # @param lookahead The lookahead distance
+    # @return None
+    def follow(self, index, window, lookahead):
+        self.coordinates = index.route
+        self.progress = RouteProgress(index, 1, 20, window, lookahead)
+        self.progress.current[0] = self.current_coordinate
+        self.progress.end[0] = self.end
+
+    ## Gets the navigator's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the route itself
+    #
+    # The route is stored by file name and shared again when unpickled.
+    def __getstate__(self):
+        return {'filename': self.filename, 'current_coordinate': self.current_coordinate,
+                'end': self.end, 'window': self.progress.window, 'lookahead': self.progress.lookahead}
 
-        reader = csv.reader(open(filename, 'r'), delimiter=',')
+    ## Restores the navigator's state after unpickling
+    #
+    # @param self The object pointer
+    # @param state The attributes returned by __getstate__()
+    # @return None
+    def __setstate__(self, state):
+        self.filename = state['filename']
+        self.current_coordinate = state['current_coordinate']
+        self.end = state['end']
+        self.load(state['window'], state['lookahead'])
 
-        for row in reader:
-            coord = (float(row[0]), float(row[1]))
-            self.coordinates.append(coord)
+    ## Moves the current coordinate to the route coordinate nearest the pod
+    #
+    # @param self The object pointer
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    # @return None
+    #
+    # Used to pick the route up again after the pod has left it.
+    def resume(self, state):
+        self.progress.resume(np.array([state.x]), np.array([state.y]))
+        self.current_coordinate = int(self.progress.current[0])
 
     ## The process function for the RouteNavigator
     #
@@ -115,17 +183,93 @@ class RouteNavigator:
     # This function monitors the current location of the pod.  Once it is within
     # 20 px of the current target coordinate, it moves on to the next one. Once
     # it is within 20 px of the final coordinate, it sets the @ref end attribute
-    # to true.
+    # to true. Otherwise, if a coordinate within the catch up window is closer
+    # than the current one, it moves on to that coordinate.
     def process(self, sensor, state, dt):
-        x_error = state.x - self.coordinates[self.current_coordinate][0]
-        y_error = state.y - self.coordinates[self.current_coordinate][1]
+        self.progress.current[0] = self.current_coordinate
+        (target_x, target_y) = self.progress.update(np.array([state.x]), np.array([state.y]))
+        self.current_coordinate = int(self.progress.current[0])
+        self.end = bool(self.progress.end[0])
+        return (float(target_x[0]), float(target_y[0]))
+
+## Planning Navigator
+#
+# This navigator plans its own route from the pod's starting position to the
+# world's end wall with @ref PathPlanning.plan_route, keeping the pod's
+# centre about @ref radius pixels clear of the other walls, and then follows
+# it like RouteNavigator. No recorded route is needed.
+#
+# @note The route is planned once, when the navigator is created. Use
+# replan() to plan again from the pod's current position.
+class PlanningNavigator(RouteNavigator):
+    ## The PlanningNavigator constructor
+    #
+    # @param self The object pointer
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    # @param world The World the pod is in
+    # @param resolution The width of a cell of the planner's occupancy grid
+    # @param radius The clearance kept from the walls
+    # @param window The number of waypoints ahead of the current one that the
+    # pod may catch up to (0 to disable catching up)
+    # @param lookahead If above 0, the target is this many pixels along the
+    # route ahead of the current waypoint
+    def __init__(self, state, world, resolution=5.0, radius=10.0, window=50, lookahead=0):
+        ## The World the route is planned in
+        self.world = world
+        ## The width of a cell of the planner's occupancy grid
+        self.resolution = resolution
+        ## The clearance kept from the walls
+        self.radius = radius
+        ## The position the route was planned from
+        self.start = (state.x, state.y)
+        RouteNavigator.__init__(self, state, None, window, lookahead)
 
-        dist = math.sqrt(math.pow(x_error, 2) + math.pow(y_error, 2))
+    ## Plans the route and sets up the progress tracker
+    #
+    # @param self The object pointer
+    # @param window The catch up window
+    # @param lookahead The lookahead distance
+    # @return None
+    def load(self, window, lookahead):
+        route = plan_route(self.world, self.start[0], self.start[1], self.resolution, self.radius)
+        self.follow(RouteIndex(route), window, lookahead)
+
+    ## Plans a new route from the pod's current position
+    #
+    # @param self The object pointer
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    # @return None
+    def replan(self, state):
+        self.start = (state.x, state.y)
+        self.current_coordinate = 0
+        self.end = False
+        self.load(self.progress.window, self.progress.lookahead)
 
-        if dist < 20 and self.current_coordinate < (len(self.coordinates) - 1):
-            self.current_coordinate += 1
-        elif dist < 20:
-            self.end = True
+    ## Gets the navigator's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, with the world stored by file name
+    #
+    # The route is planned again (from the plan cache) when unpickled, so the
+    # world must have been loaded from a file.
+    def __getstate__(self):
+        state = RouteNavigator.__getstate__(self)
+        state.update({'world_file': self.world.file_name, 'resolution': self.resolution,
+                      'radius': self.radius, 'start': self.start})
+        return state
 
-        return (self.coordinates[self.current_coordinate][0], \
-                self.coordinates[self.current_coordinate][1])
+    ## Restores the navigator's state after unpickling
+    #
+    # @param self The object pointer
+    # @param state The attributes returned by __getstate__()
+    # @return None
+    def __setstate__(self, state):
+        self.world = load_world(state['world_file'], [])
+        self.resolution = state['resolution']
+        self.radius = state['radius']
+        self.start = state['start']
+        RouteNavigator.__setstate__(self, state)
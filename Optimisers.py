@@ -0,0 +1,353 @@
+## @package Optimisers
+# Contains the genetic optimiser used to tune the parameters of the
+# controllers in Controllers against the real simulation physics.
+#
+# Each member of the population is a set of controller attributes. Its cost is
+# found by flying a simulation.GravityPod through a set of scenarios with
+# those attributes, using BatchRunner to spread the episodes over a process
+# pool. Lower costs are better.
+#
+# Example:
+#
+# optimiser = GeneticOptimiser(RuleController, RULE_CONTROLLER_GENES,
+#                              checkpoint='rule_controller.json')
+# optimiser.run(50)
+# optimiser.export('rule_controller_params.json')
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from BatchRunner import Episode
+from BatchRunner import cached_world
+from BatchRunner import resolve
+from BatchRunner import run_episodes
+from BatchRunner import string_types
+
+## Optimisable Parameter
+#
+# Describes one controller attribute and the range it may take.
+class Gene:
+    ## The Gene constructor
+    #
+    # @param self The object pointer
+    # @param name The name of the controller attribute
+    # @param low The lowest allowed value
+    # @param high The highest allowed value
+    def __init__(self, name, low, high):
+        self.name = name
+        self.low = float(low)
+        self.high = float(high)
+
+    ## Limits a value to the gene's range
+    #
+    # @param self The object pointer
+    # @param value The value to limit
+    # @return The limited value
+    def clamp(self, value):
+        return min(max(value, self.low), self.high)
+
+## The genes of Controllers.PDController
+PD_CONTROLLER_GENES = [
+    Gene('vertical_prop_gain', 0, 5),
+    Gene('vertical_diff_gain', -20, 0),
+    Gene('horizontal_prop_gain', 0, 10),
+    Gene('horizontal_diff_gain', -50, 0),
+    Gene('angle_gain', 0, 1),
+    Gene('angle_prop_gain', 0, 50),
+    Gene('angle_diff_gain', -50, 0),
+    Gene('horizontal_force_feedback_scale', 1, 50),
+]
+
+## The genes of Controllers.RuleController and Controllers.TestRuleController
+RULE_CONTROLLER_GENES = [
+    Gene('big_y_speed', 0, 100),
+    Gene('mid_y_speed', 0, 100),
+    Gene('sml_y_speed', 0, 100),
+    Gene('big_x_speed', 0, 100),
+    Gene('mid_x_speed', 0, 100),
+    Gene('sml_x_speed', 0, 100),
+    Gene('big_x_error', 0, 100),
+    Gene('mid_x_error', 0, 100),
+    Gene('big_y_error', 0, 100),
+    Gene('mid_y_error', 0, 100),
+    Gene('up_force', 0, 1),
+    Gene('down_force', 0, 1),
+    Gene('propel_angle', 0, 0.5),
+    Gene('angle_prop_gain', 0, 50),
+    Gene('angle_diff_gain', 0, 50),
+]
+
+## The default episode cost
+#
+# @param result A BatchRunner.EpisodeResult
+# @return The mean distance from the target over the episode, plus a penalty
+# of 10 px for every tick spent against a wall
+def landing_cost(result):
+    return result.mean_distance + 10.0 * result.collisions
+
+## Genetic Optimiser
+#
+# Evolves a population of controller parameter sets using elitism, tournament
+# selection, blend crossover and Gaussian mutation. The state is saved to a
+# JSON checkpoint after every generation, so a run can be stopped and resumed.
+class GeneticOptimiser:
+    ## The GeneticOptimiser constructor
+    #
+    # @param self The object pointer
+    # @param controller_class The controller class to optimise (a class or a
+    # dotted name such as 'Controllers.RuleController')
+    # @param genes A list of Gene objects
+    # @param world_file The world file the scenarios are flown in
+    # @param scenarios A list of dictionaries of extra Episode arguments (for
+    # example target and start), one per scenario. By default the pod flies
+    # to targets 50 px either side of, and 100 px above, its start position.
+    # @param population_size The number of members in the population
+    # @param elite_count The number of best members copied unchanged to the
+    # next generation
+    # @param tournament_size The number of members in a selection tournament
+    # @param crossover_rate The probability that a child mixes two parents
+    # @param mutation_rate The probability that each gene is mutated
+    # @param mutation_scale The standard deviation of a mutation, as a
+    # fraction of the gene's range
+    # @param ticks The length of each episode
+    # @param cost A function giving the cost of a BatchRunner.EpisodeResult
+    # @param processes The number of worker processes used for evaluation
+    # @param checkpoint The checkpoint file. If it exists, the optimiser
+    # resumes from it.
+    # @param seed The random seed
+    def __init__(self, controller_class, genes, world_file='rect_world.txt', scenarios=None,
+                 population_size=40, elite_count=2, tournament_size=3, crossover_rate=0.7,
+                 mutation_rate=0.2, mutation_scale=0.1, ticks=600, cost=landing_cost,
+                 processes=None, checkpoint=None, seed=None):
+        self.controller_class = controller_class
+        self.genes = genes
+        self.world_file = world_file
+        if scenarios == None:
+            (x, y) = cached_world(world_file).pod_start
+            scenarios = [{'target': (x + 50, y - 100)}, {'target': (x - 50, y - 100)}]
+        self.scenarios = scenarios
+        self.population_size = population_size
+        self.elite_count = elite_count
+        self.tournament_size = tournament_size
+        self.crossover_rate = crossover_rate
+        self.mutation_rate = mutation_rate
+        self.mutation_scale = mutation_scale
+        self.ticks = ticks
+        self.cost = cost
+        self.processes = processes
+        ## The worker pool shared by the generations of run(), or None
+        self.pool = None
+        self.checkpoint = checkpoint
+        self.random = random.Random(seed)
+
+        ## The current population, as lists of gene values
+        self.population = []
+        ## The cost of each member of the population
+        self.costs = []
+        ## The number of generations evaluated so far
+        self.generation = 0
+        ## The best (member, cost) found so far
+        self.best = None
+
+        if checkpoint != None and os.path.exists(checkpoint):
+            self.load(checkpoint)
+
+    ## Converts a member to a dictionary of controller attributes
+    #
+    # @param self The object pointer
+    # @param member A list of gene values
+    # @return A dictionary mapping attribute names to values
+    def params(self, member):
+        return dict((gene.name, value) for (gene, value) in zip(self.genes, member))
+
+    ## Evaluates a list of members
+    #
+    # @param self The object pointer
+    # @param members A list of members
+    # @return A list holding the mean scenario cost of each member
+    def evaluate(self, members):
+        episodes = []
+        for (i, member) in enumerate(members):
+            for scenario in self.scenarios:
+                options = dict(scenario)
+                options.setdefault('ticks', self.ticks)
+                episodes.append(Episode(self.world_file, controller_class=self.controller_class,
+                                        params=self.params(member), n_sensors=0, tag=i, **options))
+
+        totals = [0.0] * len(members)
+        for result in run_episodes(episodes, self.processes, pool=self.pool):
+            totals[result.tag] += self.cost(result)
+        return [total / len(self.scenarios) for total in totals]
+
+    ## Picks a parent by tournament
+    #
+    # @param self The object pointer
+    # @return A member of the current population
+    def select(self):
+        entrants = self.random.sample(range(len(self.population)), min(self.tournament_size, len(self.population)))
+        return self.population[min(entrants, key=lambda i: self.costs[i])]
+
+    ## Breeds a child from two parents
+    #
+    # @param self The object pointer
+    # @param mother A member
+    # @param father A member
+    # @return The child member
+    def breed(self, mother, father):
+        child = list(mother)
+        if self.random.random() < self.crossover_rate:
+            for i in range(len(child)):
+                mix = self.random.uniform(-0.25, 1.25)
+                child[i] = mother[i] + mix * (father[i] - mother[i])
+
+        for (i, gene) in enumerate(self.genes):
+            if self.random.random() < self.mutation_rate:
+                child[i] += self.random.gauss(0, self.mutation_scale * (gene.high - gene.low))
+            child[i] = gene.clamp(child[i])
+        return child
+
+    ## Runs one generation
+    #
+    # @param self The object pointer
+    # @return None
+    #
+    # The first call creates and evaluates a random population (seeded with
+    # the controller's own defaults). Later calls breed and evaluate the next
+    # generation, keeping the elite members.
+    def step(self):
+        if len(self.population) == 0:
+            members = [[self.random.uniform(gene.low, gene.high) for gene in self.genes]
+                       for i in range(self.population_size)]
+            members[0] = self.default_member()
+            self.population = members
+            self.costs = self.evaluate(members)
+        else:
+            ranked = sorted(range(len(self.population)), key=lambda i: self.costs[i])
+            elite = [self.population[i] for i in ranked[:self.elite_count]]
+            elite_costs = [self.costs[i] for i in ranked[:self.elite_count]]
+            children = [self.breed(self.select(), self.select())
+                        for i in range(self.population_size - len(elite))]
+            self.population = elite + children
+            self.costs = elite_costs + self.evaluate(children)
+
+        self.generation += 1
+        i = min(range(len(self.costs)), key=lambda i: self.costs[i])
+        if self.best == None or self.costs[i] < self.best[1]:
+            self.best = (list(self.population[i]), self.costs[i])
+
+        if self.checkpoint != None:
+            self.save(self.checkpoint)
+
+    ## Builds a member from the controller's default attributes
+    #
+    # @param self The object pointer
+    # @return A member
+    def default_member(self):
+        controller = resolve(self.controller_class)()
+        return [gene.clamp(float(getattr(controller, gene.name))) for gene in self.genes]
+
+    ## Runs a number of generations, reporting progress
+    #
+    # @param self The object pointer
+    # @param generations The number of generations to run
+    # @param report If true, a line is printed after each generation
+    # @return The best (params, cost) found
+    #
+    # The generations share one worker pool, so each worker loads the world
+    # once for the whole run.
+    def run(self, generations, report=True):
+        start = time.time()
+        if self.processes != 1 and self.pool == None:
+            self.pool = multiprocessing.Pool(self.processes)
+        try:
+            for i in range(generations):
+                self.step()
+                if report:
+                    elapsed = time.time() - start
+                    mean = sum(self.costs) / len(self.costs)
+                    print("Generation %d: best %.3f, mean %.3f, %.3f generations/s" %
+                          (self.generation, self.best[1], mean, (i + 1) / elapsed))
+        finally:
+            if self.pool != None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+        return (self.params(self.best[0]), self.best[1])
+
+    ## Saves the optimiser state to a JSON checkpoint
+    #
+    # @param self The object pointer
+    # @param filename The file to write
+    # @return None
+    def save(self, filename):
+        state = self.random.getstate()
+        data = {
+            'controller': self.class_name(),
+            'genes': [[gene.name, gene.low, gene.high] for gene in self.genes],
+            'generation': self.generation,
+            'population': self.population,
+            'costs': self.costs,
+            'best': None if self.best == None else {'member': self.best[0], 'cost': self.best[1]},
+            'random': [state[0], list(state[1]), state[2]],
+        }
+        temp = filename + '.tmp'
+        out = open(temp, 'w')
+        json.dump(data, out)
+        out.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp, filename)
+
+    ## Restores the optimiser state from a JSON checkpoint
+    #
+    # @param self The object pointer
+    # @param filename The file to read
+    # @return None
+    def load(self, filename):
+        data = json.load(open(filename, 'r'))
+        if [gene.name for gene in self.genes] != [gene[0] for gene in data['genes']]:
+            raise ValueError("Checkpoint " + filename + " was written for different genes")
+
+        self.generation = data['generation']
+        self.population = data['population']
+        self.costs = data['costs']
+        if data['best'] != None:
+            self.best = (data['best']['member'], data['best']['cost'])
+        state = data['random']
+        self.random.setstate((state[0], tuple(state[1]), state[2]))
+
+    ## Writes the best parameters found to a JSON file
+    #
+    # @param self The object pointer
+    # @param filename The file to write
+    # @return None
+    #
+    # The file holds the controller's dotted class name, the parameters and
+    # their cost, and can be loaded with load_params().
+    def export(self, filename):
+        out = open(filename, 'w')
+        json.dump({'controller': self.class_name(), 'params': self.params(self.best[0]),
+                   'cost': self.best[1]}, out, indent=4, sort_keys=True)
+        out.close()
+
+    ## Gets the dotted name of the controller class
+    #
+    # @param self The object pointer
+    # @return A string such as 'Controllers.RuleController'
+    def class_name(self):
+        if isinstance(self.controller_class, string_types):
+            return str(self.controller_class)
+        return self.controller_class.__module__ + '.' + self.controller_class.__name__
+
+## Creates a controller from a file written by GeneticOptimiser.export()
+#
+# @param filename The parameter file
+# @return A controller instance with the optimised attributes set
+def load_params(filename):
+    data = json.load(open(filename, 'r'))
+    controller = resolve(str(data['controller']))()
+    for (name, value) in data['params'].items():
+        setattr(controller, str(name), value)
+    return controller
@@ -8,6 +8,14 @@
 # preDraw(self, screen)
 #
 # If a function is not required, its attribute can be set to None instead.
+#
+# Both functions may return the rect (or a list of rects) they drew over, so
+# that the simulation only redraws and updates those parts of the display. If
+# they return None, the whole display is redrawn.
+#
+# When the physics runs on its own thread (simulation.Simulation.threaded),
+# each frame draws a shallow copy of the painter taken along with the pods'
+# snapshots, so a painter should keep what it draws in plain attributes.
 import pygame
 
 ## Target Coordinate Painter
@@ -27,13 +35,13 @@ class TargetCoordinatePainter:
     #
     # @param self The object pointer
     # @param screen The screen to paint to
-    # @return None
+    # @return The rect painted over
     #
     # Called before the main printing is performed, placing the output below
     # the other elements.
     def preDraw(self, screen):
         col = (255, 255, 255)
-        pygame.draw.line(screen, col, (self.target_x - 10, self.target_y), \
+        rect = pygame.draw.line(screen, col, (self.target_x - 10, self.target_y), \
             (self.target_x + 10, self.target_y), 3)
-        pygame.draw.line(screen, col, (self.target_x, self.target_y - 10), \
-            (self.target_x, self.target_y + 10), 3)
\ No newline at end of file
+        return rect.union(pygame.draw.line(screen, col, (self.target_x, self.target_y - 10), \
+            (self.target_x, self.target_y + 10), 3))
\ No newline at end of file
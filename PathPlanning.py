@@ -0,0 +1,269 @@
+## @package PathPlanning
+# Contains the path planner used by Navigators.PlanningNavigator to find a
+# route from the pod to the end wall of a world without a recorded route.
+#
+# The walls are rasterised in to an OccupancyGrid, with every cell closer to a
+# wall than the pod's radius marked as blocked, and A* search finds the
+# shortest 8-connected path through the free cells to the cells next to the
+# end wall. The path is then simplified and resampled in to a route like the
+# ones made by Routes.compact_route().
+#
+# Occupancy grids and planned routes are saved in the world's WorldCache
+# entry, so each world is only planned once for each start cell.
+#
+# Example:
+#
+# route = plan_route(world, pod.x, pod.y)
+import heapq
+import math
+
+import numpy as np
+
+from Routes import resample_route
+from Routes import simplify_route
+from SpatialIndex import expand_ranges
+from WorldCache import cached_array
+
+## The number of segments rasterised in one NumPy operation
+BUILD_BLOCK = 1 << 12
+
+## The routes planned by this process, keyed by world file, start cell and
+# planner settings
+plan_cache = {}
+
+## Finds the distance of each point from its own segment
+#
+# @param p_x An array of point x coordinates
+# @param p_y An array of point y coordinates
+# @param segs An array of segments (x1, y1, x2, y2), one row per point
+# @return An array of distances
+#
+# Unlike Routes.segment_distances(), which measures many points from one
+# segment, each point is paired with the segment in the same row.
+def point_segment_distances(p_x, p_y, segs):
+    d_x = segs[:, 2] - segs[:, 0]
+    d_y = segs[:, 3] - segs[:, 1]
+    length2 = d_x * d_x + d_y * d_y
+    t = (p_x - segs[:, 0]) * d_x + (p_y - segs[:, 1]) * d_y
+    t = np.clip(np.where(length2 > 0, t / np.where(length2 > 0, length2, 1), 0), 0, 1)
+    return np.hypot(p_x - (segs[:, 0] + t * d_x), p_y - (segs[:, 1] + t * d_y))
+
+## Occupancy Grid
+#
+# A grid of square cells covering a world. A cell is blocked if its centre is
+# within radius + resolution / 2 of a wall that is not an end wall, so a pod
+# of the given radius can move between the centres of free cells without
+# touching a wall. Goal cells are free cells whose centres are within
+# radius + resolution of an end wall (a wall with "end" in its name).
+class OccupancyGrid:
+    ## The OccupancyGrid constructor
+    #
+    # @param self The object pointer
+    # @param world The World to rasterise
+    # @param resolution The width of a cell
+    # @param radius The pod radius the walls are inflated by
+    # @param cells A (blocked, goal) tuple of arrays saved from a grid built
+    # with the same world and settings. If None, the walls are rasterised.
+    def __init__(self, world, resolution=5.0, radius=10.0, cells=None):
+        self.resolution = float(resolution)
+        self.radius = float(radius)
+        border = self.radius + 2 * self.resolution
+        ## The x coordinate of the left edge of the grid
+        self.x0 = world.rect.left - border
+        ## The y coordinate of the top edge of the grid
+        self.y0 = world.rect.top - border
+        ## The number of cells in the x direction
+        self.nx = int((world.rect.width + 2 * border) / self.resolution) + 1
+        ## The number of cells in the y direction
+        self.ny = int((world.rect.height + 2 * border) / self.resolution) + 1
+
+        if cells == None:
+            is_end = np.array(["end" in wall.name for wall in world.walls], dtype=bool)
+            ends = is_end[world.seg_wall] if len(world.seg_wall) > 0 else np.zeros(0, dtype=bool)
+            blocked = self.rasterise(world.segs[~ends], self.radius + self.resolution / 2)
+            goal = self.rasterise(world.segs[ends], self.radius + self.resolution) & ~blocked
+            cells = (blocked, goal)
+        ## A (ny, nx) array flagging the blocked cells
+        self.blocked = np.asarray(cells[0], dtype=bool)
+        ## A (ny, nx) array flagging the goal cells
+        self.goal = np.asarray(cells[1], dtype=bool)
+
+    ## Marks the cells near a set of segments
+    #
+    # @param self The object pointer
+    # @param segs An (n, 4) array of segments
+    # @param reach The distance from a segment within which a cell's centre
+    # is marked
+    # @return A (ny, nx) array flagging the marked cells
+    def rasterise(self, segs, reach):
+        marked = np.zeros(self.ny * self.nx, dtype=bool)
+        res = self.resolution
+        for first in range(0, len(segs), BUILD_BLOCK):
+            block = segs[first:first + BUILD_BLOCK]
+            cx_lo = np.clip(((np.minimum(block[:, 0], block[:, 2]) - reach - self.x0) // res).astype(np.intp), 0, self.nx - 1)
+            cx_hi = np.clip(((np.maximum(block[:, 0], block[:, 2]) + reach - self.x0) // res).astype(np.intp), 0, self.nx - 1)
+            cy_lo = np.clip(((np.minimum(block[:, 1], block[:, 3]) - reach - self.y0) // res).astype(np.intp), 0, self.ny - 1)
+            cy_hi = np.clip(((np.maximum(block[:, 1], block[:, 3]) + reach - self.y0) // res).astype(np.intp), 0, self.ny - 1)
+
+            span_x = cx_hi - cx_lo + 1
+            (seg, offset) = expand_ranges(np.zeros(len(block), dtype=np.intp), span_x * (cy_hi - cy_lo + 1))
+            cx = cx_lo[seg] + offset % span_x[seg]
+            cy = cy_lo[seg] + offset // span_x[seg]
+            (c_x, c_y) = self.centre(cx, cy)
+            near = point_segment_distances(c_x, c_y, block[seg]) <= reach
+            marked[cy[near] * self.nx + cx[near]] = True
+        return marked.reshape(self.ny, self.nx)
+
+    ## Finds the cell holding a position
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return A tuple (cx, cy), which may lie outside the grid
+    def cell(self, x, y):
+        return (int(math.floor((x - self.x0) / self.resolution)), int(math.floor((y - self.y0) / self.resolution)))
+
+    ## Finds the centre of a cell
+    #
+    # @param self The object pointer
+    # @param cx The cell x coordinate (or an array of them)
+    # @param cy The cell y coordinate (or an array of them)
+    # @return A tuple (x, y)
+    def centre(self, cx, cy):
+        return (self.x0 + (cx + 0.5) * self.resolution, self.y0 + (cy + 0.5) * self.resolution)
+
+    ## Finds the free cell nearest a position
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return A tuple (cx, cy), or None if every cell is blocked
+    def nearest_free(self, x, y):
+        (cx, cy) = self.cell(x, y)
+        if 0 <= cx < self.nx and 0 <= cy < self.ny and not self.blocked[cy, cx]:
+            return (cx, cy)
+        (free_y, free_x) = np.nonzero(~self.blocked)
+        if len(free_x) == 0:
+            return None
+        (c_x, c_y) = self.centre(free_x, free_y)
+        i = int(np.argmin((c_x - x) ** 2 + (c_y - y) ** 2))
+        return (int(free_x[i]), int(free_y[i]))
+
+    ## Finds the shortest path from a cell to the goal cells with A*
+    #
+    # @param self The object pointer
+    # @param start The (cx, cy) start cell, which must be free
+    # @return A list of (cx, cy) cells from the start to a goal cell, or None
+    # if no goal cell can be reached
+    #
+    # Moves are to the 8 neighbouring cells, but a diagonal move may not cut
+    # the corner of a blocked cell. The heuristic is the octile distance to
+    # the box round the goal cells.
+    def search(self, start):
+        (goal_y, goal_x) = np.nonzero(self.goal)
+        if len(goal_x) == 0:
+            return None
+        (gx_lo, gx_hi) = (int(goal_x.min()), int(goal_x.max()))
+        (gy_lo, gy_hi) = (int(goal_y.min()), int(goal_y.max()))
+
+        nx = self.nx
+        # Pad the grid with a ring of blocked cells so that no bounds checks
+        # are needed.
+        blocked = np.ones((self.ny + 2, nx + 2), dtype=bool)
+        blocked[1:-1, 1:-1] = self.blocked
+        goal = np.zeros((self.ny + 2, nx + 2), dtype=bool)
+        goal[1:-1, 1:-1] = self.goal
+        width = nx + 2
+        blocked = blocked.ravel().tolist()
+        goal = goal.ravel().tolist()
+
+        diagonal = math.sqrt(2)
+        straight = [(1, 1.0), (-1, 1.0), (width, 1.0), (-width, 1.0)]
+        corners = [(1, width), (1, -width), (-1, width), (-1, -width)]
+
+        def heuristic(cell):
+            (cy, cx) = divmod(cell, width)
+            d_x = max(gx_lo + 1 - cx, 0, cx - gx_hi - 1)
+            d_y = max(gy_lo + 1 - cy, 0, cy - gy_hi - 1)
+            return max(d_x, d_y) + (diagonal - 1) * min(d_x, d_y)
+
+        start = (start[1] + 1) * width + start[0] + 1
+        cost = {start: 0.0}
+        parent = {start: -1}
+        heap = [(heuristic(start), 0.0, start)]
+        while len(heap) > 0:
+            (f, g, cell) = heapq.heappop(heap)
+            if g > cost[cell]:
+                continue
+            if goal[cell]:
+                path = []
+                while cell != -1:
+                    (cy, cx) = divmod(cell, width)
+                    path.append((cx - 1, cy - 1))
+                    cell = parent[cell]
+                path.reverse()
+                return path
+
+            moves = [(cell + step, g + length) for (step, length) in straight]
+            for (a, b) in corners:
+                if not blocked[cell + a] and not blocked[cell + b]:
+                    moves.append((cell + a + b, g + diagonal))
+            for (next_cell, next_g) in moves:
+                if blocked[next_cell] or next_g >= cost.get(next_cell, next_g + 1):
+                    continue
+                cost[next_cell] = next_g
+                parent[next_cell] = cell
+                heapq.heappush(heap, (next_g + heuristic(next_cell), next_g, next_cell))
+        return None
+
+## Loads the occupancy grid of a world
+#
+# @param world The World
+# @param resolution The width of a cell
+# @param radius The pod radius
+# @return An OccupancyGrid, taken from the world's cache entry when the world
+# was loaded from a file
+def occupancy_grid(world, resolution=5.0, radius=10.0):
+    if world.file_name == None:
+        return OccupancyGrid(world, resolution, radius)
+
+    def build():
+        grid = OccupancyGrid(world, resolution, radius)
+        return np.stack([grid.blocked, grid.goal])
+    cells = cached_array(world.file_name, 'occupancy-%r-%r' % (float(resolution), float(radius)), build)
+    return OccupancyGrid(world, resolution, radius, cells=(cells[0], cells[1]))
+
+## Plans a route from a position to the end wall of a world
+#
+# @param world The World
+# @param x The start x coordinate
+# @param y The start y coordinate
+# @param resolution The width of an occupancy grid cell
+# @param radius The pod radius
+# @param spacing The spacing of the route's waypoints
+# @return An (n, 2) array of waypoints, starting at the free cell nearest the
+# start position and ending next to the end wall
+def plan_route(world, x, y, resolution=5.0, radius=10.0, spacing=10.0):
+    grid = occupancy_grid(world, resolution, radius)
+    start = grid.nearest_free(x, y)
+    if start == None:
+        raise ValueError("The world has no free cells at this resolution and radius")
+
+    key = (world.file_name, start, float(resolution), float(radius), float(spacing))
+    if world.file_name != None and key in plan_cache:
+        return plan_cache[key]
+
+    def build():
+        path = grid.search(start)
+        if path == None:
+            raise ValueError("No route from (%g, %g) to an end wall" % (x, y))
+        (c_x, c_y) = grid.centre(np.array([cell[0] for cell in path]), np.array([cell[1] for cell in path]))
+        route = simplify_route(np.column_stack([c_x, c_y]), grid.resolution / 2)
+        return resample_route(route, spacing)
+
+    if world.file_name == None:
+        return build()
+    name = 'plan-%r-%r-%r-%d-%d' % (float(resolution), float(radius), float(spacing), start[0], start[1])
+    route = cached_array(world.file_name, name, build)
+    plan_cache[key] = route
+    return route
@@ -0,0 +1,641 @@
+## @package PodBatches
+# Contains the batched pods used to simulate many pods of the same type in
+# one world.
+#
+# A pod batch stores the state of all of its pods in contiguous NumPy arrays
+# and steps the physics, collision checks and sensor casts for every pod at
+# once. It can be added to World.pods like a single pod.
+#
+# A batch brain must implement the following function:
+#
+# process_batch(self, sensor, state, dt)
+#
+# where sensor is the pod batch itself (see @ref PodBatch.sensor_val and
+# friends) and state is a BatchState. The sensor rays are only cast when
+# sensor_val or sensor_wall is first read after the pods move, so a brain
+# that does not use them costs no ray casts. The function returns a BatchControl (or
+# any object with up, down, left and right arrays). A list of ordinary
+# per-pod brains can be used instead of a batch brain, at the cost of calling
+# each of them in turn.
+#
+# Running this module checks that each batch class moves its pods exactly as
+# the matching simulation pods would (see check_batch()).
+import copy
+import random
+import sys
+from math import pi
+
+import numpy as np
+import pygame as pg
+
+from simulation import CarPod
+from simulation import Control
+from simulation import GravityPod
+from simulation import Pod
+from simulation import Sensor
+from simulation import State
+from simulation import World
+from simulation import red
+from simulation import resolve_sensors
+from simulation import rotate_poly
+
+## Batched Thruster Instructions
+#
+# The batched equivalent of simulation.Control.
+class BatchControl:
+    ## The BatchControl constructor
+    #
+    # @param self The object pointer
+    # @param n The number of pods
+    def __init__(self, n):
+        ## The main thruster instruction for each pod
+        self.up = np.zeros(n)
+        ## The downward thruster instruction for each pod
+        self.down = np.zeros(n)
+        ## The left thruster instruction for each pod
+        self.left = np.zeros(n)
+        ## The right thruster instruction for each pod
+        self.right = np.zeros(n)
+
+    ## Limits every instruction to the range 0 to 1
+    #
+    # @param self The object pointer
+    # @return None
+    def limit(self):
+        self.up = np.clip(self.up, 0, 1)
+        self.down = np.clip(self.down, 0, 1)
+        self.left = np.clip(self.left, 0, 1)
+        self.right = np.clip(self.right, 0, 1)
+
+## Batched Pod State
+#
+# The batched equivalent of simulation.State. The arrays are copies, so a
+# brain may change them (for example to add target_x and target_y) without
+# affecting the pods.
+class BatchState:
+    ## The BatchState constructor
+    #
+    # @param self The object pointer
+    # @param batch The PodBatch to copy the state from
+    def __init__(self, batch):
+        ## The x coordinate of each pod
+        self.x = batch.x.copy()
+        ## The y coordinate of each pod
+        self.y = batch.y.copy()
+        ## The x velocity of each pod
+        self.dxdt = batch.dxdt.copy()
+        ## The y velocity of each pod
+        self.dydt = batch.dydt.copy()
+        ## The angle of each pod
+        self.ang = batch.ang.copy()
+        ## The angular velocity of each pod
+        self.dangdt = batch.dangdt.copy()
+
+## Single Pod Row
+#
+# Holds one pod's values as plain floats so that it can be passed to
+# simulation.State and simulation.rotate_poly.
+class PodRow:
+    ## The PodRow constructor
+    #
+    # @param self The object pointer
+    # @param batch The PodBatch the pod belongs to
+    # @param i The index of the pod in the batch
+    def __init__(self, batch, i):
+        self.x = float(batch.x[i])
+        self.y = float(batch.y[i])
+        self.dxdt = float(batch.dxdt[i])
+        self.dydt = float(batch.dydt[i])
+        self.ang = float(batch.ang[i])
+        self.dangdt = float(batch.dangdt[i])
+
+## Pod Batch
+#
+# The base class for the batched pods. It holds the state arrays, casts the
+# sensor rays and draws the pods. Sub-classes implement step().
+class PodBatch:
+    ## The names of the arrays saved by get_state()
+    state_arrays = ('x', 'y', 'dxdt', 'dydt', 'ang', 'dangdt', 'collide', 'active', 'collide_count',
+                    'sensor_unread', 'sensor_x', 'sensor_y', 'sensor_ang', 'cast_val', 'cast_wall')
+
+    ## The PodBatch constructor
+    #
+    # @param self The object pointer
+    # @param n The number of pods in the batch
+    # @param nSensor The number of sensors on each pod
+    # @param sensorRange The range of the sensors
+    # @param brain A batch brain, or a list of n per-pod brains
+    # @param col The colour used to draw the pods
+    def __init__(self, n, nSensor, sensorRange, brain, col):
+        ## The number of pods in the batch
+        self.n = n
+        ## The batch brain, or list of per-pod brains
+        self.brain = brain
+        ## The colour used to draw the pods
+        self.col = col
+
+        ## The x coordinate of each pod
+        self.x = np.zeros(n)
+        ## The y coordinate of each pod
+        self.y = np.zeros(n)
+        ## The x velocity of each pod
+        self.dxdt = np.zeros(n)
+        ## The y velocity of each pod
+        self.dydt = np.zeros(n)
+        ## The angle of each pod
+        self.ang = np.full(n, pi)
+        ## The angular velocity of each pod
+        self.dangdt = np.zeros(n)
+
+        ## Flags showing which pods hit a wall on the last step
+        self.collide = np.zeros(n, dtype=bool)
+        ## Flags showing which pods are simulated. Inactive pods are frozen.
+        self.active = np.ones(n, dtype=bool)
+        ## The number of frames each pod is still drawn as collided
+        self.collide_count = np.zeros(n, dtype=np.intp)
+        ## The last thruster instructions
+        self.control = BatchControl(n)
+
+        ## The range of the sensors
+        self.sensor_range = sensorRange
+        ## Flags showing which pods have moved since their rays were cast
+        self.sensor_unread = np.zeros(n, dtype=bool)
+        ## The x coordinate each pod's rays are cast from
+        self.sensor_x = np.zeros(n)
+        ## The y coordinate each pod's rays are cast from
+        self.sensor_y = np.zeros(n)
+        ## The world the rays are cast in
+        self.sensor_world = None
+        self.set_sensor_layout(np.arange(nSensor) * pi * 2 / nSensor)
+
+    ## Replaces the sensors of every pod with one at each angle
+    #
+    # @param self The object pointer
+    # @param angles The angle of each sensor relative to the pod (see
+    # @ref SensorLayouts)
+    # @return None
+    def set_sensor_layout(self, angles):
+        n = self.n
+        ## The angle of each sensor relative to the pod
+        self.sensor_ang_ref = np.asarray(angles, dtype=np.float64)
+        n_sensor = len(self.sensor_ang_ref)
+        ## The absolute angle of each sensor, one row per pod
+        self.sensor_ang = np.zeros((n, n_sensor))
+        ## The distances cast so far, shared with @ref sensor_val
+        self.cast_val = np.zeros((n, n_sensor))
+        ## The wall indices cast so far, shared with @ref sensor_wall
+        self.cast_wall = np.full((n, n_sensor), -1, dtype=np.intp)
+        ## The segment each sensor hit when it was last cast (-1 for none)
+        self.cast_seg = np.full((n, n_sensor), -1, dtype=np.intp)
+        ## The distance to the nearest wall for each sensor, one row per pod
+        #
+        # Cast when first read after update_sensors() (see __getattr__()).
+        self.sensor_val = self.cast_val
+        ## The index of the wall each sensor sees (-1 for none)
+        self.sensor_wall = self.cast_wall
+        self.sensor_unread[:] = False
+
+    ## Casts the sensor rays when sensor_val or sensor_wall is read
+    #
+    # @param self The object pointer
+    # @param name The name of the attribute
+    # @return The attribute
+    #
+    # update_sensors() removes the two attributes, so reading either casts
+    # every unread ray in one batch and puts them back until the next step.
+    def __getattr__(self, name):
+        if name == 'sensor_val' or name == 'sensor_wall':
+            self.resolve_sensors()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    ## Moves every pod to the same position
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return None
+    #
+    # Called by World when it reads the pod's starting position.
+    def place(self, x, y):
+        self.x[:] = x
+        self.y[:] = y
+
+    ## Runs the brain for every pod
+    #
+    # @param self The object pointer
+    # @param dt The timestep
+    # @param world The world the pods are in
+    # @return A limited BatchControl
+    def think(self, dt, world):
+        if hasattr(self.brain, 'process_batch'):
+            control = self.brain.process_batch(self, BatchState(self), dt)
+        else:
+            control = BatchControl(self.n)
+            for (i, brain) in enumerate(self.brain):
+                if not self.active[i]:
+                    continue
+                result = brain.process(self.pod_sensors(i, world), State(PodRow(self, i)), dt)
+                result.limit()
+                control.up[i] = result.up
+                control.down[i] = result.down
+                control.left[i] = result.left
+                control.right[i] = result.right
+
+        limited = BatchControl(self.n)
+        for name in ('up', 'down', 'left', 'right'):
+            setattr(limited, name, np.where(self.active, np.asarray(getattr(control, name), dtype=np.float64), 0.0))
+        limited.limit()
+        self.control = limited
+        return limited
+
+    ## Builds the sensor list of one pod for a per-pod brain
+    #
+    # @param self The object pointer
+    # @param i The index of the pod
+    # @param world The world the pods are in
+    # @return A list of simulation.Sensor objects
+    #
+    # Only the rays of this pod are cast.
+    def pod_sensors(self, i, world):
+        self.resolve_sensors([i])
+        sensors = []
+        for j in range(len(self.sensor_ang_ref)):
+            sensor = Sensor(float(self.sensor_ang_ref[j]), self.sensor_range, "sensor" + str(j))
+            sensor.ang = float(self.sensor_ang[i, j])
+            sensor.val = float(self.cast_val[i, j])
+            wall = self.cast_wall[i, j]
+            sensor.wall = None if wall < 0 else world.walls[wall].name
+            sensors.append(sensor)
+        return sensors
+
+    ## Marks the sensors of every active pod as unread
+    #
+    # @param self The object pointer
+    # @param world The world the pods are in
+    # @return None
+    #
+    # The rays are cast by resolve_sensors() when they are first read.
+    def update_sensors(self, world):
+        self.sensor_ang = self.sensor_ang_ref[None, :] + self.ang[:, None]
+        self.sensor_x = self.x.copy()
+        self.sensor_y = self.y.copy()
+        self.sensor_world = world
+        self.sensor_unread = self.active.copy()
+        self.share_casts()
+
+    ## Casts the unread sensor rays
+    #
+    # @param self The object pointer
+    # @param rows The indices of the pods to cast for, or None for all of them
+    # @return None
+    #
+    # Each search stops at the segment the ray hit last time, if it still
+    # hits it.
+    def resolve_sensors(self, rows=None):
+        live = np.nonzero(self.sensor_unread)[0]
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.intp)
+            live = rows[self.sensor_unread[rows]]
+        if len(live) > 0:
+            world = self.sensor_world
+            if world.profiler != None:
+                world.profiler.push('sensors')
+            ang = self.sensor_ang[live]
+            x = np.repeat(self.sensor_x[live], ang.shape[1])
+            y = np.repeat(self.sensor_y[live], ang.shape[1])
+            (t, seg) = world.cast_rays(x, y,
+                                       x + self.sensor_range * np.sin(ang).ravel(),
+                                       y + self.sensor_range * np.cos(ang).ravel(),
+                                       self.cast_seg[live].ravel())
+
+            self.cast_seg[live] = seg.reshape(ang.shape)
+            self.cast_val[live] = (t * self.sensor_range).reshape(ang.shape)
+            self.cast_wall[live] = np.where(seg < 0, -1, world.seg_wall[np.maximum(seg, 0)]).reshape(ang.shape)
+            self.sensor_unread[live] = False
+            if world.profiler != None:
+                world.profiler.pop()
+
+        if not self.sensor_unread.any():
+            self.sensor_val = self.cast_val
+            self.sensor_wall = self.cast_wall
+
+    ## Checks each pod's move against the walls
+    #
+    # @param self The object pointer
+    # @param world The world the pods are in
+    # @param x_next The x coordinates the pods are moving to
+    # @param y_next The y coordinates the pods are moving to
+    # @return An array of flags, true for the active pods that can move
+    def free_moves(self, world, x_next, y_next):
+        free = self.active.copy()
+        live = np.nonzero(self.active)[0]
+        if len(live) > 0:
+            seg = world.check_collisions(self.x[live], self.y[live], x_next[live], y_next[live])
+            free[live] = seg < 0
+        return free
+
+    ## Draws the pods and their sensors
+    #
+    # @param self The object pointer
+    # @param screen The surface to draw on
+    # @return The rect drawn over
+    #
+    # The rays are drawn from each pod's pose, at the lengths cast at the last
+    # tick, so they move with the pods simulation.Simulation.draw() places
+    # between ticks.
+    def draw(self, screen):
+        self.collide_count = np.where(self.collide, 100, self.collide_count)
+
+        rects = []
+        for i in range(self.n):
+            row = PodRow(self, i)
+            for j in range(self.sensor_ang.shape[1]):
+                dist = self.sensor_val[i, j]
+                ang = self.sensor_ang_ref[j] + row.ang
+                col = (10, 10, 10) if self.sensor_wall[i, j] < 0 else (70, 70, 70)
+                rects.append(pg.draw.line(screen, col, (row.x, row.y),
+                                          (row.x + dist * np.sin(ang), row.y + dist * np.cos(ang)), 1))
+
+            if self.collide_count[i] > 0:
+                col = (255, 100, 100)
+                self.collide_count[i] -= 1
+            else:
+                col = self.col
+            rects.append(pg.draw.polygon(screen, col, rotate_poly(Pod.pod_poly_ref, row.ang, row)))
+            if self.control.up[i] > 0.0:
+                rects.append(pg.draw.polygon(screen, red, rotate_poly(Pod.thrust_poly_ref, row.ang, row)))
+            if self.control.left[i] > 0.0:
+                rects.append(pg.draw.polygon(screen, red, rotate_poly(Pod.left_poly_ref, row.ang, row)))
+            if self.control.right[i] > 0.0:
+                rects.append(pg.draw.polygon(screen, red, rotate_poly(Pod.right_poly_ref, row.ang, row)))
+
+        if len(rects) == 0:
+            return pg.Rect(0, 0, 0, 0)
+        return rects[0].unionall(rects)
+
+    ## Gets the dynamic state of every pod
+    #
+    # @param self The object pointer
+    # @return A flat float64 array of the arrays named in @ref state_arrays,
+    # followed by a flag showing if the sensors have been updated (see
+    # WorldStates). The thrusters and the brain are saved separately.
+    def get_state(self):
+        arrays = [np.asarray(getattr(self, name), dtype=np.float64).ravel() for name in self.state_arrays]
+        arrays.append([float(self.sensor_world is not None)])
+        return np.concatenate(arrays)
+
+    ## Restores the dynamic state of every pod
+    #
+    # @param self The object pointer
+    # @param values An array returned by get_state() for a batch of the same
+    # size and sensor layout
+    # @param world The world the pods are in
+    # @return None
+    #
+    # The arrays are replaced with copies, so the batch never shares them
+    # with values. The unread sensors are cast again when they are read.
+    def set_state(self, values, world):
+        first = 0
+        for name in self.state_arrays:
+            old = getattr(self, name)
+            setattr(self, name, values[first:first + old.size].reshape(old.shape).astype(old.dtype))
+            first += old.size
+        self.sensor_world = world if values[first] else None
+        self.cast_seg = np.full(self.cast_val.shape, -1, dtype=np.intp)
+        self.share_casts()
+
+    ## Copies the batch for a World fork
+    #
+    # @param self The object pointer
+    # @return A PodBatch with its own state arrays, sharing the brain and the
+    # physical constants until they are replaced
+    def fork(self):
+        batch = copy.copy(self)
+        for name in self.state_arrays + ('cast_seg',):
+            setattr(batch, name, getattr(self, name).copy())
+        batch.share_casts()
+        return batch
+
+    ## Points sensor_val and sensor_wall at the cast arrays, or removes them
+    # while any ray is unread so that reading them casts it
+    #
+    # @param self The object pointer
+    # @return None
+    def share_casts(self):
+        if self.sensor_unread.any():
+            self.__dict__.pop('sensor_val', None)
+            self.__dict__.pop('sensor_wall', None)
+        else:
+            self.sensor_val = self.cast_val
+            self.sensor_wall = self.cast_wall
+
+    ## Copies the batch for drawing while it steps on
+    #
+    # @param self The object pointer
+    # @return A PodBatch holding copies of the arrays draw() uses
+    def snapshot(self):
+        self.resolve_sensors()
+        snap = copy.copy(self)
+        for name in ('x', 'y', 'ang', 'collide', 'collide_count', 'cast_val', 'cast_wall'):
+            setattr(snap, name, getattr(self, name).copy())
+        snap.sensor_val = snap.cast_val
+        snap.sensor_wall = snap.cast_wall
+        snap.control = copy.copy(self.control)
+        return snap
+
+## Batched Gravity Pod
+#
+# Steps many simulation.GravityPod pods at once. The physics is the same as
+# GravityPod.step(), applied to whole arrays.
+class GravityPodBatch(PodBatch):
+    ## The GravityPodBatch constructor
+    #
+    # Takes the same parameters as @ref PodBatch.__init__. The physical
+    # constants are copied from simulation.GravityPod, and may be replaced with
+    # per-pod arrays.
+    def __init__(self, n, nSensor, sensorRange, brain, col):
+        PodBatch.__init__(self, n, nSensor, sensorRange, brain, col)
+        template = GravityPod(0, sensorRange, None, col)
+        ## The acceleration due to gravity
+        self.g = GravityPod.g
+        ## The mass of the pods
+        self.mass = template.mass
+        ## The angular inertia of the pods
+        self.inertia = template.inertia
+        ## The main thruster force
+        self.thrustMax = template.thrustMax
+        ## The side thruster force
+        self.spinThrustMax = template.spinThrustMax
+
+    ## Steps the physics of every pod
+    #
+    # @param self The object pointer
+    # @param dt The timestep
+    # @param world The world the pods are in
+    # @return None
+    def step(self, dt, world):
+        control = self.think(dt, world)
+
+        x_next = self.x + self.dxdt * dt
+        y_next = self.y + self.dydt * dt
+        free = self.free_moves(world, x_next, y_next)
+        hit = self.active & ~free
+
+        thrust = self.thrustMax * control.up
+        self.x = np.where(free, x_next, self.x)
+        self.y = np.where(free, y_next, self.y)
+        self.dydt = np.where(free, self.dydt + (thrust * np.cos(self.ang) / self.mass + self.g),
+                             np.where(hit, 0.0, self.dydt))
+        self.dxdt = np.where(free, self.dxdt + thrust * np.sin(self.ang) / self.mass,
+                             np.where(hit, 0.0, self.dxdt))
+        self.collide = np.where(self.active, hit, self.collide)
+
+        spin = (-control.right + control.left) * self.spinThrustMax / self.inertia
+        self.ang = np.where(self.active, self.ang + self.dangdt * dt, self.ang)
+        self.dangdt = np.where(self.active, self.dangdt + spin, self.dangdt)
+
+## Batched Car Pod
+#
+# Steps many simulation.CarPod pods at once. The physics is the same as
+# CarPod.step(), applied to whole arrays.
+class CarPodBatch(PodBatch):
+    ## The names of the arrays saved by get_state()
+    state_arrays = PodBatch.state_arrays + ('vel', 'slip')
+
+    ## The CarPodBatch constructor
+    #
+    # Takes the same parameters as @ref PodBatch.__init__. The physical
+    # constants are copied from simulation.CarPod, and may be replaced with
+    # per-pod arrays.
+    def __init__(self, n, nSensor, sensorRange, brain, col):
+        PodBatch.__init__(self, n, nSensor, sensorRange, brain, col)
+        template = CarPod(0, sensorRange, None, col)
+        ## The mass of the pods
+        self.mass = template.mass
+        ## The steering sensitivity
+        self.steer_factor = template.steer_factor
+        ## The main thruster force
+        self.thrust_max = template.thrust_max
+        ## The thruster force applied while slipping
+        self.slip_thrust_max = template.slip_thrust_max
+        ## The speed at which the pods start to slip
+        self.slip_speed_thresh = template.slip_speed_thresh
+        ## The speed at which the pods slip completely
+        self.slip_speed_max = template.slip_speed_max
+        ## The drag coefficient
+        self.damp = template.damp
+        ## The forward speed of each pod
+        self.vel = np.zeros(n)
+        ## The amount each pod is slipping (0 to 1)
+        self.slip = np.zeros(n)
+
+    ## Steps the physics of every pod
+    #
+    # @param self The object pointer
+    # @param dt The timestep
+    # @param world The world the pods are in
+    # @return None
+    def step(self, dt, world):
+        control = self.think(dt, world)
+        active = self.active
+        slip = self.slip
+        sin_ang = np.sin(self.ang)
+        cos_ang = np.cos(self.ang)
+
+        slip_thrust = (control.up - control.down) * slip * self.slip_thrust_max
+        dxdt = self.dxdt * slip + (1.0 - slip) * self.vel * sin_ang + sin_ang * slip_thrust * dt
+        dydt = self.dydt * slip + (1.0 - slip) * self.vel * cos_ang + cos_ang * slip_thrust * dt
+        x_next = self.x + dxdt * dt
+        y_next = self.y + dydt * dt
+        free = self.free_moves(world, x_next, y_next)
+        hit = active & ~free
+
+        moving = self.vel > 0
+        damp_fact = np.where(moving, self.vel * self.vel * self.vel / np.where(moving, np.abs(self.vel), 1.0), 0.0)
+        vel = np.where(free, self.vel + ((control.up - control.down) * self.thrust_max / self.mass - self.damp * damp_fact),
+                       np.where(hit, 0.0, self.vel))
+        turn = -control.right + control.left
+        ang = np.where(free, self.ang + (0.5 * (2.0 - slip) * turn * vel * self.steer_factor * dt + slip * self.dangdt * dt),
+                       np.where(hit, self.ang + turn * vel * self.steer_factor * dt, self.ang))
+
+        avel = np.abs(vel)
+        ramp = (avel - self.slip_speed_thresh) / (self.slip_speed_max - self.slip_speed_thresh)
+        new_slip = np.where(avel > self.slip_speed_max, 1.0, np.where(avel > self.slip_speed_thresh, ramp, 0.0))
+
+        self.x = np.where(free, x_next, self.x)
+        self.y = np.where(free, y_next, self.y)
+        self.dxdt = np.where(free, dxdt, np.where(hit, 0.0, self.dxdt))
+        self.dydt = np.where(free, dydt, np.where(hit, 0.0, self.dydt))
+        self.slip = np.where(free, new_slip, slip)
+        self.vel = vel
+        self.collide = np.where(active, hit, self.collide)
+        self.dangdt = np.where(active, (ang - self.ang) / dt, self.dangdt)
+        self.ang = ang
+
+## Random Brain
+#
+# Fires a pod's thrusters at random and casts its sensors, for check_batch().
+class RandomBrain:
+    ## The RandomBrain constructor
+    #
+    # @param self The object pointer
+    # @param seed The random seed
+    def __init__(self, seed):
+        ## The random number generator
+        self.random = random.Random(seed)
+
+    ## The process function for the RandomBrain
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects, which are all cast
+    # @param state The current state of the pod.  Unused.
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A Control object with random thruster instructions
+    def process(self, sensor, state, dt):
+        resolve_sensors(sensor)
+        control = Control()
+        control.up = self.random.random() * 1.2 - 0.1
+        control.down = self.random.random() * 0.2
+        control.left = self.random.random() * 0.4
+        control.right = self.random.random() * 0.4
+        return control
+
+## Checks that a pod batch moves exactly like the same pods stepped one by one
+#
+# @param pod_class The pod class, such as simulation.GravityPod
+# @param batch_class The matching batch class, such as GravityPodBatch
+# @param world_file The world file to fly in
+# @param n The number of pods
+# @param ticks The number of ticks to step
+# @return The number of ticks at which any pod's position, velocity, angle,
+# collision flag or sensor readings differ
+def check_batch(pod_class, batch_class, world_file, n=8, ticks=100):
+    pods = [pod_class(40, 1000, RandomBrain(i), (255, 0, 0)) for i in range(n)]
+    world = World(world_file, pods)
+    batch = batch_class(n, 40, 1000, [RandomBrain(i) for i in range(n)], (255, 0, 0))
+    batch_world = World(world_file, [batch])
+    for (i, pod) in enumerate(pods):
+        pod.ang = pi + 0.3 * i
+    batch.ang = np.array([pod.ang for pod in pods])
+
+    mismatches = 0
+    for tick in range(ticks):
+        world.step(0.1)
+        batch_world.step(0.1)
+        same = all((np.array([getattr(pod, name) for pod in pods]) == getattr(batch, name)).all()
+                   for name in ('x', 'y', 'dxdt', 'dydt', 'ang', 'dangdt', 'collide'))
+        resolve_sensors([sensor for pod in pods for sensor in pod.sensors])
+        values = np.array([[sensor.val for sensor in pod.sensors] for pod in pods])
+        if not same or (values != batch.sensor_val).any():
+            mismatches += 1
+    return mismatches
+
+if __name__ == '__main__':
+    failed = False
+    for world_file in ('world.txt', 'rect_world.txt'):
+        for (pod_class, batch_class) in ((GravityPod, GravityPodBatch), (CarPod, CarPodBatch)):
+            mismatches = check_batch(pod_class, batch_class, world_file)
+            print("%s %s: %d mismatched ticks" % (world_file, batch_class.__name__, mismatches))
+            failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,199 @@
+## @package Profiling
+# Contains the profiler used to find which stages of a tick take the time.
+#
+# The stages timed are:
+#
+# - navigator, dodger, recorder and controller - the modules run by
+#   MainController.MainController.process()
+# - sensors - the sensor ray casts (simulation.Pod.cast_sensors() and
+#   PodBatches.PodBatch.resolve_sensors())
+# - physics - the rest of each pod's step, including any brain that is not
+#   profiled itself
+#
+# Stages may be nested, and each stage is only charged for the time not spent
+# in the stages inside it, so the totals add up to the time spent stepping the
+# world. A world and its brains are only profiled while a Profiler is attached
+# to them. Otherwise the cost is one test per stage.
+#
+# Example:
+#
+# profiler = Profiler()
+# profiler.attach(world)
+# HeadlessSimulation(world, dt).run(ticks=1000)
+# print(profiler.report())
+# profiler.export('profile.json')
+import json
+import time
+
+try:
+    ## The clock used for timing, in integer nanoseconds
+    clock_ns = time.perf_counter_ns
+except AttributeError:
+    ## The clock used for timing, in integer nanoseconds (a fallback for
+    # Pythons without time.perf_counter_ns)
+    def clock_ns():
+        return int(time.time() * 1e9)
+
+## The stages in the order they are reported
+STAGES = ('navigator', 'dodger', 'recorder', 'controller', 'physics', 'sensors')
+
+## Stage Statistics
+#
+# The time spent in one stage.
+class StageStats:
+    ## The StageStats constructor
+    #
+    # @param self The object pointer
+    # @param name The name of the stage
+    def __init__(self, name):
+        ## The name of the stage
+        self.name = name
+        ## The number of times the stage has run
+        self.calls = 0
+        ## The total time spent in the stage, in nanoseconds
+        self.total_ns = 0
+        ## The longest single run of the stage, in nanoseconds
+        self.max_ns = 0
+
+    ## Adds one run of the stage
+    #
+    # @param self The object pointer
+    # @param ns The time spent, in nanoseconds
+    # @return None
+    def add(self, ns):
+        self.calls += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    ## Finds the mean time of a run
+    #
+    # @param self The object pointer
+    # @return The mean time, in nanoseconds
+    def mean_ns(self):
+        if self.calls == 0:
+            return 0.0
+        return float(self.total_ns) / self.calls
+
+## Profiler
+#
+# Accumulates the time spent in each stage. The statistics in @ref stages
+# are updated as the simulation runs, so they can be read (or shown by a
+# painter) at any time.
+class Profiler:
+    ## The Profiler constructor
+    #
+    # @param self The object pointer
+    def __init__(self):
+        ## The StageStats of each stage, by name
+        self.stages = {}
+        ## The number of world ticks profiled
+        self.ticks = 0
+        ## The stages currently running, as [name, start, time in inner stages]
+        self.stack = []
+
+    ## Clears the statistics
+    #
+    # @param self The object pointer
+    # @return None
+    def reset(self):
+        self.stages = {}
+        self.ticks = 0
+        self.stack = []
+
+    ## Starts timing a stage
+    #
+    # @param self The object pointer
+    # @param name The name of the stage
+    # @return None
+    def push(self, name):
+        self.stack.append([name, clock_ns(), 0])
+
+    ## Stops timing the most recently started stage
+    #
+    # @param self The object pointer
+    # @return None
+    def pop(self):
+        (name, start, inner) = self.stack.pop()
+        elapsed = clock_ns() - start
+        stats = self.stages.get(name)
+        if stats == None:
+            stats = self.stages[name] = StageStats(name)
+        stats.add(elapsed - inner)
+        if len(self.stack) > 0:
+            self.stack[-1][2] += elapsed
+
+    ## Starts profiling a world and its brains
+    #
+    # @param self The object pointer
+    # @param world The World
+    # @return None
+    #
+    # Brains with a profiler attribute (such as MainController.MainController)
+    # time their own stages.
+    def attach(self, world):
+        self.set_profiler(world, self)
+
+    ## Stops profiling a world and its brains
+    #
+    # @param self The object pointer
+    # @param world The World
+    # @return None
+    def detach(self, world):
+        self.set_profiler(world, None)
+
+    ## Sets the profiler of a world and its brains
+    #
+    # @param self The object pointer
+    # @param world The World
+    # @param profiler The Profiler, or None
+    # @return None
+    def set_profiler(self, world, profiler):
+        world.profiler = profiler
+        for pod in world.pods:
+            brains = pod.brain if isinstance(pod.brain, list) else [pod.brain]
+            for brain in brains:
+                if hasattr(brain, 'profiler'):
+                    brain.profiler = profiler
+
+    ## Summarises the statistics
+    #
+    # @param self The object pointer
+    # @return A list holding a dictionary for each stage that has run (name,
+    # calls, total_ms, mean_us, max_us, per_tick_us and share), known
+    # stages first
+    def summary(self):
+        names = [name for name in STAGES if name in self.stages]
+        names += sorted(name for name in self.stages if name not in STAGES)
+        total = sum(stats.total_ns for stats in self.stages.values())
+        rows = []
+        for name in names:
+            stats = self.stages[name]
+            rows.append({'name': name, 'calls': stats.calls, 'total_ms': stats.total_ns / 1e6,
+                         'mean_us': stats.mean_ns() / 1e3, 'max_us': stats.max_ns / 1e3,
+                         'per_tick_us': stats.total_ns / 1e3 / max(self.ticks, 1),
+                         'share': float(stats.total_ns) / total if total > 0 else 0.0})
+        return rows
+
+    ## Formats the statistics as a table
+    #
+    # @param self The object pointer
+    # @return A string with one line per stage
+    def report(self):
+        lines = ["%d ticks" % self.ticks,
+                 "%-12s %9s %11s %10s %10s %11s %6s" % ('stage', 'calls', 'total ms', 'mean us', 'max us', 'us/tick', 'share')]
+        for row in self.summary():
+            lines.append("%-12s %9d %11.2f %10.2f %10.1f %11.2f %5.1f%%" %
+                         (row['name'], row['calls'], row['total_ms'], row['mean_us'], row['max_us'],
+                          row['per_tick_us'], 100 * row['share']))
+        return "\n".join(lines)
+
+    ## Writes the statistics to a JSON file
+    #
+    # @param self The object pointer
+    # @param filename The file to write
+    # @return None
+    def export(self, filename):
+        out = open(filename, 'w')
+        json.dump({'ticks': self.ticks, 'stages': self.summary()}, out, indent=4, sort_keys=True)
+        out.close()
@@ -0,0 +1,237 @@
+## @package RayCasting
+# Contains the vectorised ray casting engine used to test many rays (or pod
+# motion segments) against every wall segment in the world in a single NumPy
+# operation.
+#
+# The engine reproduces simulation.intersect() and the tolerance rules used by
+# World.find_closest_intersect() and World.check_collide_with_wall() exactly,
+# so swapping it in does not change the simulation results.
+#
+# A segment index must implement the following functions:
+#
+# closest_intersect(self, p0_x, p0_y, p1_x, p1_y)
+# closest_intersects(self, p0_x, p0_y, p1_x, p1_y, t_max=None)
+# first_collision(self, p0_x, p0_y, p1_x, p1_y)
+# first_collisions(self, p0_x, p0_y, p1_x, p1_y)
+#
+# The closest functions return a tuple (t, segment), where t is the normalised
+# distance along the ray and segment is the index of the segment that was hit
+# in the packed segment array (or -1 if nothing was hit, in which case t is 2).
+# The collision functions return the index of the first segment (in file
+# order) that the motion segment crosses, or -1. The plural forms take arrays
+# of rays (or motion segments) and return arrays.
+#
+# t_max is an optional array holding, for each ray, a distance at which the
+# ray is already known to hit a segment (see hint_bounds()). The index may
+# stop searching a ray beyond it, which makes short hits much cheaper to find
+# in a spatial index. The results are the same as without it.
+import numpy as np
+
+## The value used by simulation.intersect() for parallel lines
+HUGE = 1e6
+
+## The maximum number of ray/segment pairs evaluated in one NumPy operation
+#
+# Large worlds are processed in blocks of segments so that memory use stays
+# bounded.
+BLOCK_SIZE = 1 << 18
+
+## Packs the segments of a list of walls into a single array
+#
+# @param walls A list of Wall objects
+# @return A tuple (segs, seg_wall) where segs is an (n, 4) array of
+# x1, y1, x2, y2 rows in file order and seg_wall holds the index of the wall
+# each segment belongs to.
+def pack_segments(walls):
+    segs = []
+    seg_wall = []
+    for (i, wall) in enumerate(walls):
+        segs.extend(wall.segments)
+        seg_wall.extend([i] * len(wall.segments))
+
+    segs = np.array(segs, dtype=np.float64).reshape(-1, 4)
+    seg_wall = np.array(seg_wall, dtype=np.intp)
+    return (segs, seg_wall)
+
+## Vectorised version of simulation.intersect()
+#
+# @return A tuple (s, t) of arrays broadcast from the inputs. Parallel lines
+# give HUGE for both values, as in the scalar version.
+#
+# The arithmetic is performed in the same order as the scalar version, so the
+# results are bit-for-bit identical.
+def intersect_arrays(p0_x, p0_y, p1_x, p1_y, p2_x, p2_y, p3_x, p3_y):
+    s1_x = p1_x - p0_x
+    s1_y = p1_y - p0_y
+    s2_x = p3_x - p2_x
+    s2_y = p3_y - p2_y
+
+    fact = (-s2_x * s1_y + s1_x * s2_y)
+    parallel = fact == 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (-s1_y * (p0_x - p2_x) + s1_x * (p0_y - p2_y)) / fact
+        t = (s2_x * (p0_y - p2_y) - s2_y * (p0_x - p2_x)) / fact
+
+    s = np.where(parallel, HUGE, s)
+    t = np.where(parallel, HUGE, t)
+    return (s, t)
+
+## Finds the closest segment hit by each of a set of rays
+#
+# @param segs An (n, 4) array of segments
+# @param p0_x The x coordinates of the ray origins (scalar or array)
+# @param p0_y The y coordinates of the ray origins (scalar or array)
+# @param p1_x The x coordinates of the ray ends
+# @param p1_y The y coordinates of the ray ends
+# @param tol The tolerance applied to both s and t (simulation.small)
+# @return A tuple (t, seg) of arrays with one entry per ray. Rays that hit
+# nothing have t = 2 and seg = -1.
+#
+# When several segments are hit at exactly the same distance, the first one in
+# the array wins, matching the strict comparison in
+# World.find_closest_intersect().
+def closest_hits(segs, p0_x, p0_y, p1_x, p1_y, tol):
+    (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+        np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+        np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+    n_rays = p0_x.shape[0]
+
+    t_min = np.full(n_rays, 2.0)
+    seg_min = np.full(n_rays, -1, dtype=np.intp)
+    if n_rays == 0 or len(segs) == 0:
+        return (t_min, seg_min)
+
+    block = max(1, BLOCK_SIZE // n_rays)
+    rays = (p0_x[:, None], p0_y[:, None], p1_x[:, None], p1_y[:, None])
+    for start in range(0, len(segs), block):
+        seg_block = segs[start:start + block]
+        (s, t) = intersect_arrays(rays[0], rays[1], rays[2], rays[3],
+                                  seg_block[:, 0], seg_block[:, 1],
+                                  seg_block[:, 2], seg_block[:, 3])
+
+        hit = (t >= -tol) & (t <= 1 + tol) & (s >= -tol) & (s <= 1 + tol)
+        t = np.where(hit, t, 2.0)
+
+        best = np.argmin(t, axis=1)
+        t_best = t[np.arange(n_rays), best]
+        better = t_best < t_min
+        t_min = np.where(better, t_best, t_min)
+        seg_min = np.where(better, best + start, seg_min)
+
+    return (t_min, seg_min)
+
+## Finds the distance at which each ray hits a hinted segment
+#
+# @param segs An (n, 4) array of segments
+# @param p0_x The x coordinates of the ray origins (scalar or array)
+# @param p0_y The y coordinates of the ray origins (scalar or array)
+# @param p1_x The x coordinates of the ray ends
+# @param p1_y The y coordinates of the ray ends
+# @param hint An array holding a segment index for each ray (-1 for none),
+# usually the segment the ray hit on the previous tick
+# @param tol The tolerance applied to both s and t (simulation.small)
+# @return An array of t_max bounds for closest_intersects(): the distance to
+# the hinted segment where the ray still hits it, and 1 + tol elsewhere.
+#
+# Uses the same arithmetic as closest_hits(), so a bound is exactly the t the
+# full search finds for that segment.
+def hint_bounds(segs, p0_x, p0_y, p1_x, p1_y, hint, tol):
+    hint = np.asarray(hint, dtype=np.intp)
+    if len(segs) == 0:
+        return np.full(hint.shape, 1 + tol)
+
+    seg = segs[np.maximum(hint, 0)]
+    (s, t) = intersect_arrays(np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+                              np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64),
+                              seg[:, 0], seg[:, 1], seg[:, 2], seg[:, 3])
+    hit = (hint >= 0) & (t >= -tol) & (t <= 1 + tol) & (s >= -tol) & (s <= 1 + tol)
+    return np.where(hit, t, 1 + tol)
+
+## Finds the first segment crossed by each of a set of motion segments
+#
+# @param segs An (n, 4) array of segments
+# @param p0_x The x coordinates of the start points
+# @param p0_y The y coordinates of the start points
+# @param p1_x The x coordinates of the end points
+# @param p1_y The y coordinates of the end points
+# @return An array holding, for each motion segment, the index of the first
+# segment in the array that it crosses, or -1.
+#
+# Matches World.check_collide_with_wall(): no tolerance is applied and a motion
+# segment of zero length never collides.
+def first_hits(segs, p0_x, p0_y, p1_x, p1_y):
+    (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+        np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+        np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+    n_moves = p0_x.shape[0]
+
+    seg_first = np.full(n_moves, -1, dtype=np.intp)
+    moving = (p0_x != p1_x) | (p0_y != p1_y)
+    if n_moves == 0 or len(segs) == 0 or not moving.any():
+        return seg_first
+
+    block = max(1, BLOCK_SIZE // n_moves)
+    moves = (p0_x[:, None], p0_y[:, None], p1_x[:, None], p1_y[:, None])
+    for start in range(0, len(segs), block):
+        seg_block = segs[start:start + block]
+        (s, t) = intersect_arrays(moves[0], moves[1], moves[2], moves[3],
+                                  seg_block[:, 0], seg_block[:, 1],
+                                  seg_block[:, 2], seg_block[:, 3])
+
+        hit = (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1) & moving[:, None]
+        found = hit.any(axis=1) & (seg_first < 0)
+        seg_first = np.where(found, np.argmax(hit, axis=1) + start, seg_first)
+
+        if (seg_first >= 0).all():
+            break
+
+    return seg_first
+
+## Brute-Force Segment Index
+#
+# This index tests every ray against every segment in the world, but does so
+# for all of a pod's rays at once in a single NumPy operation. It is the
+# fastest option for small worlds, where building a spatial index is not worth
+# the effort.
+class SegmentArray:
+    ## The SegmentArray constructor
+    #
+    # @param self The object pointer
+    # @param segs An (n, 4) array of segments
+    # @param tol The tolerance used for ray casts (simulation.small)
+    def __init__(self, segs, tol):
+        ## The packed segment array
+        self.segs = segs
+        ## The tolerance used for ray casts
+        self.tol = tol
+
+    ## Finds the closest segment hit by a single ray
+    #
+    # @param self The object pointer
+    # @return A tuple (t, segment)
+    def closest_intersect(self, p0_x, p0_y, p1_x, p1_y):
+        (t, seg) = closest_hits(self.segs, p0_x, p0_y, [p1_x], [p1_y], self.tol)
+        return (float(t[0]), int(seg[0]))
+
+    ## Finds the closest segment hit by each of a set of rays
+    #
+    # @param self The object pointer
+    # @param t_max Unused, as every segment is tested anyway
+    # @return A tuple (t, segment) of arrays
+    def closest_intersects(self, p0_x, p0_y, p1_x, p1_y, t_max=None):
+        return closest_hits(self.segs, p0_x, p0_y, p1_x, p1_y, self.tol)
+
+    ## Finds the first segment crossed by a motion segment
+    #
+    # @param self The object pointer
+    # @return The index of the segment, or -1
+    def first_collision(self, p0_x, p0_y, p1_x, p1_y):
+        return int(first_hits(self.segs, p0_x, p0_y, [p1_x], [p1_y])[0])
+
+    ## Finds the first segment crossed by each of a set of motion segments
+    #
+    # @param self The object pointer
+    # @return An array of segment indices (-1 for no collision)
+    def first_collisions(self, p0_x, p0_y, p1_x, p1_y):
+        return first_hits(self.segs, p0_x, p0_y, p1_x, p1_y)
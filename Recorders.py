@@ -2,9 +2,21 @@
 # Contains all of the recorders used to dump sensor and state data to a file
 # during the simulation.
 #
-# A recorder must implement the following function:
+# A recorder must implement the following functions:
 #
 # process(self, sensor, state)
+#
+# close(self)
+#
+# close() is called when the recorder is replaced or the simulation ends, and
+# must write out any buffered data.
+import io
+import zipfile
+
+import numpy as np
+
+from Routes import StreamingSimplifier
+from simulation import resolve_sensors
 
 ## Route Recorder
 #
@@ -27,8 +39,61 @@ class RouteRecorder:
     #        - y
     # @return None
     def process(self, sensor, state):
-        sensor_data = str(state.x) + ',' + str(state.y)
-        self.file.write(sensor_data + '\n')
+        self.file.write(str(state.x) + ',' + str(state.y) + '\n')
+
+    ## Closes the file
+    #
+    # @param self The object pointer
+    # @return None
+    def close(self):
+        self.file.close()
+
+## Compact Route Recorder
+#
+# This recorder records the route of the pod like RouteRecorder, but passes
+# the positions through a @ref Routes.StreamingSimplifier so that only the
+# points needed to describe the route (to within a tolerance) are written.
+# Hovering and straight flight add no points.
+class CompactRouteRecorder:
+    ## The CompactRouteRecorder constructor
+    #
+    # @param self The object pointer
+    # @param file_name The name of the file to store to
+    # @param tolerance The largest distance a dropped position may lie from
+    # the recorded route
+    def __init__(self, file_name, tolerance=1.0):
+        ## The file the data is saved to.
+        self.file = open(file_name, 'w')
+        ## The simplifier choosing the points to keep
+        self.simplifier = StreamingSimplifier(tolerance)
+
+    ## Writes a list of points to the file
+    #
+    # @param self The object pointer
+    # @param points A list of (x, y) tuples
+    # @return None
+    def write(self, points):
+        for (x, y) in points:
+            self.file.write(str(x) + ',' + str(y) + '\n')
+
+    ## The process function for the CompactRouteRecorder
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects. Unused.
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    # @return None
+    def process(self, sensor, state):
+        self.write(self.simplifier.add(state.x, state.y))
+
+    ## Writes the last position and closes the file
+    #
+    # @param self The object pointer
+    # @return None
+    def close(self):
+        self.write(self.simplifier.finish())
+        self.file.close()
 
 ## Sensor Recorder
 #
@@ -54,8 +119,172 @@ class SensorRecorder:
     #        - y
     # @return None
     def process(self, sensor, state):
-        sensor_data = str(state.x) + ',' + str(state.y) + ','
-        for i in range(0, 40):
-            sensor_data += str(sensor[i].ang) + ',' + str(sensor[i].val) \
-                + ',' + sensor[i].wall + ','
-        self.file.write(sensor_data + '\n')
+        resolve_sensors(sensor)
+        fields = [str(state.x), str(state.y)]
+        for i in range(0, len(sensor)):
+            fields.extend((str(sensor[i].ang), str(sensor[i].val), str(sensor[i].wall)))
+        fields.append('\n')
+        self.file.write(','.join(fields))
+
+    ## Closes the file
+    #
+    # @param self The object pointer
+    # @return None
+    def close(self):
+        self.file.close()
+
+## Binary Recorder
+#
+# This recorder records the state and sensor values of the pod in to
+# preallocated NumPy buffers. Each time the buffers fill they are written to
+# the output file as one block, so the simulation only touches the disk once
+# every block_size ticks.
+#
+# The output is a .npz file (a zip of .npy arrays) holding one array per
+# column per block, named block0000/x, block0000/y and so on, plus a
+# wall_names array. Use load_recording() to read it back as whole columns.
+#
+# The columns are:
+# - tick - the number of the call to process()
+# - x, y, dxdt, dydt, ang, dangdt - the pod state
+# - sensor_ang, sensor_val - one row of sensor angles and values per tick
+# - sensor_wall - the index in wall_names of the wall each sensor sees, or -1
+class BinaryRecorder:
+    ## The names of the state columns
+    STATE_COLUMNS = ['x', 'y', 'dxdt', 'dydt', 'ang', 'dangdt']
+
+    ## The BinaryRecorder constructor
+    #
+    # @param self The object pointer
+    # @param file_name The name of the file to store to
+    # @param block_size The number of ticks buffered before a block is written
+    def __init__(self, file_name, block_size=4096):
+        ## The zip file the data is saved to.
+        self.file = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_STORED, True)
+        ## The number of ticks buffered before a block is written
+        self.block_size = block_size
+        ## The number of blocks written
+        self.blocks = 0
+        ## The number of rows in the buffers
+        self.rows = 0
+        ## The number of calls to process()
+        self.tick = 0
+        ## The names of the walls seen so far
+        self.wall_names = []
+        ## The index of each wall name in wall_names
+        self.wall_ids = {None: -1, 'None': -1}
+        ## The column buffers, allocated on the first call to process()
+        self.columns = None
+
+    ## Allocates the column buffers
+    #
+    # @param self The object pointer
+    # @param n_sensors The number of sensors on the pod
+    # @return None
+    def allocate(self, n_sensors):
+        size = self.block_size
+        self.columns = {'tick': np.zeros(size, dtype=np.int64),
+                        'sensor_ang': np.zeros((size, n_sensors)),
+                        'sensor_val': np.zeros((size, n_sensors)),
+                        'sensor_wall': np.zeros((size, n_sensors), dtype=np.int32)}
+        for name in self.STATE_COLUMNS:
+            self.columns[name] = np.zeros(size)
+
+    ## Finds the index of a wall name, adding it if it is new
+    #
+    # @param self The object pointer
+    # @param name The wall name
+    # @return The index of the name in wall_names
+    def wall_id(self, name):
+        if name not in self.wall_ids:
+            self.wall_ids[name] = len(self.wall_names)
+            self.wall_names.append(name)
+        return self.wall_ids[name]
+
+    ## The process function for the BinaryRecorder
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects. Must be a list of objects with the following properties:
+    #        - ang
+    #        - val
+    #        - wall
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    #        - dxdt
+    #        - dydt
+    #        - ang
+    #        - dangdt
+    # @return None
+    def process(self, sensor, state):
+        if self.columns == None:
+            self.allocate(len(sensor))
+
+        row = self.rows
+        columns = self.columns
+        columns['tick'][row] = self.tick
+        for name in self.STATE_COLUMNS:
+            columns[name][row] = getattr(state, name)
+        resolve_sensors(sensor)
+        columns['sensor_ang'][row] = [s.ang for s in sensor]
+        columns['sensor_val'][row] = [s.val for s in sensor]
+        columns['sensor_wall'][row] = [self.wall_id(s.wall) for s in sensor]
+
+        self.tick += 1
+        self.rows += 1
+        if self.rows == self.block_size:
+            self.flush()
+
+    ## Writes an array in to the output file
+    #
+    # @param self The object pointer
+    # @param name The array name
+    # @param array The array
+    # @return None
+    def write_array(self, name, array):
+        data = io.BytesIO()
+        np.save(data, array)
+        self.file.writestr(name + '.npy', data.getvalue())
+
+    ## Writes the buffered rows to the output file as one block
+    #
+    # @param self The object pointer
+    # @return None
+    def flush(self):
+        if self.rows == 0:
+            return
+        prefix = 'block%04d/' % self.blocks
+        for (name, column) in sorted(self.columns.items()):
+            self.write_array(prefix + name, column[:self.rows])
+        self.blocks += 1
+        self.rows = 0
+
+    ## Writes any buffered rows and the wall names, and closes the file
+    #
+    # @param self The object pointer
+    # @return None
+    def close(self):
+        if self.file == None:
+            return
+        self.flush()
+        self.write_array('wall_names', np.array(self.wall_names, dtype=str))
+        self.file.close()
+        self.file = None
+
+## Loads a file written by a BinaryRecorder
+#
+# @param file_name The file to load
+# @return A dictionary mapping each column name (and wall_names) to an array
+# holding the whole recording
+def load_recording(file_name):
+    data = np.load(file_name)
+    blocks = {}
+    for name in sorted(data.files, key=lambda name: (len(name), name)):
+        if '/' in name:
+            (block, column) = name.split('/')
+            blocks.setdefault(column, []).append(data[name])
+
+    recording = dict((column, np.concatenate(arrays)) for (column, arrays) in blocks.items())
+    recording['wall_names'] = data['wall_names']
+    data.close()
+    return recording
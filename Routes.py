@@ -0,0 +1,626 @@
+## @package Routes
+# Contains the route loader used by the navigators.
+#
+# A route file is a comma-separated values file with one coordinate per line:
+#
+# target_x_1, target_y_1\n
+# target_x_2, target_y_2\n
+# ...\n
+#
+# load_route() parses the whole file in one pass in to an (n, 2) NumPy array
+# and saves a binary copy next to it (routeData.csv is cached in
+# routeData.csv.npz). The copy is used until the file's modification time or
+# size changes and its contents no longer match the saved hash. Each route is
+# only loaded once per process: every navigator given the same file shares
+# one read only array.
+#
+# RouteIndex answers nearest waypoint and distance-along-the-route queries on
+# a route, and RouteProgress uses it to follow a route with many pods at once.
+#
+# Recorded routes (one point per tick) can be compacted with compact_route(),
+# or from the command line:
+#
+# python Routes.py routeData.csv routeNew.csv --tolerance 2 --spacing 10
+import argparse
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from SpatialIndex import expand_ranges
+
+## The extension added to a route file's name to give its binary copy
+CACHE_EXTENSION = '.npz'
+
+## The routes loaded by this process, keyed by absolute file name. Each entry
+# is a tuple (stamp, route).
+route_cache = {}
+
+## The route indexes built by this process, keyed by absolute file name. Each
+# entry is a tuple (route, index).
+index_cache = {}
+
+## The maximum number of cells in a RouteIndex grid
+MAX_CELLS = 1 << 20
+
+## The number of distances found in one NumPy operation by a brute force
+# nearest waypoint search
+BLOCK_SIZE = 1 << 20
+
+## Gets the modification time and size of a file
+#
+# @param filename The file
+# @return An array [mtime, size]
+def file_stamp(filename):
+    info = os.stat(filename)
+    return np.array([info.st_mtime, info.st_size], dtype=float)
+
+## Hashes the contents of a file
+#
+# @param filename The file
+# @return The hex SHA-1 digest of the file
+def file_hash(filename):
+    fin = open(filename, 'rb')
+    digest = hashlib.sha1(fin.read()).hexdigest()
+    fin.close()
+    return digest
+
+## Parses a route file
+#
+# @param filename The route file
+# @return An (n, 2) array of coordinates. Any extra columns, including empty
+# ones left by trailing commas, are ignored.
+#
+# The file is parsed in bulk, and only parsed row by row if some rows are
+# malformed (for example with too few columns for the bulk parser).
+def parse_route(filename):
+    fin = open(filename, 'r')
+    text = fin.read()
+    fin.close()
+    if len(text.strip()) == 0:
+        return np.zeros((0, 2))
+    try:
+        return np.loadtxt(text.splitlines(), delimiter=',', usecols=(0, 1), ndmin=2)
+    except ValueError:
+        pass
+
+    rows = [line for line in text.splitlines() if len(line.strip()) != 0]
+    return np.array([[float(value) for value in row.split(',')[:2]] for row in rows], dtype=float).reshape(-1, 2)
+
+## Saves the binary copy of a route
+#
+# @param filename The route file
+# @param route The parsed route
+# @param stamp The file stamp the route was parsed from
+# @param digest The hash of the file the route was parsed from
+# @return None
+#
+# The copy is written to a temporary file and renamed, so other processes
+# never see half a file. Failure to write it (for example in a read only
+# directory) is ignored.
+def save_cache(filename, route, stamp, digest):
+    temp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        out = open(temp, 'wb')
+        np.savez(out, route=route, stamp=stamp, hash=np.array(digest))
+        out.close()
+        os.rename(temp, filename + CACHE_EXTENSION)
+    except (IOError, OSError):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+## Loads a route from its binary copy, if the copy is up to date
+#
+# @param filename The route file
+# @param stamp The current file stamp
+# @return The route, or None if there is no usable copy
+def load_cache(filename, stamp):
+    cache = filename + CACHE_EXTENSION
+    if not os.path.exists(cache):
+        return None
+    try:
+        data = np.load(cache)
+        (route, saved_stamp, digest) = (data['route'], data['stamp'], str(data['hash']))
+        data.close()
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+    if np.array_equal(saved_stamp, stamp):
+        return route
+
+    # The file was touched. Keep the copy if the contents did not change.
+    if file_hash(filename) == digest:
+        save_cache(filename, route, stamp, digest)
+        return route
+    return None
+
+## Loads a route
+#
+# @param filename The route file
+# @return A read only (n, 2) array of coordinates, shared with every other
+# caller that loads the same file
+def load_route(filename):
+    key = os.path.abspath(filename)
+    stamp = file_stamp(filename)
+    if key in route_cache and np.array_equal(route_cache[key][0], stamp):
+        return route_cache[key][1]
+
+    route = load_cache(filename, stamp)
+    if route is None:
+        route = parse_route(filename)
+        save_cache(filename, route, stamp, file_hash(filename))
+
+    route.flags.writeable = False
+    route_cache[key] = (stamp, route)
+    return route
+
+## Saves a route file
+#
+# @param filename The route file
+# @param route An (n, 2) array of coordinates
+# @return None
+def save_route(filename, route):
+    out = open(filename, 'w')
+    out.write(''.join('%r,%r\n' % (x, y) for (x, y) in np.asarray(route).tolist()))
+    out.close()
+
+## Finds the distance of a set of points from a line segment
+#
+# @param points An (n, 2) array of points
+# @param a The (x, y) start of the segment
+# @param b The (x, y) end of the segment
+# @return An array of distances
+def segment_distances(points, a, b):
+    (d_x, d_y) = (b[0] - a[0], b[1] - a[1])
+    length2 = d_x * d_x + d_y * d_y
+    if length2 == 0:
+        return np.hypot(points[:, 0] - a[0], points[:, 1] - a[1])
+    t = np.clip(((points[:, 0] - a[0]) * d_x + (points[:, 1] - a[1]) * d_y) / length2, 0, 1)
+    return np.hypot(points[:, 0] - (a[0] + t * d_x), points[:, 1] - (a[1] + t * d_y))
+
+## Removes repeated points from a route
+#
+# @param route An (n, 2) array of coordinates
+# @return The route without points equal to the one before them
+def remove_repeats(route):
+    if len(route) == 0:
+        return route
+    moved = np.any(route[1:] != route[:-1], axis=1)
+    return route[np.concatenate([[True], moved])]
+
+## Simplifies a route with the Ramer-Douglas-Peucker algorithm
+#
+# @param route An (n, 2) array of coordinates
+# @param tolerance The largest distance any removed point may lie from the
+# simplified route
+# @return The simplified route, which always keeps the first and last points
+def simplify_route(route, tolerance):
+    route = np.asarray(route, dtype=float)
+    if len(route) < 3:
+        return route.copy()
+
+    keep = np.zeros(len(route), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(route) - 1)]
+    while len(stack) > 0:
+        (first, last) = stack.pop()
+        if last - first < 2:
+            continue
+        distances = segment_distances(route[first + 1:last], route[first], route[last])
+        i = int(distances.argmax())
+        if distances[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return route[keep]
+
+## Resamples a route at (roughly) even spacing
+#
+# @param route An (n, 2) array of coordinates
+# @param spacing The distance between waypoints on straight parts of the route
+# @param curvature_gain If above 0, extra waypoints are placed where the route
+# turns. Each radian of turn counts as this many extra pixels of route.
+# @return The resampled route, which always keeps the first and last points
+def resample_route(route, spacing, curvature_gain=0):
+    route = remove_repeats(np.asarray(route, dtype=float))
+    if len(route) < 2:
+        return route.copy()
+
+    d = np.diff(route, axis=0)
+    steps = np.hypot(d[:, 0], d[:, 1])
+    arc = np.concatenate([[0.0], np.cumsum(steps)])
+
+    # Each segment is weighted by its length plus half the turn at each end.
+    weight = steps.copy()
+    if curvature_gain > 0 and len(route) > 2:
+        heading = np.arctan2(d[:, 1], d[:, 0])
+        turn = np.abs((np.diff(heading) + math.pi) % (2 * math.pi) - math.pi)
+        weight[:-1] += curvature_gain * turn / 2
+        weight[1:] += curvature_gain * turn / 2
+    effort = np.concatenate([[0.0], np.cumsum(weight)])
+
+    n = max(int(math.ceil(effort[-1] / spacing)), 1)
+    samples = np.interp(np.linspace(0, effort[-1], n + 1), effort, arc)
+    return np.column_stack([np.interp(samples, arc, route[:, 0]), np.interp(samples, arc, route[:, 1])])
+
+## Compacts a recorded route
+#
+# @param route An (n, 2) array of coordinates
+# @param tolerance The simplification tolerance (see simplify_route())
+# @param spacing If set, the simplified route is resampled at this spacing
+# (see resample_route())
+# @param curvature_gain The extra density at turns when resampling
+# @return The compacted route
+def compact_route(route, tolerance=1.0, spacing=None, curvature_gain=0):
+    route = simplify_route(remove_repeats(np.asarray(route, dtype=float)), tolerance)
+    if spacing != None:
+        route = resample_route(route, spacing, curvature_gain)
+    return route
+
+## Streaming Route Simplifier
+#
+# Simplifies a route one point at a time, for use while it is being recorded.
+# It grows a window from the last kept point and keeps the previous point
+# whenever a point in the window would lie further than the tolerance from
+# the straight line to the newest point (the "opening window" method). The
+# result is close to, but not the same as, simplify_route().
+class StreamingSimplifier:
+    ## The StreamingSimplifier constructor
+    #
+    # @param self The object pointer
+    # @param tolerance The largest distance any removed point may lie from the
+    # simplified route
+    # @param max_window The most points held in the window. A point is kept
+    # whenever the window fills, which bounds the work per point.
+    def __init__(self, tolerance, max_window=256):
+        self.tolerance = tolerance
+        self.max_window = max_window
+        ## The last kept point
+        self.anchor = None
+        ## The points since the anchor
+        self.window = []
+
+    ## Adds a point to the route
+    #
+    # @param self The object pointer
+    # @param x The x coordinate
+    # @param y The y coordinate
+    # @return A list of the (x, y) points kept as a result, possibly empty
+    def add(self, x, y):
+        point = (x, y)
+        if self.anchor == None:
+            self.anchor = point
+            return [point]
+        if len(self.window) == 0:
+            if point == self.anchor:
+                return []
+            self.window.append(point)
+            return []
+
+        if self.window[-1] == point:
+            return []
+
+        distances = segment_distances(np.array(self.window), self.anchor, point)
+        if distances.max() <= self.tolerance and len(self.window) < self.max_window:
+            self.window.append(point)
+            return []
+
+        self.anchor = self.window[-1]
+        self.window = [point]
+        return [self.anchor]
+
+    ## Ends the route
+    #
+    # @param self The object pointer
+    # @return A list holding the last point, if it has not been kept already
+    def finish(self):
+        if len(self.window) == 0:
+            return []
+        self.anchor = self.window[-1]
+        self.window = []
+        return [self.anchor]
+
+## Picks the nearest candidate waypoint of each query
+#
+# @param query An array giving the query each candidate belongs to, in
+# ascending order
+# @param points An array of candidate waypoint indices
+# @param d2 An array of candidate squared distances
+# @return A tuple (query, points, d2) with one entry for each query that has
+# candidates. Ties go to the lowest waypoint index.
+def group_nearest(query, points, d2):
+    if len(query) == 0:
+        return (query, points, d2)
+    starts = np.flatnonzero(np.diff(np.concatenate([[-1], query])))
+    best_d2 = np.minimum.reduceat(d2, starts)
+    counts = np.diff(np.concatenate([starts, [len(query)]]))
+    tied = np.where(d2 == np.repeat(best_d2, counts), points, np.iinfo(np.intp).max)
+    return (query[starts], np.minimum.reduceat(tied, starts), best_d2)
+
+## Loads a route and its RouteIndex
+#
+# @param filename The route file
+# @return A RouteIndex, shared with every other caller that loads the same
+# file
+def load_route_index(filename):
+    key = os.path.abspath(filename)
+    route = load_route(filename)
+    if key not in index_cache or index_cache[key][0] is not route:
+        index_cache[key] = (route, RouteIndex(route))
+    return index_cache[key][1]
+
+## Route Index
+#
+# This index buckets the points of a route in to a uniform grid, so the
+# nearest waypoint to a position is found by searching the few cells around
+# it rather than the whole route. It also holds the distance along the route
+# (arc length) of every waypoint.
+#
+# All of the queries take arrays of positions so that many pods can be
+# served by one call.
+class RouteIndex:
+    ## The RouteIndex constructor
+    #
+    # @param self The object pointer
+    # @param route An (n, 2) array of waypoints
+    # @param cell_size The width of a grid cell. If None, a size of about four
+    # waypoint spacings (or one waypoint per cell, if larger) is chosen.
+    def __init__(self, route, cell_size=None):
+        if len(route) == 0:
+            raise ValueError("A route must have at least one waypoint")
+
+        ## The (n, 2) array of waypoints
+        self.route = route
+        steps = np.hypot(np.diff(route[:, 0]), np.diff(route[:, 1]))
+        ## The distance along the route of each waypoint
+        self.arc = np.concatenate([[0.0], np.cumsum(steps)])
+        ## The length of the route
+        self.length = float(self.arc[-1])
+
+        (x_min, y_min) = route.min(axis=0)
+        (x_max, y_max) = route.max(axis=0)
+        width = max(x_max - x_min, 1.0)
+        height = max(y_max - y_min, 1.0)
+        if cell_size == None:
+            cell_size = max(4 * self.length / len(route), math.sqrt(width * height / len(route)))
+        cell_size = max(cell_size, math.sqrt(width * height / MAX_CELLS))
+
+        ## The width (and height) of a cell
+        self.cell_size = float(cell_size)
+        ## The x coordinate of the left edge of the grid
+        self.x0 = float(x_min)
+        ## The y coordinate of the top edge of the grid
+        self.y0 = float(y_min)
+        ## The number of cells in the x direction
+        self.nx = int(width / self.cell_size) + 1
+        ## The number of cells in the y direction
+        self.ny = int(height / self.cell_size) + 1
+
+        (cx, cy) = self.cells(route[:, 0], route[:, 1])
+        cells = cy * self.nx + cx
+        counts = np.bincount(cells, minlength=self.nx * self.ny)
+        ## The start of each cell's waypoints in @ref cell_points
+        self.cell_start = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        ## The waypoint indices, grouped by cell and in route order
+        self.cell_points = np.argsort(cells, kind='mergesort').astype(np.intp)
+
+    ## Finds the grid cells holding a set of positions
+    #
+    # @param self The object pointer
+    # @param xs An array of x coordinates
+    # @param ys An array of y coordinates
+    # @return A tuple (cx, cy) of cell coordinates, clamped to the grid
+    def cells(self, xs, ys):
+        cx = np.clip(((xs - self.x0) // self.cell_size).astype(np.intp), 0, self.nx - 1)
+        cy = np.clip(((ys - self.y0) // self.cell_size).astype(np.intp), 0, self.ny - 1)
+        return (cx, cy)
+
+    ## Finds the nearest waypoint to each of a set of positions
+    #
+    # @param self The object pointer
+    # @param xs An array of x coordinates
+    # @param ys An array of y coordinates
+    # @return A tuple (indices, distances) of arrays. Ties go to the earlier
+    # waypoint.
+    #
+    # Each position searches a square of cells around its own cell, doubling
+    # the square's size until the nearest waypoint found is closer than any
+    # waypoint outside the square could be. Positions whose square grows to
+    # more cells than the route has waypoints (those far from the route) test
+    # every waypoint instead.
+    def nearest(self, xs, ys):
+        xs = np.atleast_1d(np.asarray(xs, dtype=float))
+        ys = np.atleast_1d(np.asarray(ys, dtype=float))
+        best = np.zeros(len(xs), dtype=np.intp)
+        best_d2 = np.zeros(len(xs))
+        (cx, cy) = self.cells(xs, ys)
+        cs = self.cell_size
+
+        todo = np.arange(len(xs))
+        r = 1
+        while len(todo) > 0:
+            if (2 * r + 1) ** 2 > len(self.route):
+                (best[todo], best_d2[todo]) = self.nearest_all(xs[todo], ys[todo])
+                break
+
+            lo_x = np.maximum(cx[todo] - r, 0)
+            hi_x = np.minimum(cx[todo] + r, self.nx - 1)
+            lo_y = np.maximum(cy[todo] - r, 0)
+            hi_y = np.minimum(cy[todo] + r, self.ny - 1)
+
+            span_x = hi_x - lo_x + 1
+            (query, offset) = expand_ranges(np.zeros(len(todo), dtype=np.intp), span_x * (hi_y - lo_y + 1))
+            cell = (lo_y[query] + offset // span_x[query]) * self.nx + lo_x[query] + offset % span_x[query]
+            start = self.cell_start[cell]
+            (owner, pos) = expand_ranges(start, self.cell_start[cell + 1] - start)
+            query = query[owner]
+            points = self.cell_points[pos]
+
+            d2 = (self.route[points, 0] - xs[todo][query]) ** 2 + (self.route[points, 1] - ys[todo][query]) ** 2
+            (query, points, d2) = group_nearest(query, points, d2)
+            found = np.zeros(len(todo), dtype=bool)
+            found[query] = True
+            best[todo[query]] = points
+            best_d2[todo[query]] = d2
+
+            # The distance from each position to the nearest unsearched cell
+            inf = np.inf
+            edge = np.minimum(np.minimum(np.where(lo_x > 0, xs[todo] - (self.x0 + lo_x * cs), inf),
+                                         np.where(hi_x < self.nx - 1, self.x0 + (hi_x + 1) * cs - xs[todo], inf)),
+                              np.minimum(np.where(lo_y > 0, ys[todo] - (self.y0 + lo_y * cs), inf),
+                                         np.where(hi_y < self.ny - 1, self.y0 + (hi_y + 1) * cs - ys[todo], inf)))
+            done = np.isinf(edge) | (found & (best_d2[todo] < edge * edge))
+            todo = todo[~done]
+            r *= 2
+
+        return (best, np.sqrt(best_d2))
+
+    ## Finds the nearest waypoint to each of a set of positions by testing
+    # every waypoint
+    #
+    # @param self The object pointer
+    # @param xs An array of x coordinates
+    # @param ys An array of y coordinates
+    # @return A tuple (indices, squared distances) of arrays
+    def nearest_all(self, xs, ys):
+        best = np.zeros(len(xs), dtype=np.intp)
+        best_d2 = np.zeros(len(xs))
+        step = max(1, BLOCK_SIZE // len(self.route))
+        for first in range(0, len(xs), step):
+            block = slice(first, first + step)
+            d2 = ((self.route[:, 0] - xs[block, None]) ** 2 + (self.route[:, 1] - ys[block, None]) ** 2)
+            best[block] = d2.argmin(axis=1)
+            best_d2[block] = d2[np.arange(len(d2)), best[block]]
+        return (best, best_d2)
+
+    ## Finds the nearest waypoint in a window ahead of a set of waypoints
+    #
+    # @param self The object pointer
+    # @param xs An array of x coordinates
+    # @param ys An array of y coordinates
+    # @param starts An array holding the first waypoint of each window
+    # @param window The number of waypoints after the first one in each window
+    # @return A tuple (indices, distances) of arrays. Ties go to the earlier
+    # waypoint.
+    def nearest_forward(self, xs, ys, starts, window):
+        xs = np.atleast_1d(np.asarray(xs, dtype=float))
+        ys = np.atleast_1d(np.asarray(ys, dtype=float))
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.intp))
+        counts = np.minimum(starts + window, len(self.route) - 1) - starts + 1
+        (query, points) = expand_ranges(starts, counts)
+
+        d2 = (self.route[points, 0] - xs[query]) ** 2 + (self.route[points, 1] - ys[query]) ** 2
+        (query, points, d2) = group_nearest(query, points, d2)
+        return (points, np.sqrt(d2))
+
+    ## Finds the points at given distances along the route
+    #
+    # @param self The object pointer
+    # @param arc An array of distances along the route (clamped to the route)
+    # @return A tuple (xs, ys) of arrays
+    def points_at(self, arc):
+        return (np.interp(arc, self.arc, self.route[:, 0]), np.interp(arc, self.arc, self.route[:, 1]))
+
+    ## Finds the points a given distance further along the route than a set
+    # of waypoints
+    #
+    # @param self The object pointer
+    # @param indices An array of waypoint indices
+    # @param distance The lookahead distance
+    # @return A tuple (xs, ys) of arrays
+    def lookahead(self, indices, distance):
+        return self.points_at(self.arc[indices] + distance)
+
+## Route Progress
+#
+# Tracks the progress of a set of pods along one route, using the same rule
+# as Navigators.RouteNavigator: a pod moves on to the next waypoint once it is
+# within reach of its current one, and has ended once it is within reach of
+# the last one.
+#
+# A pod that has not reached its current waypoint catches up to the nearest
+# waypoint in a window ahead of it, so a pod that overshoots or is pushed
+# along the route does not have to turn back. resume() moves pods to their
+# nearest waypoint anywhere on the route.
+class RouteProgress:
+    ## The RouteProgress constructor
+    #
+    # @param self The object pointer
+    # @param index The RouteIndex of the route
+    # @param n The number of pods
+    # @param reach The distance at which a waypoint counts as reached
+    # @param window The number of waypoints ahead searched when catching up,
+    # or 0 to never catch up
+    # @param lookahead If above 0, the targets are this far along the route
+    # ahead of the current waypoints rather than the waypoints themselves
+    def __init__(self, index, n, reach=20, window=50, lookahead=0):
+        self.index = index
+        self.reach = reach
+        self.window = window
+        self.lookahead = lookahead
+        ## The current waypoint of each pod
+        self.current = np.zeros(n, dtype=np.intp)
+        ## Flags showing which pods have reached the end of the route
+        self.end = np.zeros(n, dtype=bool)
+
+    ## Updates the progress of every pod
+    #
+    # @param self The object pointer
+    # @param xs An array of pod x coordinates
+    # @param ys An array of pod y coordinates
+    # @return A tuple (target_xs, target_ys) of arrays
+    def update(self, xs, ys):
+        route = self.index.route
+        current = self.current
+        x_error = xs - route[current, 0]
+        y_error = ys - route[current, 1]
+        reached = np.sqrt(x_error * x_error + y_error * y_error) < self.reach
+
+        last = len(route) - 1
+        self.end |= reached & (current == last)
+        current[reached & (current < last)] += 1
+
+        lost = np.flatnonzero(~reached)
+        if self.window > 0 and len(lost) > 0:
+            (ahead, distance) = self.index.nearest_forward(xs[lost], ys[lost], current[lost], self.window)
+            current[lost] = ahead
+
+        return self.targets()
+
+    ## Moves every pod to its nearest waypoint
+    #
+    # @param self The object pointer
+    # @param xs An array of pod x coordinates
+    # @param ys An array of pod y coordinates
+    # @return None
+    def resume(self, xs, ys):
+        self.current[:] = self.index.nearest(xs, ys)[0]
+
+    ## Gets the current targets
+    #
+    # @param self The object pointer
+    # @return A tuple (target_xs, target_ys) of arrays
+    def targets(self):
+        if self.lookahead > 0:
+            return self.index.lookahead(self.current, self.lookahead)
+        route = self.index.route
+        return (route[self.current, 0], route[self.current, 1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compacts a recorded route file.')
+    parser.add_argument('source', help='the recorded route (e.g. routeData.csv)')
+    parser.add_argument('destination', help='the compacted route to write (e.g. routeNew.csv)')
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help='the largest distance a removed point may lie from the route')
+    parser.add_argument('--spacing', type=float, default=None,
+                        help='resample the route at this spacing')
+    parser.add_argument('--curvature-gain', type=float, default=0,
+                        help='extra pixels of route per radian of turn when resampling')
+    args = parser.parse_args()
+
+    source = load_route(args.source)
+    compacted = compact_route(source, args.tolerance, args.spacing, args.curvature_gain)
+    save_route(args.destination, compacted)
+    print("%s: %d points -> %s: %d points" % (args.source, len(source), args.destination, len(compacted)))
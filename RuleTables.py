@@ -0,0 +1,243 @@
+## @package RuleTables
+# Contains the rule table engine, which runs the rules of
+# Controllers.RuleController with the thresholds and actions taken from a
+# table instead of from a hand-written class.
+#
+# A rule table is a dictionary holding a value for each name in
+# @ref TABLE_KEYS. The names are the attribute names of RuleController, plus:
+#
+# - climb_force - the main thruster instruction when the target is above the
+#   pod and the speed is within the limits
+# - error_limit - if not None, the position errors are limited to this size
+#   before the rules are applied (as TestRuleController does)
+#
+# The rules are written once, as @ref RULES, and a table is compiled in to a
+# function for one pod and a function for a batch of pods, with the values
+# bound as globals, so a tick needs no attribute lookups. The tables of
+# the two hand-written controllers are @ref RULE_CONTROLLER_TABLE and
+# @ref TEST_RULE_CONTROLLER_TABLE, and a table can be loaded from the file
+# written by Optimisers.GeneticOptimiser.export(), so new rule variants need
+# no new classes.
+#
+# Example:
+#
+# controller = RuleTableController(load_rule_table('rule_controller_params.json'))
+import json
+import math
+
+import numpy as np
+
+from Controllers import RuleController
+from Controllers import TestRuleController
+from PodBatches import BatchControl
+from simulation import Control
+
+## The names every rule table must hold
+TABLE_KEYS = ('target_ang', 'big_y_speed', 'mid_y_speed', 'sml_y_speed', 'big_x_speed', 'mid_x_speed',
+              'sml_x_speed', 'big_x_error', 'mid_x_error', 'big_y_error', 'mid_y_error', 'up_force',
+              'down_force', 'propel_angle', 'angle_prop_gain', 'angle_diff_gain', 'climb_force',
+              'error_limit')
+
+## The rules, in order. Each rule is a tuple (name, cases, default) that sets
+# the variable name to the value of the first (condition, value) case that
+# holds, or to default if none do. The names of the rule table are globals
+# of the compiled functions.
+RULES = [
+    ('y_error', [], 'target_y - y'),
+    ('x_error', [], 'target_x - x'),
+    ('norm_ang', [], 'two_pi - ((ang + pi) % two_pi)'),
+    ('norm_ang', [('norm_ang > pi', 'norm_ang - two_pi')], 'norm_ang'),
+
+    ('up', [('y_error < 0', 'climb_force')], '0.0'),
+    ('abs_error', [], 'abs(y_error)'),
+    ('max_speed', [('abs_error > big_y_error', 'big_y_speed'), ('abs_error > mid_y_error', 'mid_y_speed')],
+     'sml_y_speed'),
+    ('up', [('dydt < -max_speed', 'down_force'), ('dydt > max_speed', 'up_force')], 'up'),
+
+    ('aim_ang', [('x_error > 0', 'propel_angle'), ('x_error < 0', '-propel_angle')], 'target_ang'),
+    ('abs_error', [], 'abs(x_error)'),
+    ('max_speed', [('abs_error > big_x_error', 'big_x_speed'), ('abs_error > mid_x_error', 'mid_x_speed')],
+     'sml_x_speed'),
+    ('aim_ang', [('dxdt > max_speed', '-propel_angle')], 'aim_ang'),
+    ('aim_ang', [('dxdt < -max_speed', 'propel_angle')], 'aim_ang'),
+
+    ('side_force', [], '(aim_ang - norm_ang) * angle_prop_gain + dangdt * angle_diff_gain'),
+    ('left', [('side_force > 0', '0.0')], '-side_force'),
+    ('right', [('side_force > 0', 'side_force')], '0.0'),
+]
+
+## The rules that limit the position errors, applied after the first two
+# rules when the table's error_limit is not None
+LIMIT_RULES = [
+    ('y_error', [('y_error > error_limit', 'error_limit'), ('y_error < -error_limit', '-error_limit')], 'y_error'),
+    ('x_error', [('x_error > error_limit', 'error_limit'), ('x_error < -error_limit', '-error_limit')], 'x_error'),
+]
+
+## The compiled rule functions, keyed by (batch, limited)
+rule_code = {}
+
+## Writes the source of a rule function
+#
+# @param name The name of the function
+# @param rules A list of rules (see @ref RULES)
+# @param batch If true, each rule is written as nested where() calls so that
+# the function takes and returns arrays, otherwise as an if/elif chain
+# @return The source of the function, which returns (up, left, right)
+def rule_source(name, rules, batch):
+    lines = ['def %s(target_x, target_y, x, y, ang, dxdt, dydt, dangdt):' % name]
+    for (variable, cases, default) in rules:
+        if batch or len(cases) == 0:
+            value = default
+            for (condition, case) in reversed(cases):
+                value = 'where(%s, %s, %s)' % (condition, case, value)
+            lines.append('    %s = %s' % (variable, value))
+            continue
+
+        for (i, (condition, case)) in enumerate(cases):
+            lines.append('    %s %s:' % ('if' if i == 0 else 'elif', condition))
+            lines.append('        %s = %s' % (variable, case))
+        if default != variable:
+            lines.append('    else:')
+            lines.append('        %s = %s' % (variable, default))
+    lines.append('    return (up, left, right)')
+    return '\n'.join(lines) + '\n'
+
+## Compiles the rule function for one pod or a batch of pods
+#
+# @param batch If true, the function takes and returns arrays
+# @param limited If true, the position errors are limited first
+# @return A code object defining rule_control (or rule_control_batch)
+def compile_rules(batch, limited):
+    key = (batch, limited)
+    if key not in rule_code:
+        rules = RULES[:2] + (LIMIT_RULES if limited else []) + RULES[2:]
+        name = 'rule_control_batch' if batch else 'rule_control'
+        rule_code[key] = compile(rule_source(name, rules, batch), '<rule table>', 'exec')
+    return rule_code[key]
+
+## Builds a rule table from a rule controller
+#
+# @param controller A Controllers.RuleController or
+# Controllers.TestRuleController (or any object with the same attributes)
+# @param error_limit The position error limit, or None
+# @param climb_force The main thruster instruction when the target is above
+# the pod
+# @return A rule table
+def rule_table(controller, error_limit=None, climb_force=0.5):
+    table = dict((name, getattr(controller, name)) for name in TABLE_KEYS[:-2])
+    table['climb_force'] = climb_force
+    table['error_limit'] = error_limit
+    return table
+
+## The table of Controllers.RuleController
+RULE_CONTROLLER_TABLE = rule_table(RuleController())
+
+## The table of Controllers.TestRuleController
+TEST_RULE_CONTROLLER_TABLE = rule_table(TestRuleController(), error_limit=20)
+
+## Compiles a rule table
+#
+# @param table A rule table. Any value may be an array holding one value per
+# pod, but only the batch function can then be used.
+# @return A tuple (scalar, batch) of functions. Both take the arguments
+# (target_x, target_y, x, y, ang, dxdt, dydt, dangdt) and return a tuple
+# (up, left, right) of thruster instructions; batch takes and returns arrays.
+def compile_rule_table(table):
+    missing = [name for name in TABLE_KEYS if name not in table]
+    if len(missing) > 0:
+        raise ValueError("The rule table has no " + ", ".join(missing))
+
+    namespace = {'where': np.where, 'pi': math.pi, 'two_pi': 2 * math.pi}
+    for name in TABLE_KEYS:
+        value = table[name]
+        if value is None:
+            continue
+        value = float(value) if np.ndim(value) == 0 else np.asarray(value, dtype=float)
+        if np.isnan(value).any():
+            raise ValueError("The rule table's " + name + " is not a number")
+        namespace[name] = value
+
+    limited = table['error_limit'] is not None
+    exec(compile_rules(False, limited), namespace)
+    exec(compile_rules(True, limited), namespace)
+    return (namespace['rule_control'], namespace['rule_control_batch'])
+
+## Loads a rule table from a JSON file
+#
+# @param filename A file written by Optimisers.GeneticOptimiser.export() for
+# RuleController or TestRuleController, or a file holding a rule table
+# @return A rule table. The optimised parameters replace the values of the
+# table of the optimised controller.
+def load_rule_table(filename):
+    data = json.load(open(filename, 'r'))
+    if 'params' not in data:
+        return dict((str(name), value) for (name, value) in data.items())
+
+    controller = str(data['controller'])
+    if controller.endswith('.TestRuleController'):
+        table = dict(TEST_RULE_CONTROLLER_TABLE)
+    elif controller.endswith('.RuleController'):
+        table = dict(RULE_CONTROLLER_TABLE)
+    else:
+        raise ValueError("No rule table for " + controller)
+    for (name, value) in data['params'].items():
+        table[str(name)] = value
+    return table
+
+## Rule Table Controller
+#
+# Controls the pod's thrusters with the rules of Controllers.RuleController,
+# using the thresholds and actions from a compiled rule table.
+class RuleTableController:
+    ## The RuleTableController constructor
+    #
+    # @param self The object pointer
+    # @param table The rule table, or None for @ref RULE_CONTROLLER_TABLE
+    def __init__(self, table=None):
+        if table == None:
+            table = RULE_CONTROLLER_TABLE
+        ## The rule table
+        self.table = dict(table)
+        (self.rule_control, self.rule_control_batch) = compile_rule_table(self.table)
+
+    ## Gets the controller's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the compiled functions
+    def __getstate__(self):
+        return {'table': self.table}
+
+    ## Restores the controller's state after unpickling
+    #
+    # @param self The object pointer
+    # @param state The attributes returned by __getstate__()
+    # @return None
+    def __setstate__(self, state):
+        RuleTableController.__init__(self, state['table'])
+
+    ## The process function for the RuleTableController
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects.  Unused.
+    # @param state The current state of the pod.  Must include the same
+    # properties as for Controllers.RuleController.process().
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A Control object that contains the desired thruster instructions
+    def process(self, sensor, state, dt):
+        control = Control()
+        (control.up, control.left, control.right) = self.rule_control(
+            state.target_x, state.target_y, state.x, state.y, state.ang, state.dxdt, state.dydt, state.dangdt)
+        return control
+
+    ## The batched process function for the RuleTableController
+    #
+    # @param self The object pointer
+    # @param sensor The pod batch.  Unused.
+    # @param state A PodBatches.BatchState with target_x and target_y arrays
+    # @param dt The timestep used by the simulator. Unused.
+    # @return A BatchControl holding the instructions process() gives each pod
+    def process_batch(self, sensor, state, dt):
+        control = BatchControl(len(state.x))
+        (control.up, control.left, control.right) = self.rule_control_batch(
+            state.target_x, state.target_y, state.x, state.y, state.ang, state.dxdt, state.dydt, state.dangdt)
+        return control
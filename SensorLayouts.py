@@ -0,0 +1,47 @@
+## @package SensorLayouts
+# Contains the functions used to choose the angles of a pod's sensors.
+#
+# A layout is a list of sensor angles relative to the pod, where 0 points
+# straight ahead, in increasing order. It is applied with
+# simulation.Pod.set_sensor_layout() or PodBatches.PodBatch.set_sensor_layout().
+#
+# Example:
+#
+# pod.set_sensor_layout(focused_layout(24, 4))
+from math import pi
+
+import numpy as np
+
+## Spaces the sensors evenly round the pod
+#
+# @param n The number of sensors
+# @return A list of n angles, the same as the default pod layout
+def uniform_layout(n):
+    return [i * pi * 2 / n for i in range(n)]
+
+## Packs the sensors more densely ahead of the pod than behind it
+#
+# @param n The number of sensors
+# @param focus The ratio of the density of sensors straight ahead to the
+# density straight behind (1 gives the uniform layout)
+# @return A list of n angles, starting with one straight ahead
+#
+# The density of sensors varies smoothly with the cosine of the angle. A
+# pod mostly moves forwards, so a focused layout with fewer sensors can see
+# the walls ahead in as much detail as a uniform one while casting fewer rays.
+def focused_layout(n, focus=3.0):
+    if focus == 1:
+        return uniform_layout(n)
+
+    # The fraction of the sensors between 0 and ang is
+    # (ang + a * sin(ang)) / (2 * pi) for a density of 1 + a * cos(ang).
+    a = (focus - 1.0) / (focus + 1.0)
+    target = np.arange(n) * 2 * pi / n
+    lo = np.zeros(n)
+    hi = np.full(n, 2 * pi)
+    for i in range(60):
+        mid = 0.5 * (lo + hi)
+        below = mid + a * np.sin(mid) < target
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+    return lo.tolist()
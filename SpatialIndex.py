@@ -0,0 +1,638 @@
+## @package SpatialIndex
+# Contains the spatial indexes used by World to find the wall segments a ray
+# or motion segment could touch without testing every segment in the world.
+#
+# Each index implements the segment index functions described in
+# @ref RayCasting, and returns exactly the same results as
+# RayCasting.SegmentArray (and so the original World loops).
+import math
+
+import numpy as np
+
+from RayCasting import intersect_arrays
+
+## The maximum number of cells a UniformGrid will create
+MAX_CELLS = 1 << 22
+
+## The number of segments rasterised in one NumPy operation while building
+BUILD_BLOCK = 1 << 14
+
+## Expands a list of [start, start + count) ranges in to one flat index array
+#
+# @param starts An array of range starts
+# @param counts An array of range lengths
+# @return A tuple (owner, index) where owner holds the position of the range
+# each entry came from.
+def expand_ranges(starts, counts):
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return (owner, np.repeat(starts, counts) + offsets)
+
+## Uniform Grid Index
+#
+# This index buckets the wall segments in to the cells of a uniform grid that
+# covers the world. A query walks the cells the ray crosses (a vectorised DDA:
+# the grid line crossings along each ray are found and sorted) and only tests
+# the segments stored in those cells.
+#
+# The buckets are held in compressed (CSR) form: the segments in cell c are
+# cell_segs[cell_start[c]:cell_start[c + 1]], in file order.
+#
+# @note Segments are stored in every cell their padded bounding line touches,
+# so hits that only satisfy the tolerance (or lie on a cell boundary) are
+# never missed.
+class UniformGrid:
+    ## The UniformGrid constructor
+    #
+    # @param self The object pointer
+    # @param segs An (n, 4) array of segments
+    # @param tol The tolerance used for ray casts (simulation.small)
+    # @param cell_size The width of a grid cell. If None, a size giving about
+    # one segment per cell is chosen.
+    # @param buckets A (cell_start, cell_segs) tuple saved from a grid built
+    # with the same segments and cell size (see WorldCache). If None, the
+    # buckets are built.
+    def __init__(self, segs, tol, cell_size=None, buckets=None):
+        ## The packed segment array
+        self.segs = segs
+        ## The tolerance used for ray casts
+        self.tol = tol
+
+        if len(segs) > 0:
+            x_min = min(segs[:, 0].min(), segs[:, 2].min())
+            x_max = max(segs[:, 0].max(), segs[:, 2].max())
+            y_min = min(segs[:, 1].min(), segs[:, 3].min())
+            y_max = max(segs[:, 1].max(), segs[:, 3].max())
+        else:
+            (x_min, x_max, y_min, y_max) = (0.0, 1.0, 0.0, 1.0)
+
+        width = max(x_max - x_min, 1.0)
+        height = max(y_max - y_min, 1.0)
+
+        ## The distance a segment is grown by before it is bucketed
+        self.pad = 2 * tol * (math.hypot(width, height) + 1)
+
+        if cell_size == None:
+            cell_size = math.sqrt(width * height / max(len(segs), 1))
+        cell_size = max(cell_size, math.sqrt(width * height / MAX_CELLS))
+
+        ## The width (and height) of a cell
+        self.cell_size = float(cell_size)
+        ## The x coordinate of the left edge of the grid
+        self.x0 = x_min - 2 * self.pad
+        ## The y coordinate of the top edge of the grid
+        self.y0 = y_min - 2 * self.pad
+        ## The number of cells in the x direction
+        self.nx = int((width + 4 * self.pad) / self.cell_size) + 1
+        ## The number of cells in the y direction
+        self.ny = int((height + 4 * self.pad) / self.cell_size) + 1
+
+        if buckets == None:
+            buckets = self.bucket_segments()
+        (self.cell_start, self.cell_segs) = buckets
+
+    ## Builds the CSR cell buckets
+    #
+    # @param self The object pointer
+    # @return A tuple (cell_start, cell_segs)
+    #
+    # Every cell overlapped by a segment's padded bounding box is tested with
+    # a separating axis test against the segment's line, so long diagonal
+    # walls are only stored in the cells they actually pass through.
+    def bucket_segments(self):
+        segs = self.segs
+        cs = self.cell_size
+        pad = self.pad
+        cells = []
+        owners = []
+
+        for first in range(0, len(segs), BUILD_BLOCK):
+            block = segs[first:first + BUILD_BLOCK]
+            x_lo = np.minimum(block[:, 0], block[:, 2]) - pad
+            x_hi = np.maximum(block[:, 0], block[:, 2]) + pad
+            y_lo = np.minimum(block[:, 1], block[:, 3]) - pad
+            y_hi = np.maximum(block[:, 1], block[:, 3]) + pad
+
+            cx_lo = np.clip(((x_lo - self.x0) // cs).astype(np.intp), 0, self.nx - 1)
+            cx_hi = np.clip(((x_hi - self.x0) // cs).astype(np.intp), 0, self.nx - 1)
+            cy_lo = np.clip(((y_lo - self.y0) // cs).astype(np.intp), 0, self.ny - 1)
+            cy_hi = np.clip(((y_hi - self.y0) // cs).astype(np.intp), 0, self.ny - 1)
+
+            span_x = cx_hi - cx_lo + 1
+            counts = span_x * (cy_hi - cy_lo + 1)
+            (seg, offset) = expand_ranges(np.zeros(len(block), dtype=np.intp), counts)
+            cx = cx_lo[seg] + offset % span_x[seg]
+            cy = cy_lo[seg] + offset // span_x[seg]
+
+            # Project the cell corners on to the segment normal.
+            n_x = block[seg, 1] - block[seg, 3]
+            n_y = block[seg, 2] - block[seg, 0]
+            left = self.x0 + cx * cs - block[seg, 0]
+            top = self.y0 + cy * cs - block[seg, 1]
+            d = np.stack([n_x * left + n_y * top,
+                          n_x * (left + cs) + n_y * top,
+                          n_x * left + n_y * (top + cs),
+                          n_x * (left + cs) + n_y * (top + cs)])
+            reach = pad * np.hypot(n_x, n_y)
+            keep = (d.min(axis=0) <= reach) & (d.max(axis=0) >= -reach)
+
+            cells.append(cy[keep] * self.nx + cx[keep])
+            owners.append(seg[keep] + first)
+
+        if len(cells) > 0:
+            cells = np.concatenate(cells)
+            owners = np.concatenate(owners)
+        else:
+            cells = np.zeros(0, dtype=np.intp)
+            owners = np.zeros(0, dtype=np.intp)
+
+        order = np.lexsort((owners, cells))
+        counts = np.bincount(cells, minlength=self.nx * self.ny)
+        cell_start = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        return (cell_start, owners[order].astype(np.intp))
+
+    ## Finds the segments that could be touched by a set of rays
+    #
+    # @param self The object pointer
+    # @param t_max An array of distances beyond which each ray need not be
+    # walked, or None to walk the whole ray
+    # @return A tuple (ray, seg) of arrays listing every candidate pair once,
+    # sorted by ray and then by segment.
+    #
+    # The rays are extended by the tolerance at both ends and clipped to the
+    # grid. The cells crossed are found from the midpoints between the sorted
+    # grid line crossings along each ray.
+    def candidates(self, p0_x, p0_y, p1_x, p1_y, t_max=None):
+        (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+            np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+            np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+        n_rays = p0_x.shape[0]
+        cs = self.cell_size
+        d_x = p1_x - p0_x
+        d_y = p1_y - p0_y
+
+        enter = np.full(n_rays, -self.tol)
+        leave = np.full(n_rays, 1 + self.tol)
+        if t_max is not None:
+            leave = np.minimum(leave, np.asarray(t_max, dtype=np.float64) + self.tol)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for (p, d, lo, n) in ((p0_x, d_x, self.x0, self.nx),
+                                  (p0_y, d_y, self.y0, self.ny)):
+                hi = lo + n * cs
+                t_a = (lo - p) / d
+                t_b = (hi - p) / d
+                inside = (p >= lo) & (p <= hi)
+                enter = np.maximum(enter, np.where(d == 0, np.where(inside, -np.inf, np.inf), np.minimum(t_a, t_b)))
+                leave = np.minimum(leave, np.where(d == 0, np.where(inside, np.inf, -np.inf), np.maximum(t_a, t_b)))
+
+        live = np.nonzero(enter <= leave)[0]
+        if len(live) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return (empty, empty)
+
+        ray_t = [live, live]
+        cross_t = [enter[live], leave[live]]
+        for (p, d, lo) in ((p0_x, d_x, self.x0), (p0_y, d_y, self.y0)):
+            a = (p[live] + enter[live] * d[live] - lo) / cs
+            b = (p[live] + leave[live] * d[live] - lo) / cs
+            k_lo = np.ceil(np.minimum(a, b)).astype(np.intp)
+            counts = np.maximum(np.floor(np.maximum(a, b)).astype(np.intp) - k_lo + 1, 0)
+            counts[d[live] == 0] = 0
+            (owner, k) = expand_ranges(k_lo, counts)
+            ray = live[owner]
+            ray_t.append(ray)
+            cross_t.append((lo + k * cs - p[ray]) / d[ray])
+
+        ray_t = np.concatenate(ray_t)
+        cross_t = np.concatenate(cross_t)
+        order = np.lexsort((cross_t, ray_t))
+        ray_t = ray_t[order]
+        cross_t = cross_t[order]
+
+        same = ray_t[1:] == ray_t[:-1]
+        ray = ray_t[1:][same]
+        t_mid = 0.5 * (cross_t[1:][same] + cross_t[:-1][same])
+        cx = np.clip(((p0_x[ray] + t_mid * d_x[ray] - self.x0) // cs).astype(np.intp), 0, self.nx - 1)
+        cy = np.clip(((p0_y[ray] + t_mid * d_y[ray] - self.y0) // cs).astype(np.intp), 0, self.ny - 1)
+        cell = cy * self.nx + cx
+
+        starts = self.cell_start[cell]
+        (owner, item) = expand_ranges(starts, self.cell_start[cell + 1] - starts)
+        keys = np.unique(ray[owner] * len(self.segs) + self.cell_segs[item])
+        return (keys // len(self.segs), keys % len(self.segs))
+
+    ## Finds the closest segment hit by a single ray
+    #
+    # @param self The object pointer
+    # @return A tuple (t, segment)
+    def closest_intersect(self, p0_x, p0_y, p1_x, p1_y):
+        (t, seg) = self.closest_intersects(p0_x, p0_y, [p1_x], [p1_y])
+        return (float(t[0]), int(seg[0]))
+
+    ## Finds the closest segment hit by each of a set of rays
+    #
+    # @param self The object pointer
+    # @param t_max An array of known hit distances, or None. Only the cells
+    # up to them are walked.
+    # @return A tuple (t, segment) of arrays
+    def closest_intersects(self, p0_x, p0_y, p1_x, p1_y, t_max=None):
+        (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+            np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+            np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+        t_min = np.full(p0_x.shape[0], 2.0)
+        seg_min = np.full(p0_x.shape[0], -1, dtype=np.intp)
+        if len(self.segs) == 0:
+            return (t_min, seg_min)
+
+        (ray, seg) = self.candidates(p0_x, p0_y, p1_x, p1_y, t_max)
+        segs = self.segs[seg]
+        (s, t) = intersect_arrays(p0_x[ray], p0_y[ray], p1_x[ray], p1_y[ray],
+                                  segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3])
+        tol = self.tol
+        hit = (t >= -tol) & (t <= 1 + tol) & (s >= -tol) & (s <= 1 + tol)
+        (ray, seg, t) = (ray[hit], seg[hit], t[hit])
+
+        # Closest first, with ties going to the first segment in file order.
+        order = np.lexsort((seg, t, ray))
+        first = order[np.concatenate([[True], ray[order][1:] != ray[order][:-1]])[:len(order)]]
+        t_min[ray[first]] = t[first]
+        seg_min[ray[first]] = seg[first]
+        return (t_min, seg_min)
+
+    ## Finds the first segment crossed by a motion segment
+    #
+    # @param self The object pointer
+    # @return The index of the segment, or -1
+    def first_collision(self, p0_x, p0_y, p1_x, p1_y):
+        if p0_x == p1_x and p0_y == p1_y:
+            return -1
+        return int(self.first_collisions(p0_x, p0_y, [p1_x], [p1_y])[0])
+
+    ## Finds the first segment crossed by each of a set of motion segments
+    #
+    # @param self The object pointer
+    # @return An array of segment indices (-1 for no collision)
+    def first_collisions(self, p0_x, p0_y, p1_x, p1_y):
+        (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+            np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+            np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+        seg_first = np.full(p0_x.shape[0], -1, dtype=np.intp)
+        if len(self.segs) == 0:
+            return seg_first
+
+        (ray, seg) = self.candidates(p0_x, p0_y, p1_x, p1_y)
+        segs = self.segs[seg]
+        (s, t) = intersect_arrays(p0_x[ray], p0_y[ray], p1_x[ray], p1_y[ray],
+                                  segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3])
+        moving = (p0_x[ray] != p1_x[ray]) | (p0_y[ray] != p1_y[ray])
+        hit = (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1) & moving
+        (ray, seg) = (ray[hit], seg[hit])
+
+        # The candidates are sorted by segment, so the first hit of each
+        # motion segment is the first wall in file order.
+        first = np.concatenate([[True], ray[1:] != ray[:-1]])[:len(ray)]
+        seg_first[ray[first]] = seg[first]
+        return seg_first
+
+## Bounding Volume Hierarchy Index
+#
+# This index builds a binary tree of axis-aligned bounding boxes over the wall
+# segments. Each wall gets its own subtree, and a top level tree is built over
+# the walls, so a query rejects whole walls (and then whole groups of
+# segments) before any exact intersection test is made.
+#
+# The nodes are held in flat arrays. A node is a leaf if its count is not
+# zero, in which case its segments are order[start:start + count]. seg_min
+# holds the lowest segment index under each node, which lets collision
+# queries skip subtrees that cannot beat the first wall already found.
+#
+# @note The boxes are grown by the same padding as UniformGrid, so hits that
+# only satisfy the tolerance are never culled.
+class SegmentBVH:
+    ## The SegmentBVH constructor
+    #
+    # @param self The object pointer
+    # @param segs An (n, 4) array of segments
+    # @param seg_wall The index of the wall each segment belongs to (segments
+    # of one wall must be contiguous, as produced by RayCasting.pack_segments)
+    # @param tol The tolerance used for ray casts (simulation.small)
+    # @param leaf_size The maximum number of segments in a leaf
+    # @param nodes A tuple returned by export() from a tree built with the
+    # same segments and leaf size (see WorldCache). If None, the tree is
+    # built.
+    def __init__(self, segs, seg_wall, tol, leaf_size=4, nodes=None):
+        ## The packed segment array
+        self.segs = segs
+        ## The tolerance used for ray casts
+        self.tol = tol
+        ## The maximum number of segments in a leaf
+        self.leaf_size = leaf_size
+
+        if len(segs) > 0:
+            extent = np.ptp(segs[:, 0::2]) + np.ptp(segs[:, 1::2])
+        else:
+            extent = 0.0
+        ## The distance the node boxes are grown by
+        self.pad = 2 * tol * (extent + 1)
+
+        self.box_lo_x = np.minimum(segs[:, 0], segs[:, 2]) - self.pad
+        self.box_lo_y = np.minimum(segs[:, 1], segs[:, 3]) - self.pad
+        self.box_hi_x = np.maximum(segs[:, 0], segs[:, 2]) + self.pad
+        self.box_hi_y = np.maximum(segs[:, 1], segs[:, 3]) + self.pad
+
+        ## The node boxes as (lo_x, lo_y, hi_x, hi_y) tuples
+        self.box = []
+        ## The index of each node's first child, or -1 for a leaf
+        self.left = []
+        ## The index of each node's second child, or -1 for a leaf
+        self.right = []
+        ## The position of each leaf's segments in @ref order
+        self.start = []
+        ## The number of segments in each leaf (0 for inner nodes)
+        self.count = []
+        ## The lowest segment index under each node
+        self.seg_min = []
+        ## The segment indices, grouped by leaf
+        self.order = []
+
+        ## The index of the root node, or -1 if the world has no segments
+        self.root = -1
+
+        if nodes != None:
+            self.restore(nodes)
+        else:
+            walls = []
+            bounds = np.searchsorted(seg_wall, np.arange(seg_wall.max() + 2)) if len(seg_wall) > 0 else []
+            for w in range(len(bounds) - 1):
+                if bounds[w + 1] > bounds[w]:
+                    walls.append(self.build_segments(np.arange(bounds[w], bounds[w + 1])))
+            if len(walls) > 0:
+                self.root = self.build_walls(walls)
+        ## The segments as a list of tuples, for fast access during queries
+        self.seg_list = [tuple(seg) for seg in segs.tolist()]
+
+    ## Adds a node to the tree
+    #
+    # @return The index of the new node
+    def add_node(self, box, left, right, start, count, seg_min):
+        self.box.append(box)
+        self.left.append(left)
+        self.right.append(right)
+        self.start.append(start)
+        self.count.append(count)
+        self.seg_min.append(seg_min)
+        return len(self.box) - 1
+
+    ## Builds the subtree for the segments of one wall
+    #
+    # @param self The object pointer
+    # @param ids An array of segment indices
+    # @return The index of the subtree's root node
+    #
+    # The segments are split at the median of their centres along the longer
+    # axis until each leaf holds at most @ref leaf_size segments.
+    def build_segments(self, ids):
+        box = (float(self.box_lo_x[ids].min()), float(self.box_lo_y[ids].min()),
+               float(self.box_hi_x[ids].max()), float(self.box_hi_y[ids].max()))
+
+        if len(ids) <= self.leaf_size:
+            start = len(self.order)
+            self.order.extend(ids.tolist())
+            return self.add_node(box, -1, -1, start, len(ids), int(ids.min()))
+
+        c_x = self.box_lo_x[ids] + self.box_hi_x[ids]
+        c_y = self.box_lo_y[ids] + self.box_hi_y[ids]
+        if np.ptp(c_x) >= np.ptp(c_y):
+            ids = ids[np.argsort(c_x, kind='mergesort')]
+        else:
+            ids = ids[np.argsort(c_y, kind='mergesort')]
+
+        half = len(ids) // 2
+        left = self.build_segments(ids[:half])
+        right = self.build_segments(ids[half:])
+        return self.add_node(box, left, right, 0, 0, min(self.seg_min[left], self.seg_min[right]))
+
+    ## Builds the top level tree over the wall subtrees
+    #
+    # @param self The object pointer
+    # @param roots A list of wall subtree root nodes
+    # @return The index of the tree's root node
+    def build_walls(self, roots):
+        if len(roots) == 1:
+            return roots[0]
+
+        boxes = np.array([self.box[root] for root in roots])
+        c_x = boxes[:, 0] + boxes[:, 2]
+        c_y = boxes[:, 1] + boxes[:, 3]
+        if np.ptp(c_x) >= np.ptp(c_y):
+            order = np.argsort(c_x, kind='mergesort')
+        else:
+            order = np.argsort(c_y, kind='mergesort')
+        roots = [roots[i] for i in order]
+
+        half = len(roots) // 2
+        left = self.build_walls(roots[:half])
+        right = self.build_walls(roots[half:])
+        (a, b) = (self.box[left], self.box[right])
+        box = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+        return self.add_node(box, left, right, 0, 0, min(self.seg_min[left], self.seg_min[right]))
+
+    ## Exports the tree as arrays
+    #
+    # @param self The object pointer
+    # @return A tuple (box, links, order, root) where box is an (m, 4) float
+    # array of node boxes, links is an (m, 5) array of the left, right,
+    # start, count and seg_min of each node, and order is the leaf segment
+    # array.
+    def export(self):
+        box = np.array(self.box, dtype=float).reshape(-1, 4)
+        links = np.array([self.left, self.right, self.start, self.count, self.seg_min],
+                         dtype=np.intp).reshape(5, -1).T
+        return (box, links, np.array(self.order, dtype=np.intp), self.root)
+
+    ## Restores a tree exported by export()
+    #
+    # @param self The object pointer
+    # @param nodes The (box, links, order, root) tuple
+    # @return None
+    def restore(self, nodes):
+        (box, links, order, root) = nodes
+        links = np.asarray(links)
+        self.box = [tuple(b) for b in np.asarray(box).tolist()]
+        self.left = links[:, 0].tolist()
+        self.right = links[:, 1].tolist()
+        self.start = links[:, 2].tolist()
+        self.count = links[:, 3].tolist()
+        self.seg_min = links[:, 4].tolist()
+        self.order = np.asarray(order).tolist()
+        self.root = int(root)
+
+    ## Finds where a ray enters a node's box
+    #
+    # @return The normalised distance along the ray at which it enters the
+    # box, or None if it misses the box between -tol and 1 + tol.
+    def enter(self, node, p0_x, p0_y, d_x, d_y):
+        (lo_x, lo_y, hi_x, hi_y) = self.box[node]
+        t_lo = -self.tol
+        t_hi = 1 + self.tol
+
+        if d_x == 0:
+            if p0_x < lo_x or p0_x > hi_x:
+                return None
+        else:
+            t_a = (lo_x - p0_x) / d_x
+            t_b = (hi_x - p0_x) / d_x
+            if t_a > t_b:
+                (t_a, t_b) = (t_b, t_a)
+            t_lo = max(t_lo, t_a)
+            t_hi = min(t_hi, t_b)
+
+        if d_y == 0:
+            if p0_y < lo_y or p0_y > hi_y:
+                return None
+        else:
+            t_a = (lo_y - p0_y) / d_y
+            t_b = (hi_y - p0_y) / d_y
+            if t_a > t_b:
+                (t_a, t_b) = (t_b, t_a)
+            t_lo = max(t_lo, t_a)
+            t_hi = min(t_hi, t_b)
+
+        if t_lo > t_hi:
+            return None
+        return t_lo
+
+    ## Finds the closest segment hit by a single ray
+    #
+    # @param self The object pointer
+    # @return A tuple (t, segment)
+    #
+    # The nearer child is always visited first, and subtrees the ray enters
+    # beyond the closest hit found so far (or beyond t_max) are skipped. The
+    # intersection test is the same arithmetic as simulation.intersect().
+    def closest_intersect(self, p0_x, p0_y, p1_x, p1_y, t_max=None):
+        t_min = 2
+        seg_min = -1
+        limit = 2 if t_max == None else t_max
+        if self.root < 0:
+            return (t_min, seg_min)
+
+        p0_x = float(p0_x)
+        p0_y = float(p0_y)
+        s1_x = float(p1_x) - p0_x
+        s1_y = float(p1_y) - p0_y
+        tol = self.tol
+        seg_list = self.seg_list
+
+        t_in = self.enter(self.root, p0_x, p0_y, s1_x, s1_y)
+        stack = [] if t_in == None else [(t_in, self.root)]
+        while len(stack) > 0:
+            (t_in, node) = stack.pop()
+            if t_in > t_min or t_in > limit:
+                continue
+
+            count = self.count[node]
+            if count > 0:
+                start = self.start[node]
+                for seg in self.order[start:start + count]:
+                    (p2_x, p2_y, p3_x, p3_y) = seg_list[seg]
+                    s2_x = p3_x - p2_x
+                    s2_y = p3_y - p2_y
+                    fact = (-s2_x * s1_y + s1_x * s2_y)
+                    if fact == 0:
+                        continue
+                    s = (-s1_y * (p0_x - p2_x) + s1_x * (p0_y - p2_y)) / fact
+                    t = (s2_x * (p0_y - p2_y) - s2_y * (p0_x - p2_x)) / fact
+                    if t >= -tol and t <= 1 + tol and s >= -tol and s <= 1 + tol:
+                        if t < t_min or (t == t_min and seg < seg_min):
+                            t_min = t
+                            seg_min = seg
+                continue
+
+            children = []
+            for child in (self.left[node], self.right[node]):
+                t_child = self.enter(child, p0_x, p0_y, s1_x, s1_y)
+                if t_child != None and t_child <= t_min and t_child <= limit:
+                    children.append((t_child, child))
+            children.sort(reverse=True)
+            stack.extend(children)
+
+        return (t_min, seg_min)
+
+    ## Finds the closest segment hit by each of a set of rays
+    #
+    # @param self The object pointer
+    # @param t_max An array of known hit distances, or None
+    # @return A tuple (t, segment) of arrays
+    def closest_intersects(self, p0_x, p0_y, p1_x, p1_y, t_max=None):
+        (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+            np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+            np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+        if t_max is None:
+            limits = [None] * p0_x.shape[0]
+        else:
+            limits = np.broadcast_to(np.asarray(t_max, dtype=np.float64), p0_x.shape).tolist()
+        hits = [self.closest_intersect(*ray) for ray in
+                zip(p0_x.tolist(), p0_y.tolist(), p1_x.tolist(), p1_y.tolist(), limits)]
+        if len(hits) == 0:
+            return (np.zeros(0), np.zeros(0, dtype=np.intp))
+        (t, seg) = zip(*hits)
+        return (np.array(t, dtype=np.float64), np.array(seg, dtype=np.intp))
+
+    ## Finds the first segment crossed by a motion segment
+    #
+    # @param self The object pointer
+    # @return The index of the segment, or -1
+    def first_collision(self, p0_x, p0_y, p1_x, p1_y):
+        if (p0_x == p1_x and p0_y == p1_y) or self.root < 0:
+            return -1
+
+        p0_x = float(p0_x)
+        p0_y = float(p0_y)
+        s1_x = float(p1_x) - p0_x
+        s1_y = float(p1_y) - p0_y
+        seg_list = self.seg_list
+        first = -1
+
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if first >= 0 and self.seg_min[node] >= first:
+                continue
+            if self.enter(node, p0_x, p0_y, s1_x, s1_y) == None:
+                continue
+
+            count = self.count[node]
+            if count > 0:
+                start = self.start[node]
+                for seg in self.order[start:start + count]:
+                    if first >= 0 and seg >= first:
+                        continue
+                    (p2_x, p2_y, p3_x, p3_y) = seg_list[seg]
+                    s2_x = p3_x - p2_x
+                    s2_y = p3_y - p2_y
+                    fact = (-s2_x * s1_y + s1_x * s2_y)
+                    if fact == 0:
+                        continue
+                    s = (-s1_y * (p0_x - p2_x) + s1_x * (p0_y - p2_y)) / fact
+                    t = (s2_x * (p0_y - p2_y) - s2_y * (p0_x - p2_x)) / fact
+                    if s >= 0 and s <= 1 and t >= 0 and t <= 1:
+                        first = seg
+            else:
+                stack.append(self.right[node])
+                stack.append(self.left[node])
+
+        return first
+
+    ## Finds the first segment crossed by each of a set of motion segments
+    #
+    # @param self The object pointer
+    # @return An array of segment indices (-1 for no collision)
+    def first_collisions(self, p0_x, p0_y, p1_x, p1_y):
+        (p0_x, p0_y, p1_x, p1_y) = np.broadcast_arrays(
+            np.asarray(p0_x, dtype=np.float64), np.asarray(p0_y, dtype=np.float64),
+            np.asarray(p1_x, dtype=np.float64), np.asarray(p1_y, dtype=np.float64))
+        return np.array([self.first_collision(*move) for move in
+                         zip(p0_x.tolist(), p0_y.tolist(), p1_x.tolist(), p1_y.tolist())],
+                        dtype=np.intp).reshape(-1)
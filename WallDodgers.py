@@ -1,8 +1,11 @@
 ## @package WallDodgers
-# Contains the wall dodger used to alter target coordinates so that the pod avoids
+# Contains the wall dodgers used to alter target coordinates so that the pod avoids
 # walls.
 import math
 
+from DistanceFields import distance_field
+from simulation import resolve_sensors
+
 ## Wall Dodger
 #
 # This takes the current pod state and its target coordinates, and then
@@ -39,9 +42,84 @@ class WallDodger:
     # be added together. This has the side-effect of causing stronger responses
     # when nearer the wall (as more sensors report a wall too close).
     def process(self, sensor, state, dt):
-        for i in range(0, 40):
+        resolve_sensors(sensor)
+        for i in range(0, len(sensor)):
             if sensor[i].val < self.safe_distance:
                 state.target_x += -50*math.sin(sensor[i].ang)
                 state.target_y += -25*math.cos(sensor[i].ang)
 
-        return state
\ No newline at end of file
+        return state
+
+## Distance Field Wall Dodger
+#
+# This works like WallDodger, but finds the distance to the nearest wall and
+# the direction away from it by looking them up in the world's
+# @ref DistanceFields.DistanceField instead of scanning the sensors. The cost
+# per tick does not depend on the number of sensors, and the pod needs no
+# sensors at all.
+class FieldWallDodger:
+    ## The FieldWallDodger constructor
+    #
+    # @param self The object pointer
+    # @param safety_distance The distance the wall dodger should try and keep
+    # between the pod and the wall.
+    # @param world The World the pod is in
+    # @param strength The push applied at the wall itself, as a multiple of
+    # the push WallDodger applies for one sensor
+    # @param resolution The node spacing of the distance field
+    def __init__(self, safety_distance, world, strength=10, resolution=5.0):
+        ## The distance the wall dodger will try and keep between the pod and
+        # the wall.
+        self.safe_distance = safety_distance
+        ## The push applied at the wall itself
+        self.strength = strength
+        ## The World the pod is in
+        self.world = world
+        ## The distance field of the world
+        self.field = distance_field(world, resolution, max(100.0, 2.0 * safety_distance))
+
+    ## Gets the wall dodger's state for pickling
+    #
+    # @param self The object pointer
+    # @return The attributes, without the distance field
+    #
+    # The field is loaded again (from the world's cache entry) when unpickled.
+    def __getstate__(self):
+        return {'safe_distance': self.safe_distance, 'strength': self.strength,
+                'world': self.world, 'resolution': self.field.resolution}
+
+    ## Restores the wall dodger's state after unpickling
+    #
+    # @param self The object pointer
+    # @param state The attributes returned by __getstate__()
+    # @return None
+    def __setstate__(self, state):
+        FieldWallDodger.__init__(self, state['safe_distance'], state['world'], state['strength'], state['resolution'])
+
+    ## The process function for the FieldWallDodger
+    #
+    # @param self The object pointer
+    # @param sensor A list of Sensor objects. Unused, so no sensor rays are
+    # cast for the pod.
+    # @param state The current state of the pod. Must include the following properties:
+    #        - x
+    #        - y
+    #        - target_x
+    #        - target_y
+    # @param dt The timestep of the simulator. Unused.
+    # @return Returns state with the modified target_x and target_y attributes.
+    #
+    # If the pod is closer than @ref safe_distance to a wall, the target
+    # coordinates are pushed along the distance gradient (directly away from
+    # the nearest wall). The push grows linearly from nothing at the safe
+    # distance to @ref strength times WallDodger's push at the wall.
+    def process(self, sensor, state, dt):
+        (distance, grad_x, grad_y) = self.field.lookup(state.x, state.y)
+        if distance < self.safe_distance:
+            length = math.hypot(grad_x, grad_y)
+            if length > 0:
+                scale = self.strength * (self.safe_distance - distance) / self.safe_distance / length
+                state.target_x += 50 * scale * grad_x
+                state.target_y += 25 * scale * grad_y
+
+        return state
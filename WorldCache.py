@@ -0,0 +1,342 @@
+## @package WorldCache
+# Contains the compiled world cache, which saves a parsed world file (and the
+# spatial indexes built for it) in a binary form that loads almost instantly.
+#
+# A compiled world is a directory of NumPy .npy files and a small JSON file,
+# stored in a cache directory (by default .worldcache next to the world file)
+# and named after the SHA-1 hash of the world file's contents, so editing the
+# world file simply makes a new entry. The hash is only worked out again when
+# the world file's modification time or size changes (the last hash is kept in
+# <name>.stamp.json in the cache directory). The segment arrays are memory mapped
+# read only, so they are shared between the processes of a batch run rather
+# than copied.
+#
+# Example:
+#
+# world = load_world('huge_world.txt', [pod])
+#
+# The cache can also be filled ahead of time from the command line:
+#
+# python WorldCache.py huge_world.txt world.txt
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from SpatialIndex import SegmentBVH
+from SpatialIndex import UniformGrid
+from simulation import Wall
+from simulation import World
+from simulation import small
+
+## The version of the compiled format. Changing it invalidates every cache.
+FORMAT_VERSION = 1
+
+## The name of the default cache directory
+CACHE_DIR_NAME = '.worldcache'
+
+## The files holding each index, by World index name
+INDEX_FILES = {
+    'grid': ['grid_cell_start', 'grid_cell_segs'],
+    'bvh': ['bvh_box', 'bvh_links', 'bvh_order', 'bvh_root'],
+}
+
+## The hashes found by this process, keyed by absolute file name. Each entry
+# is a tuple (stamp, hash).
+hash_cache = {}
+
+## Cached Wall
+#
+# A simulation.Wall loaded from a compiled world. Its list of segment tuples
+# is only built from the packed segment array the first time it is used, as
+# worlds with an index rarely need it.
+class CachedWall(Wall):
+    ## The CachedWall constructor
+    #
+    # @param self The object pointer
+    # @param name The name of the wall
+    # @param segs The wall's rows of the packed segment array
+    # @param bounds The wall's (minX, minY, maxX, maxY)
+    def __init__(self, name, segs, bounds):
+        self.name = name
+        ## The wall's rows of the packed segment array
+        self.segs = segs
+        (self.minX, self.minY, self.maxX, self.maxY) = bounds
+        self.update_rect()
+
+    ## Builds the segment list when it is first used
+    #
+    # @param self The object pointer
+    # @param name The attribute name
+    # @return The attribute
+    def __getattr__(self, name):
+        if name != 'segments':
+            raise AttributeError(name)
+        self.segments = [tuple(seg) for seg in self.segs.tolist()]
+        return self.segments
+
+## Hashes a world file
+#
+# @param fileName The world file
+# @return The hex SHA-1 digest of the file's contents and the format version
+def source_hash(fileName):
+    digest = hashlib.sha1(('world cache %d\n' % FORMAT_VERSION).encode('ascii'))
+    fin = open(fileName, 'rb')
+    while True:
+        block = fin.read(1 << 20)
+        if len(block) == 0:
+            break
+        digest.update(block)
+    fin.close()
+    return digest.hexdigest()
+
+## Gets the stamp used to tell when a world file has changed
+#
+# @param fileName The world file
+# @return A list [modification time, size]
+def file_stamp(fileName):
+    info = os.stat(fileName)
+    return [info.st_mtime, info.st_size]
+
+## Moves a finished temporary file in to place
+#
+# @param temp The temporary file
+# @param target The file to replace
+# @return None
+#
+# If the target cannot be replaced (for example because another process has
+# it open on Windows) but exists, the other process's copy is kept.
+def replace_file(temp, target):
+    try:
+        if hasattr(os, 'replace'):
+            os.replace(temp, target)
+        else:
+            if os.path.exists(target):
+                os.remove(target)
+            os.rename(temp, target)
+    except OSError:
+        if not os.path.exists(target):
+            raise
+        os.remove(temp)
+
+## Finds the hash of a world file, hashing it only if its stamp has changed
+#
+# @param fileName The world file
+# @param cache_dir The cache directory
+# @return The hash given by source_hash()
+#
+# Failure to save the stamp file (for example in a read only directory) is
+# ignored.
+def stamped_hash(fileName, cache_dir):
+    key = os.path.abspath(fileName)
+    stamp = file_stamp(fileName)
+    if key in hash_cache and hash_cache[key][0] == stamp:
+        return hash_cache[key][1]
+
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    stamp_file = os.path.join(cache_dir, name + '.stamp.json')
+    digest = None
+    try:
+        fin = open(stamp_file, 'r')
+        saved = json.load(fin)
+        fin.close()
+        if saved['version'] == FORMAT_VERSION and saved['source'] == key and saved['stamp'] == stamp:
+            digest = str(saved['hash'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    if digest == None:
+        digest = source_hash(fileName)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            (handle, temp) = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            out = os.fdopen(handle, 'w')
+            json.dump({'version': FORMAT_VERSION, 'source': key, 'stamp': stamp, 'hash': digest}, out)
+            out.close()
+            replace_file(temp, stamp_file)
+        except (IOError, OSError):
+            pass
+
+    hash_cache[key] = (stamp, digest)
+    return digest
+
+## Finds the cache entry of a world file
+#
+# @param fileName The world file
+# @param cache_dir The cache directory. If None, CACHE_DIR_NAME next to the
+# world file is used.
+# @return The path of the entry's directory (which may not exist yet)
+def cache_path(fileName, cache_dir=None):
+    if cache_dir == None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(fileName)), CACHE_DIR_NAME)
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    return os.path.join(cache_dir, name + '-' + stamped_hash(fileName, cache_dir))
+
+## Saves an array in to a cache entry
+#
+# @param path The entry's directory
+# @param name The array name
+# @param array The array
+# @return None
+#
+# The array is written to a temporary file and moved in to place, so another
+# process never sees half a file.
+def save_array(path, name, array):
+    (handle, temp) = tempfile.mkstemp(dir=path, suffix='.tmp')
+    out = os.fdopen(handle, 'wb')
+    np.save(out, np.asarray(array))
+    out.close()
+    replace_file(temp, os.path.join(path, name + '.npy'))
+
+## Loads an array from a cache entry
+#
+# @param path The entry's directory
+# @param name The array name
+# @return A read only memory mapped array, or None if it is not in the entry
+def load_array(path, name):
+    fileName = os.path.join(path, name + '.npy')
+    if not os.path.exists(fileName):
+        return None
+    return np.load(fileName, mmap_mode='r')
+
+## Compiles a world file in to a cache entry
+#
+# @param fileName The world file
+# @param path The entry's directory
+# @return None
+#
+# The entry is written to a temporary directory and renamed in to place. If
+# another process finishes first, the rename fails on every platform (a
+# directory holding files is never replaced) and its entry is kept.
+def compile_world(fileName, path):
+    world = World(fileName, [], index=None)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+
+    temp = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        bounds = [[wall.minX, wall.minY, wall.maxX, wall.maxY] for wall in world.walls]
+        save_array(temp, 'segs', world.segs)
+        save_array(temp, 'seg_wall', world.seg_wall)
+        save_array(temp, 'wall_bounds', np.array(bounds, dtype=float).reshape(-1, 4))
+        meta = {
+            'version': FORMAT_VERSION,
+            'source': os.path.basename(fileName),
+            'walls': [wall.name for wall in world.walls],
+            'pod_start': world.pod_start,
+        }
+        out = open(os.path.join(temp, 'meta.json'), 'w')
+        json.dump(meta, out)
+        out.close()
+        os.rename(temp, path)
+    except OSError:
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            raise
+    finally:
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+
+## Loads the index of a compiled world, building and saving it if needed
+#
+# @param world A World loaded from the entry
+# @param path The entry's directory
+# @param index The index name ("brute", "grid", "bvh" or None)
+# @return The index object
+def load_index(world, path, index):
+    if index not in INDEX_FILES:
+        return world.build_index(index)
+
+    arrays = [load_array(path, name) for name in INDEX_FILES[index]]
+    missing = any(array is None for array in arrays)
+    if index == 'grid':
+        if missing:
+            grid = UniformGrid(world.segs, small)
+            save_array(path, 'grid_cell_start', grid.cell_start)
+            save_array(path, 'grid_cell_segs', grid.cell_segs)
+            return grid
+        return UniformGrid(world.segs, small, buckets=tuple(arrays))
+
+    if missing:
+        bvh = SegmentBVH(world.segs, world.seg_wall, small)
+        (box, links, order, root) = bvh.export()
+        save_array(path, 'bvh_box', box)
+        save_array(path, 'bvh_links', links)
+        save_array(path, 'bvh_order', order)
+        save_array(path, 'bvh_root', np.array(root))
+        return bvh
+    return SegmentBVH(world.segs, world.seg_wall, small, nodes=tuple(arrays))
+
+## Loads an array derived from a world, building and saving it if needed
+#
+# @param fileName The world file
+# @param name The array name, which must describe every setting the array
+# depends on (for example 'occupancy-5-10')
+# @param build A function taking no arguments that builds the array
+# @param cache_dir The cache directory (see cache_path())
+# @return The array (memory mapped read only if it was already saved)
+#
+# Used by other modules to keep their own per-world data (occupancy grids,
+# planned routes, distance fields) with the compiled world. The array is
+# saved in the world's cache entry, so it is rebuilt when the world changes.
+def cached_array(fileName, name, build, cache_dir=None):
+    path = cache_path(fileName, cache_dir)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        compile_world(fileName, path)
+
+    array = load_array(path, name)
+    if array is None:
+        array = np.asarray(build())
+        save_array(path, name, array)
+    return array
+
+## Loads a world through the compiled world cache
+#
+# @param fileName The world file
+# @param pods A list of pods, placed at the world's pod position (the origin
+# if the world file has no pod position)
+# @param index The index to use, as for World ("auto", "brute", "grid",
+# "bvh" or None)
+# @param cache_dir The cache directory (see cache_path())
+# @return A World, identical to World(fileName, pods, index)
+def load_world(fileName, pods, index="auto", cache_dir=None):
+    path = cache_path(fileName, cache_dir)
+    meta_file = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_file):
+        compile_world(fileName, path)
+
+    fin = open(meta_file, 'r')
+    meta = json.load(fin)
+    fin.close()
+
+    world = World(None, pods)
+    world.file_name = fileName
+    world.segs = load_array(path, 'segs')
+    world.seg_wall = load_array(path, 'seg_wall')
+    bounds = load_array(path, 'wall_bounds').tolist()
+    starts = np.searchsorted(world.seg_wall, np.arange(len(meta['walls']) + 1)).tolist()
+
+    for (i, name) in enumerate(meta['walls']):
+        wall = CachedWall(str(name), world.segs[starts[i]:starts[i + 1]], bounds[i])
+        world.walls.append(wall)
+        world.rect = world.rect.union(wall.rect)
+
+    world.place_pods(*meta['pod_start'])
+
+    world.index = load_index(world, path, world.pick_index(index))
+    return world
+
+if __name__ == '__main__':
+    for fileName in sys.argv[1:]:
+        for index in ['grid', 'bvh']:
+            load_world(fileName, [], index)
+        print("%s -> %s" % (fileName, cache_path(fileName)))
@@ -0,0 +1,396 @@
+## @package WorldGenerators
+# Contains the generators used to make stress worlds for scaling tests.
+#
+# Each generator makes a world with exactly the requested number of wall
+# segments (at least 10), laid out from a seeded random number generator so
+# that the same arguments always give the same world. Every random number is
+# drawn through random.Random.random(), which gives the same sequence in
+# Python 2 and 3. The kinds are:
+#
+# - maze - a perfect maze of 40 px cells, with one wall per segment
+# - caves - a ragged outer wall round a field of irregular rocks
+# - obstacles - a dense field of small polygons and single segments
+# - corridors - a serpentine corridor between wiggling dividing walls
+#
+# Every world has a boundary, a pod start position in one corner and an end
+# wall in the opposite corner that the pod can reach. The worlds grow with the
+# segment count, keeping the same density at every size.
+#
+# Worlds are written in the world file format read by simulation.World, so
+# they can be loaded with WorldCache.load_world like any other world.
+#
+# Example:
+#
+# world = load_world(world_file('maze', 100000, seed=1), [pod])
+#
+# or, from the command line:
+#
+# python WorldGenerators.py maze 100000 --seed 1 -o maze.txt
+import argparse
+import math
+import os
+import random
+
+## The smallest segment count a generator can make
+MIN_SEGMENTS = 10
+
+## The directory world_file() writes to by default
+WORLD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.worlds')
+
+## The version of the generators, part of the name of every cached world
+# file. It must be increased whenever a change makes any world differ.
+GENERATOR_VERSION = 2
+
+## Draws a random number from a range
+#
+# @param rng A random.Random
+# @param low The lowest value
+# @param high The highest value
+# @return A float from low to high
+def uniform(rng, low, high):
+    return low + (high - low) * rng.random()
+
+## Draws a random integer
+#
+# @param rng A random.Random
+# @param n The number of values
+# @return An integer from 0 to n - 1
+def pick(rng, n):
+    return min(int(rng.random() * n), n - 1)
+
+## Shuffles a list in place
+#
+# @param rng A random.Random
+# @param items The list
+# @return None
+def shuffle(rng, items):
+    for i in range(len(items) - 1, 0, -1):
+        j = pick(rng, i + 1)
+        (items[i], items[j]) = (items[j], items[i])
+
+## Splits a total in to near-equal parts
+#
+# @param total The total
+# @param parts The number of parts
+# @return A list of parts integers adding up to total, the largest first
+def split_count(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+## Makes a closed rectangle
+#
+# @param x0 The left edge
+# @param y0 The top edge
+# @param x1 The right edge
+# @param y1 The bottom edge
+# @return A list of points going round the rectangle
+def rectangle(x0, y0, x1, y1):
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+
+## Makes a maze world
+#
+# @param n_segments The number of segments
+# @param rng A random.Random
+# @return A tuple (walls, pod) where walls is a list of (name, points) and
+# pod is the (x, y) start position
+#
+# The maze is carved by a depth first search, so there is exactly one route
+# between any two cells. A perfect maze of w by h cells keeps
+# (w - 1) * (h - 1) unit walls; the few segments left over are made by
+# splitting walls in half.
+def maze_walls(n_segments, rng):
+    cell = 40.0
+    target = n_segments - 5
+    cols = max(1, int(math.sqrt(target)))
+    rows = max(1, target // cols)
+    (w, h) = (cols + 1, rows + 1)
+
+    # Carve the maze. open_x[y * w + x] flags the wall on the right of a
+    # cell, open_y the wall below it.
+    open_x = [False] * (w * h)
+    open_y = [False] * (w * h)
+    visited = [False] * (w * h)
+    visited[0] = True
+    stack = [0]
+    while len(stack) > 0:
+        here = stack[-1]
+        (y, x) = divmod(here, w)
+        moves = []
+        if x > 0 and not visited[here - 1]:
+            moves.append((here - 1, open_x, here - 1))
+        if x < w - 1 and not visited[here + 1]:
+            moves.append((here + 1, open_x, here))
+        if y > 0 and not visited[here - w]:
+            moves.append((here - w, open_y, here - w))
+        if y < h - 1 and not visited[here + w]:
+            moves.append((here + w, open_y, here))
+        if len(moves) == 0:
+            stack.pop()
+            continue
+        (there, opened, wall) = moves[pick(rng, len(moves))]
+        opened[wall] = True
+        visited[there] = True
+        stack.append(there)
+
+    segments = []
+    for y in range(h):
+        for x in range(w):
+            i = y * w + x
+            if x < w - 1 and not open_x[i]:
+                segments.append(((x + 1) * cell, y * cell, (x + 1) * cell, (y + 1) * cell))
+            if y < h - 1 and not open_y[i]:
+                segments.append((x * cell, (y + 1) * cell, (x + 1) * cell, (y + 1) * cell))
+
+    walls = []
+    extra = target - len(segments)
+    for (i, (x1, y1, x2, y2)) in enumerate(segments):
+        if i < extra:
+            (mx, my) = ((x1 + x2) / 2, (y1 + y2) / 2)
+            walls.append(("w%d" % len(walls), [(x1, y1), (mx, my)]))
+            walls.append(("w%d" % len(walls), [(mx, my), (x2, y2)]))
+        else:
+            walls.append(("w%d" % len(walls), [(x1, y1), (x2, y2)]))
+
+    (width, height) = (w * cell, h * cell)
+    walls.append(("boundary", rectangle(0, 0, width, height)))
+    walls.append(("end", [(width - cell + 10, height - 5), (width - 10, height - 5)]))
+    return (walls, (cell / 2, cell / 2))
+
+## Makes a ragged closed loop
+#
+# @param rng A random.Random
+# @param cx The x coordinate of the centre
+# @param cy The y coordinate of the centre
+# @param radius The mean radius
+# @param n The number of segments
+# @return A list of n + 1 points going round the loop
+#
+# Each vertex's radius varies by up to 30%, so the loop is star shaped round
+# its centre and never crosses itself.
+def ragged_loop(rng, cx, cy, radius, n):
+    points = []
+    for i in range(n):
+        ang = 2 * math.pi * i / n
+        r = radius * (1 + uniform(rng, -0.3, 0.3))
+        points.append((cx + r * math.cos(ang), cy + r * math.sin(ang)))
+    return points + [points[0]]
+
+## Makes a rectangle with ragged edges
+#
+# @param rng A random.Random
+# @param size The width and height of the rectangle
+# @param n The number of segments (at least 4)
+# @param jitter The largest distance a vertex moves from the edge
+# @return A list of n + 1 points going round the rectangle
+def ragged_rectangle(rng, size, n, jitter):
+    corners = rectangle(0, 0, size, size)
+    points = []
+    for (side, count) in enumerate(split_count(n, 4)):
+        ((x0, y0), (x1, y1)) = (corners[side], corners[side + 1])
+        points.append((x0, y0))
+        for i in range(1, count):
+            offset = uniform(rng, -jitter, jitter)
+            (t_x, t_y) = (x0 + (x1 - x0) * i / count, y0 + (y1 - y0) * i / count)
+            if x0 == x1:
+                points.append((t_x + offset, t_y))
+            else:
+                points.append((t_x, t_y + offset))
+    return points + [corners[0]]
+
+## Makes a cave world
+#
+# @param n_segments The number of segments
+# @param rng A random.Random
+# @return A tuple (walls, pod) where walls is a list of (name, points) and
+# pod is the (x, y) start position
+#
+# About a tenth of the segments make the ragged outer wall, and the rest make
+# rocks of about 12 segments, each inside its own 100 px cell of a grid with
+# a clear margin round it.
+def cave_walls(n_segments, rng):
+    cell = 100.0
+    outer = max(4, (n_segments - 1) // 10)
+    rock_total = n_segments - 1 - outer
+    if rock_total < 3:
+        (outer, rock_total) = (outer + rock_total, 0)
+    rocks = split_count(rock_total, max(1, rock_total // 12)) if rock_total > 0 else []
+
+    grid = int(math.ceil(math.sqrt(len(rocks)))) if len(rocks) > 0 else 1
+    size = (grid + 2) * cell
+    cells = list(range(grid * grid))
+    shuffle(rng, cells)
+
+    walls = []
+    for (n, c) in zip(rocks, cells):
+        (y, x) = divmod(c, grid)
+        cx = (x + 1.5) * cell + uniform(rng, -0.1, 0.1) * cell
+        cy = (y + 1.5) * cell + uniform(rng, -0.1, 0.1) * cell
+        walls.append(("rock%d" % len(walls), ragged_loop(rng, cx, cy, 0.25 * cell, n)))
+    walls.append(("boundary", ragged_rectangle(rng, size, outer, 8)))
+    walls.append(("end", [(size - 0.75 * cell, size - 20), (size - 0.25 * cell, size - 20)]))
+    return (walls, (cell / 2, cell / 2))
+
+## Makes an obstacle field world
+#
+# @param n_segments The number of segments
+# @param rng A random.Random
+# @return A tuple (walls, pod) where walls is a list of (name, points) and
+# pod is the (x, y) start position
+#
+# The obstacles are polygons of 3 to 6 sides (and up to two single segments
+# to make up the count), each inside its own 60 px cell of a grid. The corner
+# cells are kept clear for the pod and the end wall.
+def obstacle_walls(n_segments, rng):
+    cell = 60.0
+    sizes = []
+    left = n_segments - 5
+    while left >= 3:
+        n = min(3 + pick(rng, 4), left)
+        sizes.append(n)
+        left -= n
+    sizes += [1] * left
+
+    grid = int(math.ceil(math.sqrt(len(sizes) + 2)))
+    cells = list(range(1, grid * grid - 1))
+    shuffle(rng, cells)
+    size = grid * cell
+
+    walls = []
+    for (n, c) in zip(sizes, cells):
+        (y, x) = divmod(c, grid)
+        cx = (x + 0.5) * cell + uniform(rng, -10, 10)
+        cy = (y + 0.5) * cell + uniform(rng, -10, 10)
+        radius = uniform(rng, 8, 15)
+        if n == 1:
+            ang = uniform(rng, 0, math.pi)
+            points = [(cx - radius * math.cos(ang), cy - radius * math.sin(ang)),
+                      (cx + radius * math.cos(ang), cy + radius * math.sin(ang))]
+        else:
+            start = uniform(rng, 0, 2 * math.pi)
+            points = [(cx + radius * math.cos(start + 2 * math.pi * i / n),
+                       cy + radius * math.sin(start + 2 * math.pi * i / n)) for i in range(n + 1)]
+        walls.append(("w%d" % len(walls), points))
+    walls.append(("boundary", rectangle(0, 0, size, size)))
+    walls.append(("end", [(size - cell + 10, size - 5), (size - 10, size - 5)]))
+    return (walls, (cell / 2, cell / 2))
+
+## Makes a corridor world
+#
+# @param n_segments The number of segments
+# @param rng A random.Random
+# @return A tuple (walls, pod) where walls is a list of (name, points) and
+# pod is the (x, y) start position
+#
+# The world is split in to 80 px rows by dividing walls of 20 px segments,
+# each with a gap at alternate ends, so the corridor winds back and forth
+# down the world. The vertices of the dividers wiggle up and down by up to
+# 16 px.
+def corridor_walls(n_segments, rng):
+    (row, step, gap) = (80.0, 20.0, 60.0)
+    total = n_segments - 5
+    dividers = max(1, min(total, int(round(math.sqrt(total / 4.0)))))
+    counts = split_count(total, dividers)
+    width = counts[0] * step + gap
+    height = (dividers + 1) * row
+
+    walls = []
+    for (i, n) in enumerate(counts):
+        (x0, x1) = (gap, width) if i % 2 == 0 else (0.0, width - gap)
+        y = (i + 1) * row
+        points = [(x0, y)]
+        for j in range(1, n):
+            points.append((x0 + (x1 - x0) * j / n, y + uniform(rng, -16, 16)))
+        points.append((x1, y))
+        walls.append(("divider%d" % i, points))
+
+    end_x = width - 10 if (dividers - 1) % 2 == 0 else 10.0
+    walls.append(("boundary", rectangle(0, 0, width, height)))
+    walls.append(("end", [(end_x, height - row + 10), (end_x, height - 10)]))
+    return (walls, (width - 30, row / 2))
+
+## The generators, by kind
+GENERATORS = {
+    'maze': maze_walls,
+    'caves': cave_walls,
+    'obstacles': obstacle_walls,
+    'corridors': corridor_walls,
+}
+
+## Generates the walls of a world
+#
+# @param kind The kind of world (a key of @ref GENERATORS)
+# @param n_segments The number of wall segments, at least @ref MIN_SEGMENTS
+# @param seed The random seed
+# @return A tuple (walls, pod) where walls is a list of (name, points) and
+# pod is the (x, y) start position
+def generate_world(kind, n_segments, seed=0):
+    if kind not in GENERATORS:
+        raise ValueError("Unknown world kind: " + str(kind))
+    if n_segments < MIN_SEGMENTS:
+        raise ValueError("A generated world needs at least %d segments" % MIN_SEGMENTS)
+    return GENERATORS[kind](int(n_segments), random.Random(seed))
+
+## Counts the segments of a list of walls
+#
+# @param walls A list of (name, points)
+# @return The number of segments
+def count_segments(walls):
+    return sum(len(points) - 1 for (name, points) in walls)
+
+## Writes a world file
+#
+# @param filename The file to write
+# @param walls A list of (name, points)
+# @param pod The (x, y) pod start position
+# @param comment A line of text written at the top of the file, or None
+# @return None
+#
+# The file is written to a temporary name and then renamed, so a reader never
+# sees a partly written world.
+def write_world(filename, walls, pod, comment=None):
+    temp = filename + '.tmp'
+    out = open(temp, 'w')
+    if comment != None:
+        out.write("# %s\n" % comment)
+    for (name, points) in walls:
+        out.write("wall %s\n" % name)
+        for first in range(0, len(points), 8):
+            out.write("\t" + ",".join("%.1f,%.1f" % point for point in points[first:first + 8]) + "\n")
+        out.write("\n")
+    out.write("# pod initial position\npod\n\t%.1f,%.1f\n" % pod)
+    out.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp, filename)
+
+## Finds (and if needed writes) a generated world file
+#
+# @param kind The kind of world
+# @param n_segments The number of wall segments
+# @param seed The random seed
+# @param directory The directory to write to (by default @ref WORLD_DIR)
+# @return The name of the world file, which is only written the first time.
+# The name includes @ref GENERATOR_VERSION, so files made by older generators
+# are not reused.
+def world_file(kind, n_segments, seed=0, directory=None):
+    if directory == None:
+        directory = WORLD_DIR
+    filename = os.path.join(directory, '%s-%d-%d-v%d.txt' % (kind, n_segments, seed, GENERATOR_VERSION))
+    if not os.path.exists(filename):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        (walls, pod) = generate_world(kind, n_segments, seed)
+        write_world(filename, walls, pod, "%s world: %d segments, seed %d" % (kind, n_segments, seed))
+    return filename
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a stress world file.')
+    parser.add_argument('kind', choices=sorted(GENERATORS), help='the kind of world')
+    parser.add_argument('segments', type=int, help='the number of wall segments (at least %d)' % MIN_SEGMENTS)
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('-o', '--output', help='the world file to write (default KIND-SEGMENTS-SEED.txt)')
+    args = parser.parse_args()
+
+    output = args.output or '%s-%d-%d.txt' % (args.kind, args.segments, args.seed)
+    (walls, pod) = generate_world(args.kind, args.segments, args.seed)
+    write_world(output, walls, pod, "%s world: %d segments, seed %d" % (args.kind, args.segments, args.seed))
+    print("%s: %d segments" % (output, count_segments(walls)))
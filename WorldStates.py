@@ -0,0 +1,199 @@
+## @package WorldStates
+# Contains the world snapshots used to save the full state of a simulation
+# part way through a run, restore it later and fork independent copies of it.
+#
+# A snapshot holds the world's tick count, the dynamic state of every pod
+# (see simulation.Pod.get_state() and PodBatches.PodBatch.get_state()) as one
+# flat float64 array, and the pods' brains and thruster instructions pickled
+# together, so controller state such as PDController.control and navigator
+# progress is saved too. The walls and spatial index are not saved: a
+# snapshot is restored in to the world it was taken from, or a fork of it.
+#
+# Running on from a restored snapshot gives exactly the same results as
+# running on from the point it was taken, so many what-if rollouts can be
+# branched from one expensive prefix instead of replaying it from tick 0.
+#
+# Example:
+#
+# snap = take_snapshot(world)
+# fork = fork_world(world, snap)
+# HeadlessSimulation(fork, dt).run(ticks=500)
+# restore_snapshot(world, snap)
+#
+# A brain may refer to objects that should not be copied, such as the painter
+# a Simulation draws. Passing them as shared to both take_snapshot() and
+# restore_snapshot() (in the same order) keeps them as they are.
+import io
+import pickle
+import struct
+
+import numpy as np
+
+from simulation import World
+
+## The first bytes of a serialised snapshot
+MAGIC = b'PWS1'
+
+## The version of the serialised format
+FORMAT_VERSION = 1
+
+## The header of a serialised snapshot: magic, version, ticks, number of
+# pods, length of the state array and length of the pickled brains
+HEADER = struct.Struct('<4sIqIqq')
+
+## The world attributes shared between a world and its forks
+STATIC_ATTRIBUTES = ('walls', 'rect', 'segs', 'seg_wall', 'index', 'pod_start', 'file_name', 'blind')
+
+## World Snapshot
+#
+# The state of a World at one tick, made by take_snapshot().
+class WorldSnapshot:
+    ## The WorldSnapshot constructor
+    #
+    # @param self The object pointer
+    # @param ticks The world's tick count
+    # @param sizes The length of each pod's state
+    # @param state A flat float64 array of every pod's state, in order
+    # @param brains The pickled brains and thruster instructions
+    def __init__(self, ticks, sizes, state, brains):
+        ## The world's tick count
+        self.ticks = ticks
+        ## The length of each pod's state
+        self.sizes = [int(size) for size in sizes]
+        ## A flat float64 array of every pod's state, in order
+        self.state = state
+        ## The pickled brains and thruster instructions
+        self.brains = brains
+
+    ## Serialises the snapshot
+    #
+    # @param self The object pointer
+    # @return A bytes object holding the header, the pod state sizes, the pod
+    # state and the pickled brains
+    def to_bytes(self):
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, self.ticks, len(self.sizes), len(self.state), len(self.brains))
+        sizes = np.asarray(self.sizes, dtype='<i8').tobytes()
+        return header + sizes + np.asarray(self.state, dtype='<f8').tobytes() + self.brains
+
+## Loads a serialised snapshot
+#
+# @param data A bytes object made by WorldSnapshot.to_bytes()
+# @return A WorldSnapshot
+def snapshot_from_bytes(data):
+    (magic, version, ticks, n_pods, n_state, n_brains) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a version %d world snapshot" % FORMAT_VERSION)
+    first = HEADER.size
+    sizes = np.frombuffer(data, dtype='<i8', count=n_pods, offset=first)
+    first += 8 * n_pods
+    state = np.frombuffer(data, dtype='<f8', count=n_state, offset=first).astype(np.float64)
+    first += 8 * n_state
+    brains = data[first:first + n_brains]
+    if len(brains) != n_brains:
+        raise ValueError("The world snapshot is truncated")
+    return WorldSnapshot(int(ticks), sizes, state, bytes(brains))
+
+## Snapshot Pickler
+#
+# Pickles the brains, replacing the world, its pods and the shared objects
+# with references so that they are not copied.
+class SnapshotPickler(pickle.Pickler):
+    ## The SnapshotPickler constructor
+    #
+    # @param self The object pointer
+    # @param file The file to write to
+    # @param world The World the brains belong to
+    # @param shared The list of objects kept by reference
+    def __init__(self, file, world, shared):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.refs = {id(world): ('world', 0)}
+        for (i, pod) in enumerate(world.pods):
+            self.refs[id(pod)] = ('pod', i)
+        for (i, obj) in enumerate(shared):
+            self.refs[id(obj)] = ('shared', i)
+
+    ## Finds the reference for an object
+    #
+    # @param self The object pointer
+    # @param obj The object being pickled
+    # @return The reference, or None to pickle the object
+    def persistent_id(self, obj):
+        return self.refs.get(id(obj))
+
+## Snapshot Unpickler
+#
+# Unpickles the brains, replacing the references made by SnapshotPickler with
+# the world being restored, its pods and the shared objects.
+class SnapshotUnpickler(pickle.Unpickler):
+    ## The SnapshotUnpickler constructor
+    #
+    # @param self The object pointer
+    # @param file The file to read from
+    # @param world The World being restored
+    # @param shared The list of objects kept by reference
+    def __init__(self, file, world, shared):
+        pickle.Unpickler.__init__(self, file)
+        self.refs = {'world': [world], 'pod': world.pods, 'shared': shared}
+
+    ## Finds the object for a reference
+    #
+    # @param self The object pointer
+    # @param pid The reference
+    # @return The object
+    def persistent_load(self, pid):
+        (kind, i) = pid
+        return self.refs[kind][i]
+
+## Takes a snapshot of a world
+#
+# @param world The World
+# @param shared A list of objects the brains refer to that are kept by
+# reference rather than copied
+# @return A WorldSnapshot
+def take_snapshot(world, shared=()):
+    states = [np.asarray(pod.get_state(), dtype=np.float64) for pod in world.pods]
+    buf = io.BytesIO()
+    SnapshotPickler(buf, world, shared).dump([(pod.brain, pod.control) for pod in world.pods])
+    state = np.concatenate(states) if len(states) > 0 else np.zeros(0)
+    return WorldSnapshot(world.ticks, [len(values) for values in states], state, buf.getvalue())
+
+## Restores a snapshot in to a world
+#
+# @param world The World the snapshot was taken from, or a fork of it
+# @param snap The WorldSnapshot
+# @param shared The list of shared objects passed to take_snapshot()
+# @return None
+#
+# Every pod gets a fresh copy of its brain and thruster instructions, so the
+# snapshot can be restored again later.
+def restore_snapshot(world, snap, shared=()):
+    sizes = [len(pod.get_state()) for pod in world.pods]
+    if sizes != snap.sizes:
+        raise ValueError("The world's pods do not match the snapshot")
+
+    first = 0
+    for (pod, size) in zip(world.pods, sizes):
+        pod.set_state(snap.state[first:first + size], world)
+        first += size
+    brains = SnapshotUnpickler(io.BytesIO(snap.brains), world, list(shared)).load()
+    for (pod, (brain, control)) in zip(world.pods, brains):
+        pod.brain = brain
+        pod.control = control
+    world.ticks = snap.ticks
+
+## Forks a world
+#
+# @param world The World
+# @param snap The WorldSnapshot to start the fork from, or None to start from
+# the world's current state
+# @param shared The list of objects kept by reference (see take_snapshot())
+# @return A new World holding forks of the pods, sharing the walls and
+# spatial index with the original
+def fork_world(world, snap=None, shared=()):
+    if snap == None:
+        snap = take_snapshot(world, shared)
+    fork = World(None, [pod.fork() for pod in world.pods])
+    for name in STATIC_ATTRIBUTES:
+        setattr(fork, name, getattr(world, name))
+    restore_snapshot(fork, snap, shared)
+    return fork
@@ -1,6 +1,16 @@
+import copy
+import numpy as np
 import pygame as pg
+import threading
+import time
 from math import *
 
+from RayCasting import SegmentArray
+from RayCasting import hint_bounds
+from RayCasting import pack_segments
+from SpatialIndex import SegmentBVH
+from SpatialIndex import UniformGrid
+
 #
 # 24/10/2010
 #    set CarPod dangdt
@@ -12,6 +22,8 @@ white = (255,255,255)
 red=(255,40,40)
 huge=1e6
 small=1e-6
+# worlds with more wall segments than this get a UniformGrid index
+grid_min_segments=256
 
 def rotate_poly(poly,ang,pos):
     ret=[]
@@ -81,7 +93,22 @@ class Control:
         self.down=limit(self.down,0,1)
         self.left=limit(self.left,0,1)
 
+# a sensor's val or wall, found on the class once Pod.update_sensors has
+# removed it from the sensor, so the ray is only cast when it is read
+class UnreadSensorField(object):
+    def __init__(self,name):
+        self.name=name
+
+    def __get__(self,sensor,owner):
+        if sensor == None:
+            return self
+        sensor.pod.cast_sensor(sensor)
+        return sensor.__dict__[self.name]
+
 class Sensor:
+    val=UnreadSensorField('val')
+    wall=UnreadSensorField('wall')
+
     def __init__(self,ang_ref,range,name):
         self.ang_ref=ang_ref
         self.ang=ang_ref
@@ -90,11 +117,23 @@ class Sensor:
         # self.val=0
         self.wall="None"
         self.name=name
+        self.pod=None
+        self.seg=-1
 
     def to_string(self):
 
         return str(int(self.val*self.range))
 
+# casts every unread ray of a list of sensors in one batch per pod, for
+# consumers that read all of them
+def resolve_sensors(sensors):
+    last=None
+    for sensor in sensors:
+        pod=sensor.__dict__.get('pod')
+        if pod is not last and pod != None:
+            pod.resolve_sensors()
+            last=pod
+
 class State:
 
     def __init__(self,pod):
@@ -130,36 +169,49 @@ class Wall:
             y2=points[i+3]
             self.segments.append((x1 ,y1, x2, y2))
 
-            if self.maxX < x1:
-                self.maxX=x1
-            if self.minX>x1:
-                self.minX=x1
-            if self.maxY < y1:
-                self.maxY=y1
-            if self.minY>y1:
-                self.minY=y1
+            self.maxX=max(self.maxX,x1,x2)
+            self.minX=min(self.minX,x1,x2)
+            self.maxY=max(self.maxY,y1,y2)
+            self.minY=min(self.minY,y1,y2)
 
             i += 2
 
+        self.update_rect()
 
+    def update_rect(self):
+        # tolerance hits can lie just outside the bounding box
+        self.pad=small*(self.maxX-self.minX+self.maxY-self.minY+1)
         self.rect=pg.Rect(self.minX,self.minY,self.maxX-self.minX,self.maxY-self.minY)
 
+    # True if the box round p0-p1 (grown by pad) misses the wall's box
+    def misses(self,p0_x,p0_y,p1_x,p1_y,pad):
+        pad += self.pad
+        return (max(p0_x,p1_x)+pad < self.minX or min(p0_x,p1_x)-pad > self.maxX or
+                max(p0_y,p1_y)+pad < self.minY or min(p0_y,p1_y)-pad > self.maxY)
+
 
 
 class World:
 
-    def __init__(self,fileName,pods):
+    def __init__(self,fileName,pods,index="auto"):
 
         self.pods=pods
         self.walls=[]
-        fin=open(fileName,"r")
         self.rect=pg.Rect(0,0,0,0)
         self.ticks=0
         self.blind=False
+        self.index=None
+        self.pod_start=(0,0)
+        self.file_name=fileName
+        self.profiler=None      # see Profiling
+        if fileName == None:    # empty world, filled in by WorldCache.load_world
+            return
+
+        fin=open(fileName,"r")
         while True:
             line = fin.readline()
             if len(line)==0:
-                return
+                break
             if line[0] == '#':
                 continue
                 
@@ -177,21 +229,58 @@ class World:
 
                 # print "POD OK"
 
+        fin.close()
+        (self.segs,self.seg_wall)=pack_segments(self.walls)
+        self.index=self.build_index(index)
+
+    def pick_index(self,index):
+        if index == "auto":
+            if len(self.segs) > grid_min_segments:
+                return "grid"
+            return "brute"
+        return index
+
+    def build_index(self,index):
+        index=self.pick_index(index)
+        if index == "brute":
+            return SegmentArray(self.segs,small)
+        elif index == "grid":
+            return UniformGrid(self.segs,small)
+        elif index == "bvh":
+            return SegmentBVH(self.segs,self.seg_wall,small)
+        elif index != None:
+            raise ValueError("Unknown world index: "+str(index))
+        return None
+
     def read_pod_pos(self,fin):
         line = fin.readline()
         linelist=line.split(',')
 
         x = float(linelist[0])
         y = float(linelist[1])
-        
+        self.place_pods(x,y)
+
+    def place_pods(self,x,y):
+        self.pod_start=(x,y)
         for pod in self.pods:
-            pod.x=x
-            pod.y=y
+            pod.place(x,y)
+
+    def wall_of(self,seg):
+        if seg < 0:
+            return None
+        return self.walls[self.seg_wall[seg]]
 
     def find_closest_intersect(self,p0_x,p0_y,p1_x,p1_y):
+        if self.index != None:
+            (t,seg)=self.index.closest_intersect(p0_x,p0_y,p1_x,p1_y)
+            return (t,self.wall_of(seg))
+
         tMin=2
         wallMin=None
+        pad=small*(abs(p1_x-p0_x)+abs(p1_y-p0_y))
         for wall in self.walls:
+            if wall.misses(p0_x,p0_y,p1_x,p1_y,pad):
+                continue
             for seg in wall.segments:
                 p2_x=seg[0]
                 p2_y=seg[1]
@@ -205,15 +294,44 @@ class World:
                         wallMin=wall
 
         return (tMin,wallMin)
-        return
 
+    # casts a fan of rays from one point, returns a list of (t,wall)
+    def find_closest_intersects(self,p0_x,p0_y,p1_xs,p1_ys):
+        if self.index == None:
+            return [self.find_closest_intersect(p0_x,p0_y,p1_x,p1_y) for (p1_x,p1_y) in zip(p1_xs,p1_ys)]
+
+        (ts,segs)=self.index.closest_intersects(p0_x,p0_y,p1_xs,p1_ys)
+        return [(t,self.wall_of(seg)) for (t,seg) in zip(ts.tolist(),segs.tolist())]
 
 
+    # batched queries (used by PodBatches), return arrays of segment indices
+    # last holds the segment each ray hit last time (or -1), the search
+    # stops at its distance if the ray still hits it
+    def cast_rays(self,p0_x,p0_y,p1_x,p1_y,last=None):
+        if last is None:
+            return self.query_index().closest_intersects(p0_x,p0_y,p1_x,p1_y)
+        t_max=hint_bounds(self.segs,p0_x,p0_y,p1_x,p1_y,last,small)
+        return self.query_index().closest_intersects(p0_x,p0_y,p1_x,p1_y,t_max)
+
+    def check_collisions(self,p0_x,p0_y,p1_x,p1_y):
+        return self.query_index().first_collisions(p0_x,p0_y,p1_x,p1_y)
+
+    def query_index(self):
+        if self.index == None:
+            return SegmentArray(self.segs,small)
+        return self.index
+
     def check_collide_with_wall(self,p0_x,p0_y,p1_x,p1_y):
         if p0_x==p1_x and p1_y==p0_y:
             return None
 
+        if self.index != None:
+            return self.wall_of(self.index.first_collision(p0_x,p0_y,p1_x,p1_y))
+
+        pad=small*(abs(p1_x-p0_x)+abs(p1_y-p0_y))
         for wall in self.walls:
+            if wall.misses(p0_x,p0_y,p1_x,p1_y,pad):
+                continue
             for seg in wall.segments:
                 p2_x=seg[0]
                 p2_y=seg[1]
@@ -228,11 +346,24 @@ class World:
 
     def step(self,dt):
         self.ticks += 1
+        profiler=self.profiler
+        if profiler != None:
+            profiler.ticks += 1
         for pod in self.pods:
+            if profiler != None:
+                profiler.push('physics')
             pod.step(dt,self)
             pod.update_sensors(self)
+            if profiler != None:
+                profiler.pop()
 
     def draw(self,screen):
+        self.draw_static(screen)
+        self.draw_dynamic(screen)
+
+    # the walls, which Simulation draws once and caches
+    def draw_static(self,screen):
+        rects=[]
         if not self.blind:
          for wall in self.walls:
                 if "start" in wall.name:
@@ -243,10 +374,17 @@ class World:
                     col=(0,0,255)
 
                 for seg in wall.segments:
-                    pg.draw.line(screen,col,(seg[0],seg[1]),(seg[2],seg[3]),6)
-
-        for pod in self.pods:
-            pod.draw(screen)
+                    rects.append(pg.draw.line(screen,col,(seg[0],seg[1]),(seg[2],seg[3]),6))
+        return rects
+
+    # the pods (or snapshots of them), returns a list of the rects drawn over
+    def draw_dynamic(self,screen,pods=None):
+        if pods == None:
+            pods=self.pods
+        rects=[]
+        for pod in pods:
+            rects.append(pod.draw(screen))
+        return rects
 
 #        fontobject = pg.font.Font(None,20)
 #        message=" Ticks: " + str(self.ticks)
@@ -258,6 +396,7 @@ class Pod:
     thrust_poly_ref=[(0,-10),(-2,-14),(0,-18),(2,-14)]
     left_poly_ref=[(-5,5),(-9,4),(-12,5),(-9,6)]
     right_poly_ref=[(5,5),(9,4),(12,5),(9,6)]
+    state_fields=('x','y','dxdt','dydt','ang','dangdt','vel','collide','collide_count')
 
     def __init__(self,nSensor,sensorRange,brain,col):
         self.col=col
@@ -273,25 +412,75 @@ class Pod:
         self.collide_count=0
         self.sensors=[]
         self.control=Control()
-        for i in range(nSensor):
-            ang_ref=i*pi*2/nSensor
-            self.sensors.append(Sensor(ang_ref,sensorRange,"sensor"+str(i)))
+        self.sensor_range=sensorRange
+        self.sensor_world=None
+        self.sensor_pos=(0,0)
+        self.set_sensor_layout([i*pi*2/nSensor for i in range(nSensor)])
+
+    # replaces the sensors with one at each angle (see SensorLayouts)
+    def set_sensor_layout(self,angles):
+        self.sensors=[]
+        for (i,ang_ref) in enumerate(angles):
+            sensor=Sensor(ang_ref,self.sensor_range,"sensor"+str(i))
+            sensor.pod=self
+            self.sensors.append(sensor)
 
+    def place(self,x,y):
+        self.x=x
+        self.y=y
+
+    # marks the sensors as unread, the rays are cast by cast_sensor or
+    # resolve_sensors when a sensor is first read this tick
     def update_sensors(self,world):
+        self.sensor_world=world
+        self.sensor_pos=(self.x,self.y)
         for sensor in self.sensors:
-            ang=sensor.ang_ref+self.ang
-            sensor.ang=ang
-            (s,wall)=world.find_closest_intersect(self.x,self.y,self.x+sensor.range*sin(ang),self.y+sensor.range*cos(ang))
+            sensor.ang=sensor.ang_ref+self.ang
+            fields=sensor.__dict__
+            if 'val' in fields:
+                del fields['val']
+                del fields['wall']
+
+    # casts from the position at the last update, each search stops at the
+    # segment the ray hit last time if it still hits it
+    def cast_sensors(self,sensors):
+        world=self.sensor_world
+        profiler=world.profiler
+        if profiler != None:
+            profiler.push('sensors')
+        (x,y)=self.sensor_pos
+        xs=[x+sensor.range*sin(sensor.ang) for sensor in sensors]
+        ys=[y+sensor.range*cos(sensor.ang) for sensor in sensors]
+        if world.index == None:
+            hits=world.find_closest_intersects(x,y,xs,ys)
+        else:
+            (ts,segs)=world.cast_rays(x,y,np.array(xs),np.array(ys),[sensor.seg for sensor in sensors])
+            segs=segs.tolist()
+            hits=[(t,world.wall_of(seg)) for (t,seg) in zip(ts.tolist(),segs)]
+            for (sensor,seg) in zip(sensors,segs):
+                sensor.seg=seg
+
+        for (sensor,(s,wall)) in zip(sensors,hits):
             sensor.val=s*sensor.range
             if wall == None:
                 sensor.wall=None
             else:
                 sensor.wall=wall.name
+        if profiler != None:
+            profiler.pop()
+
+    def cast_sensor(self,sensor):
+        self.cast_sensors([sensor])
 
+    def resolve_sensors(self):
+        unread=[sensor for sensor in self.sensors if 'val' not in sensor.__dict__]
+        if len(unread) > 0:
+            self.cast_sensors(unread)
 
+    # returns the rect drawn over
     def draw(self,screen):
-        self.draw_sensors(screen)
-        self.draw_pod(screen)
+        rect=self.draw_sensors(screen)
+        return rect.union(self.draw_pod(screen))
 
     def draw_pod(self, screen):
         if self.collide:
@@ -303,19 +492,24 @@ class Pod:
             self.collide_count -= 1
         else:
             col=self.col
-        pg.draw.polygon(screen,col,outline)
+        rect=pg.draw.polygon(screen,col,outline)
         if self.control.up > 0.0:
             outline=rotate_poly(self.thrust_poly_ref, self.ang, self)
-            pg.draw.polygon(screen,red,outline)
+            rect.union_ip(pg.draw.polygon(screen,red,outline))
         if self.control.left > 0.0:
             outline=rotate_poly(self.left_poly_ref, self.ang, self)
-            pg.draw.polygon(screen,red,outline)
+            rect.union_ip(pg.draw.polygon(screen,red,outline))
         if self.control.right > 0.0:
             outline=rotate_poly(self.right_poly_ref, self.ang, self)
-            pg.draw.polygon(screen,red,outline)
+            rect.union_ip(pg.draw.polygon(screen,red,outline))
+        return rect
 
 
+    # the rays are drawn from the pod's pose, which Simulation.draw moves
+    # between ticks, at the lengths cast at the last tick
     def draw_sensors(self,screen):
+        self.resolve_sensors()
+        rect=pg.Rect(self.x,self.y,0,0)
         for sensor in self.sensors:
             wallName=sensor.wall
             if wallName== None:
@@ -328,11 +522,56 @@ class Pod:
             dist=sensor.val
             
             p1=(self.x,self.y)
-            p2=(self.x+dist*sin(sensor.ang),self.y+dist*cos(sensor.ang))
-            pg.draw.line(screen,col,p1,p2,1)
+            ang=sensor.ang_ref+self.ang
+            p2=(self.x+dist*sin(ang),self.y+dist*cos(ang))
+            rect.union_ip(pg.draw.line(screen,col,p1,p2,1))
+        return rect
+
+    # the dynamic state as a flat list of floats (see WorldStates), the
+    # thrusters and the brain are saved separately
+    def get_state(self):
+        values=[float(getattr(self,name)) for name in self.state_fields]
+        values.append(float(self.sensor_world != None))
+        values.extend(self.sensor_pos)
+        return values
+
+    # restores get_state's values, the sensors are cast again when read
+    def set_state(self,values,world):
+        n=len(self.state_fields)
+        for (name,value) in zip(self.state_fields,values):
+            setattr(self,name,float(value))
+        self.collide=bool(self.collide)
+        self.collide_count=int(self.collide_count)
+        for sensor in self.sensors:
+            sensor.seg=-1
+        if values[n]:
+            self.update_sensors(world)
+            self.sensor_pos=(float(values[n+1]),float(values[n+2]))
+        else:
+            self.sensor_world=None
+            self.sensor_pos=(0,0)
+            for sensor in self.sensors:
+                sensor.ang=sensor.ang_ref
+                sensor.val=0
+                sensor.wall="None"
+
+    # a copy with its own sensors, for World forks
+    def fork(self):
+        pod=copy.copy(self)
+        pod.set_sensor_layout([sensor.ang_ref for sensor in self.sensors])
+        return pod
+
+    # a copy that can be drawn while the pod steps on
+    def snapshot(self):
+        self.resolve_sensors()
+        snap=copy.copy(self)
+        snap.sensors=[copy.copy(sensor) for sensor in self.sensors]
+        snap.control=copy.copy(self.control)
+        return snap
 
 
 class CarPod(Pod):
+    state_fields=Pod.state_fields+('slip',)
  
     def __init__(self,nSensor,sensorRange,brain,col):
         Pod.__init__(self,nSensor,sensorRange,brain,col)
@@ -460,6 +699,59 @@ class SimplePod(Pod):
             self.collide=True
 
 
+# statistics returned by HeadlessSimulation.run
+class RunStats:
+
+    def __init__(self):
+        self.ticks=0
+        self.sim_time=0.0
+        self.wall_time=0.0
+        self.collisions=0       # pod ticks spent against a wall
+        self.stopped=False      # True if the until predicate ended the run
+
+    def ticks_per_sec(self):
+        if self.wall_time <= 0:
+            return 0.0
+        return self.ticks/self.wall_time
+
+    def __str__(self):
+        return "%d ticks (%.1f s simulated) in %.3f s, %.0f ticks/s, %d collisions" % (
+            self.ticks,self.sim_time,self.wall_time,self.ticks_per_sec(),self.collisions)
+
+
+# Steps a world as fast as possible with no display, clock or event loop.
+# Brains must not read the keyboard (pygame is never initialised).
+class HeadlessSimulation:
+
+    def __init__(self,world,dt):
+        self.dt=dt
+        self.world=world
+
+    # runs for ticks steps, or until until(world) returns True (or both)
+    def run(self,ticks=None,until=None):
+        if ticks == None and until == None:
+            raise ValueError("HeadlessSimulation.run needs ticks or until")
+
+        stats=RunStats()
+        world=self.world
+        dt=self.dt
+        start=time.time()
+
+        while ticks == None or stats.ticks < ticks:
+            world.step(dt)
+            stats.ticks += 1
+            for pod in world.pods:
+                stats.collisions += int(np.count_nonzero(pod.collide))
+
+            if until != None and until(world):
+                stats.stopped=True
+                break
+
+        stats.wall_time=time.time()-start
+        stats.sim_time=stats.ticks*dt
+        return stats
+
+
 class Simulation:
 
     def __init__(self,world,dt):
@@ -470,7 +762,6 @@ class Simulation:
         self.world = world
         dim_world = (self.world.rect.width+20, self.world.rect.height+20)
         self.frameskipfactor=1
-        self.frameskipcount=1
         self.painter=None
         self.screen = pg.Surface(dim_world) #
 
@@ -491,48 +782,248 @@ class Simulation:
         self.display = pg.display.set_mode(self.dim_window)
         pg.display.set_caption('PodSim (press escape to exit)')
 
+        # the walls are drawn once, black is transparent so they can be
+        # blitted over the painter's preDraw output
+        self.walls=pg.Surface(dim_world).convert()
+        self.walls.fill((0,0,0))
+        self.world.draw_static(self.walls)
+        self.walls.set_colorkey((0,0,0))
+        self.dirty=None         # rects drawn over last frame, None for all
+
+        self.speed=1.0          # simulated seconds per real second
+        self.max_speed=False    # step flat out, drawing render_fps frames a second
+        self.render_fps=60
+        self.interpolate=True   # draw the pods between their last two poses
+        self.max_lag=0.25       # most real time caught up after a slow frame
+        self.prev_poses=None
+        self.threaded=False     # step the physics on a worker thread
+
+    # physics steps at dt to keep up with the clock (times rate()) and the
+    # display is drawn at up to render_fps, between the last two steps.
+    # frameskipfactor 0 turns the display off.
     def run(self):
+        if self.threaded and self.frameskipfactor != 0:
+            self.run_threaded()
+            return
 
         clock = pg.time.Clock()
-        frameRate=1.0/self.dt/self.slowMotionFactor
+        lag=0.0
+        last=time.time()
 
        # the event loop also loops the animation code
         while True:
 
-            self.frameskipcount -= 1
+            pg.event.pump()
+            keyinput = pg.key.get_pressed()
+
+            if keyinput[pg.K_ESCAPE] or pg.event.peek(pg.QUIT):
+                pg.display.quit()
+                break
+                # raise SystemExit
 
-            display= self.frameskipcount == 0 and self.frameskipfactor != 0
+            display=self.frameskipfactor != 0
+            now=time.time()
+            if self.max_speed or not display:
+                end=now+1.0/self.render_fps
+                self.step()
+                while time.time() < end:
+                    self.step()
+                lag=0.0
+                alpha=1.0
+            else:
+                lag += min(now-last,self.max_lag)*self.rate()
+                while lag >= self.dt:
+                    self.step()
+                    lag -= self.dt
+                alpha=lag/self.dt
+            last=now
 
             if display:
-                clock.tick(frameRate)
-                self.frameskipcount=self.frameskipfactor
+                self.draw(alpha)
+                clock.tick(self.render_fps)
+
+    # simulated seconds per real second. a frameskipfactor above 1 used to
+    # draw every Nth step, running N times faster, so it still multiplies the
+    # speed
+    def rate(self):
+        return self.speed*max(self.frameskipfactor,1)/self.slowMotionFactor
+
+    def step(self):
+        self.prev_poses=[pose_of(pod) for pod in self.world.pods]
+        self.world.step(self.dt)
+
+    # the physics runs on a worker thread, which publishes snapshots of the
+    # pods and the painter after the first step following each request. this
+    # thread draws the latest one while the next steps run (no interpolation)
+    # and keeps the collide_counts, which only drawing changes, to itself
+    def run_threaded(self):
+        self.stopping=threading.Event()
+        self.wanted=threading.Event()
+        self.wanted.set()
+        self.lock=threading.Lock()
+        self.front=None         # latest snapshot, None once drawn
+        self.error=None
+        worker=threading.Thread(target=self.physics_loop)
+        worker.daemon=True
+        worker.start()
+
+        clock = pg.time.Clock()
+        counts=None
+        while worker.is_alive():
 
             pg.event.pump()
             keyinput = pg.key.get_pressed()
 
             if keyinput[pg.K_ESCAPE] or pg.event.peek(pg.QUIT):
-                pg.display.quit()
                 break
-                # raise SystemExit
 
+            self.lock.acquire()
+            (snapshot,self.front)=(self.front,None)
+            self.lock.release()
+            if snapshot != None:
+                (pods,painter)=snapshot
+                if counts != None:
+                    for (pod,count) in zip(pods,counts):
+                        pod.collide_count=count
+                self.render(pods,painter)
+                counts=[pod.collide_count for pod in pods]
+                self.wanted.set()
+            clock.tick(self.render_fps)
+
+        self.stopping.set()
+        worker.join()
+        pg.display.quit()
+        if self.error != None:
+            raise self.error
+
+    def physics_loop(self):
+        try:
+            lag=0.0
+            last=time.time()
+            while not self.stopping.is_set():
+                now=time.time()
+                rate=self.rate()
+                ticks=self.world.ticks
+                if self.max_speed:
+                    self.world.step(self.dt)
+                else:
+                    lag += min(now-last,self.max_lag)*rate
+                    if lag < self.dt:
+                        time.sleep(min((self.dt-lag)/rate,0.01))
+                    while lag >= self.dt:
+                        self.world.step(self.dt)
+                        lag -= self.dt
+                last=now
+
+                if self.world.ticks != ticks and self.wanted.is_set():
+                    self.wanted.clear()
+                    self.lock.acquire()
+                    self.front=([pod.snapshot() for pod in self.world.pods],copy.copy(self.painter))
+                    self.lock.release()
+        except Exception as e:
+            self.error=e
+
+    # draws the pods alpha of the way from their previous pose to their
+    # current one
+    def draw(self,alpha=1.0):
+        pods=self.world.pods
+        poses=None
+        if self.interpolate and alpha < 1 and self.prev_poses != None and len(self.prev_poses) == len(pods):
+            poses=[pose_of(pod) for pod in pods]
+            for (pod,prev,pose) in zip(pods,self.prev_poses,poses):
+                set_pose(pod,[a+alpha*(b-a) for (a,b) in zip(prev,pose)])
+
+        self.render()
+
+        if poses != None:
+            for (pod,pose) in zip(pods,poses):
+                set_pose(pod,pose)
+
+    # redraws the parts of the screen drawn over last frame or this frame and
+    # updates them on the display, drawing pods and the painter (or snapshots
+    # of them)
+    def render(self,pods=None,painter=None):
+        if painter == None:
+            painter=self.painter
+        screen=self.screen
+        old=self.dirty
+        if old == None:
+            screen.fill((0,0,0))
+        else:
+            for rect in old:
+                screen.fill((0,0,0),rect)
 
-            self.world.step(self.dt)
-            if display:
-                self.screen.fill((0,0,0))
-                
-                if self.painter != None:
-                    if self.painter.preDraw != None:
-                        self.painter.preDraw(self.screen)
-                    
-                self.world.draw(self.screen)
-                
-           
-                
-                if self.painter != None:
-                    if self.painter.postDraw != None:
-                        self.painter.postDraw(self.screen)
-                
-                zz=pg.transform.scale(self.screen,self.dim_window)
-                self.display.blit(zz,(0,0))
-                pg.display.flip()
-            
+        new=[]
+        if painter != None:
+            if painter.preDraw != None:
+                new=add_rects(new,painter.preDraw(screen))
+
+        if old == None or new == None:
+            screen.blit(self.walls,(0,0))
+        else:
+            for rect in old+new:
+                screen.blit(self.walls,rect,rect)
+
+        new=add_rects(new,self.world.draw_dynamic(screen,pods))
+
+        if painter != None:
+            if painter.postDraw != None:
+                new=add_rects(new,painter.postDraw(screen))
+
+        if old == None or new == None:
+            self.present(None)
+        else:
+            self.present(old+new)
+        self.dirty=new
+
+    # copies rects of the screen (all of it if None) to the display, when the
+    # window is scaled a rect's edges can land a pixel away from where a full
+    # rescale would put them
+    def present(self,rects):
+        if rects == None:
+            zz=pg.transform.scale(self.screen,self.dim_window)
+            self.display.blit(zz,(0,0))
+            pg.display.flip()
+            return
+
+        bounds=self.screen.get_rect()
+        rects=[rect.inflate(4,4).clip(bounds) for rect in rects]
+        if sum([rect.width*rect.height for rect in rects]) >= bounds.width*bounds.height:
+            self.present(None)
+            return
+
+        sx=self.dim_window[0]/float(bounds.width)
+        sy=self.dim_window[1]/float(bounds.height)
+        updates=[]
+        for rect in rects:
+            if rect.width == 0 or rect.height == 0:
+                continue
+            if sx == 1 and sy == 1:
+                self.display.blit(self.screen,rect,rect)
+                updates.append(rect)
+                continue
+            x0=int(rect.left*sx)
+            y0=int(rect.top*sy)
+            target=pg.Rect(x0,y0,int(ceil(rect.right*sx))-x0,int(ceil(rect.bottom*sy))-y0)
+            zz=pg.transform.scale(self.screen.subsurface(rect),target.size)
+            self.display.blit(zz,target)
+            updates.append(target)
+        pg.display.update(updates)
+
+# copies the pose of a pod or pod batch
+def pose_of(pod):
+    if isinstance(pod.x,np.ndarray):
+        return (pod.x.copy(),pod.y.copy(),pod.ang.copy())
+    return (pod.x,pod.y,pod.ang)
+
+def set_pose(pod,pose):
+    (pod.x,pod.y,pod.ang)=pose
+
+# adds the rects a draw function returned (a rect, a list or None for
+# everything) to a list, None stays None
+def add_rects(rects,drawn):
+    if rects == None or drawn == None:
+        return None
+    if isinstance(drawn,pg.Rect):
+        return rects+[drawn]
+    return rects+list(drawn)